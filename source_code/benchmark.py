@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import math
+import shutil
+import logging
+import argparse
+import itertools
+import statistics
+import subprocess
+import tempfile
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# File the joins append their JSON records to, inside their working directory
+METRICS_FILE = "results.jsonl"
+
+# Join strategies: script, argument lists of the runs (one per direction), and whether the script
+# writes to the databases (it then gets its own copy so the other strategies see the original files)
+STRATEGIES = {
+    'single_pass_hash_join': ('joins/single_pass_hash_join.py', [[], ['--invert_join=True']], False),
+    'pipeline_hash_join': ('joins/pipeline_hash_join.py', [[], ['--invert_join=True']], False),
+    'semi_join': ('joins/semi_join.py', [[], ['--invert_join=True']], False),
+    'bloom_join': ('joins/bloom_join.py', [[], ['--invert_join=True']], False),
+    'grace_hash_join': ('joins/grace_hash_join.py', [[], ['--invert_join=True']], False),
+    'xjoin': ('joins/xjoin.py', [[], ['--invert_join=True']], False),
+    'parallel_hash_join': ('joins/parallel_hash_join.py', [[], ['--invert_join=True']], False),
+    'distributed_join': ('joins/distributed_join.py', [[], ['--invert_join=True']], False),
+    'columnar_join': ('joins/columnar_join.py', [[], ['--invert_join=True']], False),
+    'sort_merge_join': ('joins/sort_merge_join.py', [[], ['--invert_join=True']], False),
+    'sql_pushdown_join': ('joins/sql_pushdown_join.py', [[], ['--invert_join=True']], True),
+    'cost_based_join': ('joins/cost_based_join.py', [[]], False),
+}
+
+# Metrics compared against the baseline, with the smallest absolute growth that counts. A result regresses
+# when it exceeds the baseline both by more than the tolerance and by more than this floor, so that the
+# noise of runs of a few milliseconds or of a few pages of memory is not flagged.
+REGRESSION_METRICS = {'median_seconds': 0.005, 'peak_rss_bytes': 1024 * 1024}
+
+# Nearest-rank percentile of a list of numbers
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+# Generate the two databases of one dataset with create_dbs.py
+def create_dataset(dbs_directory, num_of_employees, overlap_ratio, avg_projects_per_department, key_skew, random_seed, extra_args):
+    cmd = [sys.executable, os.path.join(SCRIPT_DIRECTORY, 'databases/create_dbs.py'), '--dbs_directory', dbs_directory,
+           '--num_of_employees', str(num_of_employees), '--overlap_ratio', str(overlap_ratio),
+           '--avg_projects_per_department', str(avg_projects_per_department), '--key_skew', str(key_skew),
+           '--random_seed', str(random_seed)] + extra_args
+    subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return os.path.join(dbs_directory, 'database1.db'), os.path.join(dbs_directory, 'database2.db')
+
+# Run a join script once in its own interpreter and return the JSON records it appended
+def run_once(script, args, run_directory, db1_path, db2_path, max_days_diff, sink):
+    metrics_path = os.path.join(run_directory, METRICS_FILE)
+    offset = os.path.getsize(metrics_path) if os.path.exists(metrics_path) else 0
+    cmd = [sys.executable, os.path.join(SCRIPT_DIRECTORY, script), '--db1', db1_path, '--db2', db2_path,
+           '--max_days_diff', str(max_days_diff), '--sink', sink] + args
+    result = subprocess.run(cmd, cwd=run_directory, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{script} {' '.join(args)} failed: {result.stderr}")
+    with open(metrics_path) as file:
+        file.seek(offset)
+        return [json.loads(line) for line in file if line.strip()]
+
+# Median/p95 time, peak memory and time to first row of the repetitions of one join
+def summarize(records):
+    seconds = [record['total_seconds'] for record in records]
+    first_rows = [record['time_to_first_row'] for record in records if record['time_to_first_row'] is not None]
+    return {
+        'repetitions': len(records),
+        'rows': records[0]['rows'],
+        'median_seconds': statistics.median(seconds),
+        'p95_seconds': percentile(seconds, 0.95),
+        'median_time_to_first_row': statistics.median(first_rows) if first_rows else None,
+        'median_rows_per_second': statistics.median(record['rows_per_second'] for record in records),
+        'peak_rss_bytes': max(record['peak_rss_bytes'] for record in records),
+    }
+
+# Identity of a result row, used to match it with the baseline
+def result_key(result):
+    return (result['num_of_employees'], result['overlap_ratio'], result['avg_projects_per_department'],
+            result.get('key_skew', 0.0), result['max_days_diff'], result['name'])
+
+# Compare results with a baseline and return the regressions
+def find_regressions(results, baseline, tolerance, min_regression_seconds=REGRESSION_METRICS['median_seconds']):
+    floors = dict(REGRESSION_METRICS, median_seconds=min_regression_seconds)
+    baseline_results = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(result_key(result))
+        if previous is None:
+            continue
+        for metric, floor in floors.items():
+            if not previous[metric] or result[metric] <= max(previous[metric] * (1 + tolerance), previous[metric] + floor):
+                continue
+            # A median inside the spread of the baseline's repetitions is noise, not a slowdown
+            if metric == 'median_seconds' and result[metric] <= previous.get('p95_seconds', 0):
+                continue
+            regressions.append({'key': list(result_key(result)), 'metric': metric,
+                                'baseline': previous[metric], 'current': result[metric],
+                                'ratio': result[metric] / previous[metric]})
+    return regressions
+
+def benchmark(args):
+    strategies = list(STRATEGIES) if args.strategies == ['all'] else args.strategies
+    work_directory = args.work_directory or tempfile.mkdtemp(prefix='join_benchmark_')
+    results = []
+    for num_of_employees, overlap_ratio, avg_projects_per_department, key_skew in itertools.product(
+            args.num_of_employees, args.overlap_ratio, args.avg_projects_per_department, args.key_skew):
+        dataset = f"employees={num_of_employees} overlap={overlap_ratio} projects/department={avg_projects_per_department} skew={key_skew}"
+        dataset_directory = os.path.join(work_directory, f"data_{num_of_employees}_{overlap_ratio}_{avg_projects_per_department}_{key_skew}")
+        logging.info(f"Generating dataset {dataset}")
+        db1_path, db2_path = create_dataset(dataset_directory, num_of_employees, overlap_ratio, avg_projects_per_department,
+                                            key_skew, args.random_seed, args.create_dbs_args.split())
+
+        for max_days_diff, strategy in itertools.product(args.max_days_diff, strategies):
+            script, runs, writes_databases = STRATEGIES[strategy]
+            for run_number, run_args in enumerate(runs):
+                run_directory = os.path.join(dataset_directory, f"{strategy}_{max_days_diff}_{run_number}")
+                os.makedirs(run_directory, exist_ok=True)
+                run_db1_path, run_db2_path = db1_path, db2_path
+                if writes_databases:
+                    run_db1_path = shutil.copy(db1_path, os.path.join(run_directory, 'database1.db'))
+                    run_db2_path = shutil.copy(db2_path, os.path.join(run_directory, 'database2.db'))
+
+                # Warm the page cache and the interpreter's file cache before measuring
+                for _ in range(args.warmup):
+                    run_once(script, run_args, run_directory, run_db1_path, run_db2_path, max_days_diff, args.sink)
+                # A script may report several joins (e.g. one per distributed strategy); group them by name
+                records = dict()
+                for _ in range(args.repetitions):
+                    for record in run_once(script, run_args, run_directory, run_db1_path, run_db2_path, max_days_diff, args.sink):
+                        records.setdefault(record['name'], []).append(record)
+
+                for name, name_records in records.items():
+                    result = {'num_of_employees': num_of_employees, 'overlap_ratio': overlap_ratio,
+                              'avg_projects_per_department': avg_projects_per_department, 'key_skew': key_skew,
+                              'max_days_diff': max_days_diff, 'name': name}
+                    result.update(summarize(name_records))
+                    results.append(result)
+                    logging.info(f"{dataset} max_days_diff={max_days_diff} {name}: "
+                                 f"median {result['median_seconds']:.4f} s, p95 {result['p95_seconds']:.4f} s, "
+                                 f"peak RSS {result['peak_rss_bytes'] / (1024*1024):.1f} MB, "
+                                 f"first row {result['median_time_to_first_row'] or 0:.4f} s, {result['rows']} rows")
+                if not args.keep_outputs:
+                    shutil.rmtree(run_directory)
+
+    output = {'parameters': {key: value for key, value in vars(args).items() if key not in ('baseline', 'save_baseline')},
+              'results': results}
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance, args.min_regression_seconds)
+        for regression in regressions:
+            logging.warning(f"Regression in {regression['metric']} of {' '.join(str(part) for part in regression['key'])}: "
+                            f"{regression['baseline']:.4f} -> {regression['current']:.4f} ({regression['ratio']:.2f}x)")
+        logging.info(f"{len(regressions)} regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    output['regressions'] = regressions
+
+    with open(args.output, 'w') as file:
+        json.dump(output, file, indent=2)
+    logging.info(f"Results written to {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(output, file, indent=2)
+        logging.info(f"Baseline saved to {args.save_baseline}")
+    if not args.work_directory:
+        shutil.rmtree(work_directory)
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the join strategies over a sweep of generated datasets.")
+    parser.add_argument('--num_of_employees', type=int, nargs='+', default=[60000], help="Values of the number of rows in the Employees table.")
+    parser.add_argument('--overlap_ratio', type=float, nargs='+', default=[0.25], help="Values of the overlap ratio on the join attribute.")
+    parser.add_argument('--avg_projects_per_department', type=float, nargs='+', default=[50.0], help="Values of the average number of projects per department.")
+    parser.add_argument('--key_skew', type=float, nargs='+', default=[0.0], help="Values of the Zipfian exponent of the Department distribution (0 = uniform).")
+    parser.add_argument('--max_days_diff', type=int, nargs='+', default=[10], help="Values of the maximum allowed difference in days between timestamps.")
+    parser.add_argument('--strategies', type=str, nargs='+', default=['all'], choices=list(STRATEGIES) + ['all'], help="Join strategies to benchmark. Default=all")
+    parser.add_argument('--sink', type=str, default='csv', help="Result sink of the joins; null times the join alone. Default=csv")
+    parser.add_argument('--warmup', type=int, default=1, help="Number of unmeasured runs before the repetitions.")
+    parser.add_argument('--repetitions', type=int, default=5, help="Number of measured runs of every join.")
+    parser.add_argument('--random_seed', type=int, default=42, help="The seed of the dataset generator.")
+    parser.add_argument('--create_dbs_args', type=str, default='', help="Extra arguments passed to create_dbs.py, e.g. '--integer_dates'.")
+    parser.add_argument('--output', type=str, default='benchmark_results.json', help="File the results table is written to.")
+    parser.add_argument('--baseline', type=str, default='benchmark_baseline.json', help="Stored results to flag regressions against.")
+    parser.add_argument('--save_baseline', type=str, default=None, help="Also store the results as the new baseline in this file.")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Relative slowdown or memory growth tolerated before a regression is flagged.")
+    parser.add_argument('--min_regression_seconds', type=float, default=REGRESSION_METRICS['median_seconds'],
+                        help="Smallest slowdown of the median, in seconds, flagged as a regression. Default=0.005")
+    parser.add_argument('--work_directory', type=str, default=None, help="Directory for the generated datasets (kept). Default=a temporary directory")
+    parser.add_argument('--keep_outputs', action='store_true', help="Keep the CSV outputs and logs of every run.")
+    args = parser.parse_args()
+
+    sys.exit(1 if benchmark(args) else 0)
@@ -1,6 +1,5 @@
 import sqlite3
-import random
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 import argparse
 import numpy as np
@@ -9,63 +8,108 @@ import logging
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def create_employees_table(cursor, num_of_employees, num_of_departments, random_seed):
-    random.seed(random_seed)
+# Rows are generated and inserted in chunks so that 100M-row tables do not have to fit in memory as tuples
+CHUNK_ROWS = 1_000_000
+# Dates are drawn as day offsets within 2023
+FIRST_DATE = np.datetime64('2023-01-01')
+DAYS_IN_YEAR = 365
+
+# Dates are stored as 'YYYY-MM-DD' text, or as integer day ordinals when integer_dates is set
+def format_dates(day_offsets, integer_dates):
+    if integer_dates:
+        return (day_offsets + datetime(2023, 1, 1).toordinal()).tolist()
+    return (FIRST_DATE + day_offsets).astype(str).tolist()
+
+# Zipfian weights of n keys (the first key is the heaviest), normalized to sum to 1; skew 0 is uniform
+def zipf_weights(n, key_skew):
+    weights = 1.0 / np.arange(1, n + 1, dtype=np.float64) ** key_skew
+    return weights / weights.sum()
+
+# Open the single bulk-load transaction. The databases are regenerated from scratch on failure,
+# so there is nothing for the rollback journal or fsync to protect.
+def begin_bulk_load(cursor):
+    cursor.execute("PRAGMA journal_mode=OFF")
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.execute("BEGIN")
+
+def create_employees_table(cursor, num_of_employees, num_of_departments, random_seed, integer_dates=False, key_skew=0.0):
+    rng = np.random.default_rng(random_seed)
     cursor.execute("DROP TABLE IF EXISTS Employees")
-    cursor.execute("""
+    date_type = 'INTEGER' if integer_dates else 'TEXT'
+    cursor.execute(f"""
         CREATE TABLE Employees (
             EmployeeID INTEGER PRIMARY KEY,
             Department TEXT,
             Name TEXT,
-            HireDate TEXT
+            HireDate {date_type}
         )
     """)
 
     departments_id = list(range(1, num_of_departments+1))
     departments_tag = list(['A','B','C','D','E'])
-    departments = [tag+'_'+str(id) for tag in departments_tag for id in departments_id]
+    departments = np.array([tag+'_'+str(id) for tag in departments_tag for id in departments_id], dtype=object)
+    weights = zipf_weights(len(departments), key_skew) if key_skew else None
 
-    employees = []
-    for employee_id in range(1, num_of_employees + 1):
-        department = random.choice(departments)
-        name = f'Employee_{employee_id}'
-        hire_date = datetime(2023, 1, 1) + timedelta(days=random.randint(0, 364))
-        employees.append((employee_id, department, name, hire_date.strftime('%Y-%m-%d')))
+    # Employees are generated in EmployeeID order, which is also the order of the table's B-tree
+    for chunk_start in range(1, num_of_employees + 1, CHUNK_ROWS):
+        chunk_end = min(chunk_start + CHUNK_ROWS, num_of_employees + 1)
+        employee_ids = np.arange(chunk_start, chunk_end)
+        department_indices = rng.choice(len(departments), size=len(employee_ids), p=weights)
+        day_offsets = rng.integers(0, DAYS_IN_YEAR, size=len(employee_ids))
+        employees = zip(employee_ids.tolist(), departments[department_indices].tolist(),
+                        [f'Employee_{employee_id}' for employee_id in range(chunk_start, chunk_end)],
+                        format_dates(day_offsets, integer_dates))
+        cursor.executemany("INSERT INTO Employees (EmployeeID, Department, Name, HireDate) VALUES (?, ?, ?, ?)", employees)
+        if num_of_employees > CHUNK_ROWS:
+            logging.info(f"Inserted {chunk_end - 1} of {num_of_employees} employees")
 
-    cursor.executemany("INSERT INTO Employees (EmployeeID, Department, Name, HireDate) VALUES (?, ?, ?, ?)", employees)
-    logging.info(f"Employees table created successfully with {len(employees)} rows.")
+    logging.info(f"Employees table created successfully with {num_of_employees} rows.")
     
-def create_projects_table(cursor, overlap_ratio, num_of_departments, avg_projects_per_department, std_projects_per_department, random_seed):
-    random.seed(random_seed)
-    np.random.seed(random_seed)
+def create_projects_table(cursor, overlap_ratio, num_of_departments, avg_projects_per_department, std_projects_per_department, random_seed, integer_dates=False, key_skew=0.0):
+    rng = np.random.default_rng(random_seed)
     cursor.execute("DROP TABLE IF EXISTS Projects")
-    cursor.execute("""
+    date_type = 'INTEGER' if integer_dates else 'TEXT'
+    cursor.execute(f"""
         CREATE TABLE Projects (
             ProjectID INTEGER PRIMARY KEY,
             Department TEXT,
-            StartDate TEXT,
+            StartDate {date_type},
             Funding INTEGER
         )
     """)
 
     departments_id = list(range(1, int((1/overlap_ratio))*num_of_departments))
     departments_tag = list(['A'])
-    departments = [tag+'_'+str(id) for tag in departments_tag for id in departments_id]
-
-    max_project_ids = int(len(departments)*(avg_projects_per_department+2*std_projects_per_department))
-    project_ids = list(range(1,max_project_ids))
-    projects = []
-    for department in departments:
-        num_projects = max(1, int(np.random.normal(avg_projects_per_department, std_projects_per_department)))
-        for _ in range(num_projects):
-            start_date = datetime(2023, 1, 1) + timedelta(days=random.randint(0, 364))
-            funding = random.randint(10,1000)*1000
-            project_id = random.choice(project_ids)
-            projects.append((project_id, department, start_date.strftime('%Y-%m-%d'), funding))
-            project_ids.remove(project_id)
-
-    cursor.executemany("INSERT INTO Projects (ProjectID, Department, StartDate, Funding) VALUES (?, ?, ?, ?)", projects)
-    logging.info(f"Projects table created successfully with {len(projects)} rows.")
+    departments = np.array([tag+'_'+str(id) for tag in departments_tag for id in departments_id], dtype=object)
+
+    # Number of projects per department; with skew the mean of each department is scaled by its Zipfian weight
+    num_projects = rng.normal(avg_projects_per_department, std_projects_per_department, size=len(departments))
+    if key_skew:
+        num_projects *= zipf_weights(len(departments), key_skew) * len(departments)
+    num_projects = np.maximum(1, num_projects.astype(np.int64))
+    num_of_projects = int(num_projects.sum())
+
+    # Unique project IDs drawn from 1..max_project_ids-1 as a prefix of a random permutation
+    max_project_ids = max(int(len(departments)*(avg_projects_per_department+2*std_projects_per_department)), num_of_projects + 1)
+    project_ids = rng.permutation(max_project_ids - 1)[:num_of_projects] + 1
+    department_indices = np.repeat(np.arange(len(departments), dtype=np.int32), num_projects)
+    # Insert in ProjectID order so that the rows are appended to the table's B-tree
+    order = np.argsort(project_ids, kind='stable')
+    project_ids = project_ids[order]
+    department_indices = department_indices[order]
+    del order
+
+    for chunk_start in range(0, num_of_projects, CHUNK_ROWS):
+        chunk_end = min(chunk_start + CHUNK_ROWS, num_of_projects)
+        day_offsets = rng.integers(0, DAYS_IN_YEAR, size=chunk_end - chunk_start)
+        funding = rng.integers(10, 1001, size=chunk_end - chunk_start) * 1000
+        projects = zip(project_ids[chunk_start:chunk_end].tolist(), departments[department_indices[chunk_start:chunk_end]].tolist(),
+                       format_dates(day_offsets, integer_dates), funding.tolist())
+        cursor.executemany("INSERT INTO Projects (ProjectID, Department, StartDate, Funding) VALUES (?, ?, ?, ?)", projects)
+        if num_of_projects > CHUNK_ROWS:
+            logging.info(f"Inserted {chunk_end} of {num_of_projects} projects")
+
+    logging.info(f"Projects table created successfully with {num_of_projects} rows.")
     
 def main(args):
     if not os.path.exists(args.dbs_directory):
@@ -84,12 +128,14 @@ def main(args):
     
     conn1 = sqlite3.connect(db1_path)
     cursor1 = conn1.cursor()
-    create_projects_table(cursor1, args.overlap_ratio, args.num_of_departments, args.avg_projects_per_department, args.std_projects_per_department, args.random_seed)
+    begin_bulk_load(cursor1)
+    create_projects_table(cursor1, args.overlap_ratio, args.num_of_departments, args.avg_projects_per_department, args.std_projects_per_department, args.random_seed, args.integer_dates, args.key_skew)
     conn1.commit()
     
     conn2 = sqlite3.connect(db2_path)
     cursor2 = conn2.cursor()
-    create_employees_table(cursor2, args.num_of_employees, args.num_of_departments, args.random_seed)
+    begin_bulk_load(cursor2)
+    create_employees_table(cursor2, args.num_of_employees, args.num_of_departments, args.random_seed, args.integer_dates, args.key_skew)
     conn2.commit()
     
     conn1.close()
@@ -112,6 +158,8 @@ if __name__ == "__main__":
     parser.add_argument('--avg_projects_per_department', type=float, default=50.0, help="The average number of projects per department.")
     parser.add_argument('--std_projects_per_department', type=float, default=10.0, help="The standard deviation of the number of projects per department.")
     parser.add_argument('--random_seed', type=int, default=42, help="The seed for random number generation.")
+    parser.add_argument('--key_skew', type=float, default=0.0, help="Zipfian exponent of the Department distribution in both tables (0 = uniform).")
+    parser.add_argument('--integer_dates', action='store_true', help="Store HireDate/StartDate as INTEGER day ordinals instead of TEXT.")
 
     args = parser.parse_args()
     main(args)
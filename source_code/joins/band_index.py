@@ -0,0 +1,72 @@
+import bisect
+from array import array
+
+# Build a band index from (day ordinal, row) pairs:
+# join key -> (sorted day ordinals, rows in the same order)
+def build_band_index(entries, join_index):
+    return build_keyed_band_index((row[join_index], ordinal, row) for ordinal, row in entries)
+
+# Build a band index from (join key, day ordinal, item) triples, for items that are not plain rows
+def build_keyed_band_index(keyed_entries):
+    buckets = dict()
+    for key, ordinal, item in keyed_entries:
+        if key not in buckets:
+            buckets[key] = []
+        buckets[key].append((ordinal, item))
+
+    band_index = dict()
+    for key, bucket in buckets.items():
+        bucket.sort(key=lambda entry: entry[0])
+        band_index[key] = ([entry[0] for entry in bucket], [entry[1] for entry in bucket])
+    return band_index
+
+# Build a compact band index from (join key, day ordinal, rowid) triples:
+# join key -> (array('i') of sorted day ordinals, array('q') of rowids in the same order).
+# No row payload is kept and each distinct key is stored once; rows are fetched by rowid after they match.
+def build_compact_band_index(keyed_rowids):
+    buckets = dict()
+    for key, ordinal, rowid in keyed_rowids:
+        if key not in buckets:
+            buckets[key] = (array('i'), array('q'))
+        buckets[key][0].append(ordinal)
+        buckets[key][1].append(rowid)
+
+    for key, (ordinals, rowids) in buckets.items():
+        order = sorted(range(len(ordinals)), key=ordinals.__getitem__)
+        buckets[key] = (array('i', [ordinals[position] for position in order]), array('q', [rowids[position] for position in order]))
+    return buckets
+
+# Insert a single row into a band index, keeping its bucket sorted by ordinal
+def insert_into_band_index(band_index, key, ordinal, row):
+    if key not in band_index:
+        band_index[key] = ([], [])
+    ordinals, rows = band_index[key]
+    position = bisect.bisect_right(ordinals, ordinal)
+    ordinals.insert(position, ordinal)
+    rows.insert(position, row)
+
+# Merge the buckets of another band index into band_index, keeping each bucket sorted by ordinal
+def merge_band_index(band_index, other):
+    for key, (other_ordinals, other_rows) in other.items():
+        if key not in band_index:
+            band_index[key] = (list(other_ordinals), list(other_rows))
+            continue
+        ordinals, rows = band_index[key]
+        if not ordinals or other_ordinals[0] >= ordinals[-1]:
+            # The other bucket starts after this one ends: extend in place
+            ordinals.extend(other_ordinals)
+            rows.extend(other_rows)
+            continue
+        entries = list(zip(ordinals, rows)) + list(zip(other_ordinals, other_rows))
+        entries.sort(key=lambda entry: entry[0])
+        band_index[key] = ([entry[0] for entry in entries], [entry[1] for entry in entries])
+
+# Return the rows of a bucket whose ordinal lies in [ordinal - max_days_diff, ordinal + max_days_diff]
+def probe_band_index(band_index, key, ordinal, max_days_diff):
+    bucket = band_index.get(key)
+    if bucket is None:
+        return []
+    ordinals, rows = bucket
+    low = bisect.bisect_left(ordinals, ordinal - max_days_diff)
+    high = bisect.bisect_right(ordinals, ordinal + max_days_diff, low)
+    return rows[low:high]
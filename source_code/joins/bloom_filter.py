@@ -0,0 +1,53 @@
+import math
+import hashlib
+import argparse
+
+# Bloom filter over string items, sized for an expected item count and false-positive rate
+class BloomFilter:
+    def __init__(self, expected_items, false_positive_rate):
+        if not 0 < false_positive_rate < 1:
+            raise ValueError(f"The false-positive rate must be between 0 and 1, got {false_positive_rate}")
+        # An empty filter is sized like one for a single item
+        expected_items = max(1, expected_items)
+        self.false_positive_rate = false_positive_rate
+        self.num_bits = max(8, int(math.ceil(-expected_items * math.log(false_positive_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / expected_items * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.items = 0
+
+    # Bit positions of an item, by double hashing the two halves of one 128-bit digest
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        hash_1 = int.from_bytes(digest[:8], 'little')
+        hash_2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(hash_1 + i * hash_2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.items += 1
+
+    def __contains__(self, item):
+        for position in self.positions(item):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    # Size of the filter on the wire: the bit array plus the bit and hash counts
+    def size_in_bytes(self):
+        return len(self.bits) + 8
+
+    # False-positive rate implied by the fraction of bits that are set
+    def estimated_false_positive_rate(self):
+        set_bits = sum(bin(byte).count('1') for byte in self.bits)
+        return (set_bits / self.num_bits) ** self.num_hashes
+
+# Command line type of a false-positive rate: a number strictly between 0 and 1
+def false_positive_rate_type(value):
+    try:
+        rate = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid false-positive rate: {value!r}")
+    if not 0 < rate < 1:
+        raise argparse.ArgumentTypeError(f"the false-positive rate must be between 0 and 1, got {value}")
+    return rate
@@ -0,0 +1,184 @@
+import logging
+import argparse
+import sys
+import pickle
+
+from band_index import build_band_index, probe_band_index
+from bloom_filter import BloomFilter, false_positive_rate_type
+from table_scan import connect_for_reading, decoded_columns, scan_decoded
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
+
+# Default target false-positive rate of the filter
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# Width in days of a date bucket. A probed date can only match driving dates within max_days_diff,
+# so with this width the band of a probed row covers at most two buckets.
+def bucket_width(max_days_diff):
+    return 2 * max_days_diff + 1
+
+# Filter item of a join key, or of a (join key, date bucket) pair
+def filter_item(key, bucket=None):
+    if bucket is None:
+        return str(key)
+    return f"{key}|{bucket}"
+
+# Return True if a probed row may have a join partner on the driving side
+def may_match(bloom_filter, key, ordinal, max_days_diff, filter_dates):
+    if not filter_dates:
+        return filter_item(key) in bloom_filter
+    width = bucket_width(max_days_diff)
+    for bucket in range((ordinal - max_days_diff) // width, (ordinal + max_days_diff) // width + 1):
+        if filter_item(key, bucket) in bloom_filter:
+            return True
+    return False
+
+def bloom_join(db1_path, db2_path, invert_join, max_days_diff, false_positive_rate, filter_dates, sink='csv'):
+    if invert_join:
+        driving_db_path = db1_path
+        probed_db_path = db2_path
+        csv_file = "bloom_join_large_join_small.csv"
+        result_type = "Bloom join (Large join Small)"
+    else:
+        driving_db_path = db2_path
+        probed_db_path = db1_path
+        csv_file = "bloom_join_small_join_large.csv"
+        result_type = "Bloom join (Small join Large)"
+
+    log_file = "results.log"
+    setup_logging(log_file)
+    logging.info(result_type)
+
+    conn1 = connect_for_reading(driving_db_path)
+    conn2 = connect_for_reading(probed_db_path)
+    cursor1 = conn1.cursor()
+    cursor2 = conn2.cursor()
+
+    # Fetch the table names
+    cursor1.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    driving_table_name = cursor1.fetchone()[0]
+    cursor2.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    probed_table_name = cursor2.fetchone()[0]
+
+    # Determine the join attribute and its index in each table
+    if driving_table_name.lower() == 'employees' and probed_table_name.lower() == 'projects':
+        join_attribute = 'Department'
+        driving_join_index = 1  # Department is the second column in Employees table
+        probed_join_index = 1  # Department is the second column in Projects table
+        driving_timestamp_column = 'HireDate'
+        probed_timestamp_column = 'StartDate'
+        columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
+    elif driving_table_name.lower() == 'projects' and probed_table_name.lower() == 'employees':
+        join_attribute = 'Department'
+        driving_join_index = 1  # Department is the second column in Projects table
+        probed_join_index = 1  # Department is the second column in Employees table
+        driving_timestamp_column = 'StartDate'
+        probed_timestamp_column = 'HireDate'
+        columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
+    else:
+        raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('reduction')
+
+    # Fetch the distinct join keys, or (join key, date bucket) pairs, of the driving table
+    if filter_dates:
+        ordinal_expression, _, _ = decoded_columns(cursor1, driving_table_name, driving_timestamp_column)
+        cursor1.execute(f"SELECT DISTINCT {join_attribute}, ({ordinal_expression}) / {bucket_width(max_days_diff)} FROM {driving_table_name}")
+        filter_values = [filter_item(key, bucket) for key, bucket in cursor1.fetchall()]
+    else:
+        cursor1.execute(f"SELECT DISTINCT {join_attribute} FROM {driving_table_name}")
+        filter_values = [filter_item(row[0]) for row in cursor1.fetchall()]
+
+    # Build the filter that is shipped to the probed side instead of the values themselves
+    bloom_filter = BloomFilter(len(filter_values), false_positive_rate)
+    for value in filter_values:
+        bloom_filter.add(value)
+    logging.info(f"Bloom filter over {bloom_filter.items} {'(key, date bucket) pairs' if filter_dates else 'join keys'}: "
+                 f"{bloom_filter.num_bits} bits, {bloom_filter.num_hashes} hash functions")
+    logging.info(f"Bloom filter false-positive rate: target {false_positive_rate:.4f}, "
+                 f"estimated from fill {bloom_filter.estimated_false_positive_rate():.4f}")
+
+    # Stream the probed table through the filter
+    probed_table_count = 0
+    probed_rows = []
+    for ordinal, row in scan_decoded(cursor2, probed_table_name, probed_timestamp_column):
+        probed_table_count += 1
+        if may_match(bloom_filter, row[probed_join_index], ordinal, max_days_diff, filter_dates):
+            probed_rows.append((ordinal, row))
+    reduction_ratio = len(probed_rows) / probed_table_count if probed_table_count else 0.0
+    logging.info(f"Bloom filter passed {len(probed_rows)} of {probed_table_count} {probed_table_name} rows (ratio {reduction_ratio:.4f})")
+
+    # Bytes shipped in each direction of the reduction phase
+    join_values_bytes = len(pickle.dumps(filter_values))
+    probed_rows_bytes = len(pickle.dumps(probed_rows))
+    logging.info(f"Bytes shipped {driving_table_name} -> {probed_table_name} (Bloom filter): {bloom_filter.size_in_bytes()} "
+                 f"(the values themselves: {join_values_bytes})")
+    logging.info(f"Bytes shipped {probed_table_name} -> {driving_table_name} (passed rows): {probed_rows_bytes}")
+
+    reduction_time = metrics.end_phase('reduction')
+    logging.info(f"Reduction phase completed in {reduction_time:.4f} seconds")
+
+    metrics.start_phase('join')
+
+    # Build a band index over the passed probed rows
+    probed_index = build_band_index(probed_rows, probed_join_index)
+
+    logging.info(f"Performing Bloom join between {driving_table_name} and {probed_table_name} tables...")
+    probes = 0
+    bisect_steps = 0
+    matched_probed_rows = set()
+    with open_sink(sink, csv_file, columns) as writer:
+        # Stream the driving table through the index of the passed probed rows
+        for driving_timestamp, row1 in scan_decoded(cursor1, driving_table_name, driving_timestamp_column):
+            key = row1[driving_join_index]
+            probes += 1
+            if key in probed_index:
+                bisect_steps += 2 * len(probed_index[key][0]).bit_length()
+                for row2 in probe_band_index(probed_index, key, driving_timestamp, max_days_diff):
+                    matched_probed_rows.add(id(row2))
+                    writer.writerow(row1 + row2)
+                    metrics.add_rows()
+
+    join_time = metrics.end_phase('join')
+    logging.info(f"Join phase completed in {join_time:.4f} seconds")
+
+    # Passed rows that joined with nothing were shipped for nothing: filter false positives,
+    # and with key-only filtering also rows whose key matches but whose date is out of band
+    wasted_rows = len(probed_rows) - len(matched_probed_rows)
+    logging.info(f"Passed rows without a join partner: {wasted_rows} of {len(probed_rows)}")
+
+    metrics.count('probes', probes)
+    metrics.count('estimated_bisect_steps', bisect_steps)
+    metrics.count('passed rows', len(probed_rows))
+    metrics.count('passed rows without partner', wasted_rows)
+    metrics.measure('bloom filter', bloom_filter)
+    metrics.measure('probed index', probed_index)
+    metrics.finish(max_days_diff=max_days_diff, false_positive_rate=false_positive_rate, filter_dates=filter_dates,
+                   bytes_shipped={'bloom filter': bloom_filter.size_in_bytes(), 'passed rows': probed_rows_bytes})
+
+    # Close the connections
+    conn1.close()
+    conn2.close()
+
+    return metrics.rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform a Bloom-filter semi-join between two SQLite databases.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--false_positive_rate', type=false_positive_rate_type, default=DEFAULT_FALSE_POSITIVE_RATE, help='Target false-positive rate of the Bloom filter, between 0 and 1.')
+    parser.add_argument('--filter_dates', action='store_true', help='Filter on (join key, date bucket) pairs instead of join keys only.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    args = parser.parse_args()
+
+    bloom_join(args.db1, args.db2, args.invert_join, args.max_days_diff, args.false_positive_rate, args.filter_dates, args.sink)
@@ -0,0 +1,163 @@
+import logging
+import argparse
+import sys
+import numpy as np
+
+from table_scan import connect_for_reading, scan_batches
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
+
+# Number of probe rows joined per vectorized batch
+DEFAULT_PROBE_BATCH_SIZE = 65536
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# Load a table as full rows plus its join key and int32 day ordinal columns
+def load_columns(cursor, table_name, join_index, timestamp_column):
+    rows = []
+    ordinals = []
+    for batch in scan_batches(cursor, table_name, timestamp_column):
+        for row in batch:
+            ordinals.append(row[0])
+            rows.append(row[1:])
+    keys = np.array([row[join_index] for row in rows], dtype=object)
+    return rows, keys, np.array(ordinals, dtype=np.int32)
+
+# Expand per-probe-row [low, high) ranges into (probe position, build position) pairs
+def expand_ranges(low, high):
+    counts = high - low
+    total = int(counts.sum())
+    probe_positions = np.repeat(np.arange(len(low)), counts)
+    # Offset of each pair inside its probe row's range
+    starts = np.cumsum(counts) - counts
+    build_positions = np.repeat(low, counts) + (np.arange(total) - np.repeat(starts, counts))
+    return probe_positions, build_positions
+
+def columnar_join(db1_path, db2_path, invert_join, max_days_diff, probe_batch_size, sink='csv'):
+    if invert_join:
+        hash_db_path = db2_path
+        probe_db_path = db1_path
+        csv_file = "columnar_join_large_join_small.csv"
+        result_type = "Columnar join (Large join Small)"
+    else:
+        hash_db_path = db1_path
+        probe_db_path = db2_path
+        csv_file = "columnar_join_small_join_large.csv"
+        result_type = "Columnar join (Small join Large)"
+
+    log_file = "results.log"
+    setup_logging(log_file)
+    logging.info(result_type)
+
+    conn1 = connect_for_reading(hash_db_path)
+    conn2 = connect_for_reading(probe_db_path)
+    cursor1 = conn1.cursor()
+    cursor2 = conn2.cursor()
+
+    # Fetch the table names
+    cursor1.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_1 = cursor1.fetchone()[0]
+    cursor2.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_2 = cursor2.fetchone()[0]
+
+    # Determine the join attribute and its index in each table
+    if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
+        join_index_table_1 = 1  # Department is the second column in Projects table
+        join_index_table_2 = 1  # Department is the second column in Employees table
+        timestamp_column_table_1 = 'StartDate'
+        timestamp_column_table_2 = 'HireDate'
+        columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
+    elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
+        join_index_table_1 = 1  # Department is the second column in Employees table
+        join_index_table_2 = 1  # Department is the second column in Projects table
+        timestamp_column_table_1 = 'HireDate'
+        timestamp_column_table_2 = 'StartDate'
+        columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
+    else:
+        raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('load')
+    rows1, keys1, dates1 = load_columns(cursor1, table_name_1, join_index_table_1, timestamp_column_table_1)
+    rows2, keys2, dates2 = load_columns(cursor2, table_name_2, join_index_table_2, timestamp_column_table_2)
+    load_time = metrics.end_phase('load')
+    logging.info(f"Load phase completed in {load_time:.4f} seconds")
+
+    metrics.start_phase('build')
+
+    # Dictionary-encode the join keys of both tables into one code space
+    _, codes = np.unique(np.concatenate([keys1, keys2]), return_inverse=True)
+    codes = codes.astype(np.int64)
+    codes1 = codes[:len(keys1)]
+    codes2 = codes[len(keys1):]
+
+    # Combine (key code, date) into one sortable int64 so the date band of a key never overlaps
+    # with another key: each key owns a stride of span + 2*max_days_diff + 1 values
+    all_dates = np.concatenate([dates1, dates2])
+    min_date = int(all_dates.min()) if len(all_dates) else 0
+    max_date = int(all_dates.max()) if len(all_dates) else 0
+    stride = (max_date - min_date) + 2 * max_days_diff + 1
+    composite1 = codes1 * stride + (dates1.astype(np.int64) - min_date + max_days_diff)
+    composite2 = codes2 * stride + (dates2.astype(np.int64) - min_date + max_days_diff)
+
+    # Sort the build side by (key, date)
+    order1 = np.argsort(composite1, kind='stable')
+    sorted_composite1 = composite1[order1]
+
+    build_time = metrics.end_phase('build')
+    logging.info(f"Build phase completed in {build_time:.4f} seconds")
+
+    metrics.start_phase('probe')
+
+    logging.info(f"Performing probe phase with {table_name_2} table...")
+    bisect_steps = 0
+    # Each range search is two binary searches over the sorted build column, of about log2(n) steps each
+    steps_per_search = 2 * len(sorted_composite1).bit_length()
+    with open_sink(sink, csv_file, columns) as writer:
+        for batch_start in range(0, len(rows2), probe_batch_size):
+            batch_composite = composite2[batch_start:batch_start + probe_batch_size]
+            # Equi-join and band predicate in one range search per probe row
+            low = np.searchsorted(sorted_composite1, batch_composite - max_days_diff, side='left')
+            high = np.searchsorted(sorted_composite1, batch_composite + max_days_diff, side='right')
+            bisect_steps += steps_per_search * len(batch_composite)
+            probe_positions, build_positions = expand_ranges(low, high)
+            if len(probe_positions) == 0:
+                continue
+            build_rows = order1[build_positions].tolist()
+            probe_rows = (probe_positions + batch_start).tolist()
+            writer.writerows(rows1[i] + rows2[j] for i, j in zip(build_rows, probe_rows))
+            metrics.add_rows(len(build_rows))
+
+    probe_time = metrics.end_phase('probe')
+    logging.info(f"Probe phase completed in {probe_time:.4f} seconds")
+
+    column_memory = (keys1.nbytes + keys2.nbytes + dates1.nbytes + dates2.nbytes + codes.nbytes
+                     + composite1.nbytes + composite2.nbytes + order1.nbytes + sorted_composite1.nbytes) / ((1024)*(1024))
+    logging.info(f"Column arrays memory: {column_memory:.4f} MB")
+
+    metrics.count('probes', len(rows2))
+    metrics.count('estimated_bisect_steps', bisect_steps)
+    metrics.finish(max_days_diff=max_days_diff, probe_batch_size=probe_batch_size)
+
+    # Close the connections
+    conn1.close()
+    conn2.close()
+
+    return metrics.rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform a vectorized columnar join between two SQLite databases using NumPy.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--probe_batch_size', type=int, default=DEFAULT_PROBE_BATCH_SIZE, help='Number of probe rows joined per vectorized batch.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    args = parser.parse_args()
+
+    columnar_join(args.db1, args.db2, args.invert_join, args.max_days_diff, args.probe_batch_size, args.sink)
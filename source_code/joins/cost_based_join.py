@@ -0,0 +1,302 @@
+import time
+import math
+import random
+import logging
+import argparse
+import bisect
+import sys
+import pickle
+from collections import Counter
+
+from table_scan import connect_for_reading, decoded_select, has_index
+from sinks import SINKS
+from instrumentation import peak_rss
+from single_pass_hash_join import single_pass_hash_join
+from pipeline_hash_join import pipelined_hash_join
+from semi_join import semi_join
+from bloom_join import bloom_join, DEFAULT_FALSE_POSITIVE_RATE
+from sort_merge_join import sort_merge_join
+from columnar_join import columnar_join, DEFAULT_PROBE_BATCH_SIZE
+from grace_hash_join import grace_hash_join
+from sql_pushdown_join import sql_pushdown_join
+
+# Number of rows sampled per table, and number of rowids looked up per sampling query
+DEFAULT_SAMPLE_SIZE = 2000
+SAMPLE_CHUNK_SIZE = 500
+# Seed of the row sampler, so that the same databases give the same statistics and plan
+DEFAULT_RANDOM_SEED = 42
+
+# Per-row costs in seconds, calibrated on the bundled 20k x 60k datasets
+SCAN_ROW_COST = 2.5e-6         # fetch and decode a row through scan_decoded
+INDEX_INSERT_COST = 1.5e-6     # add a row to a band index
+PROBE_COST = 0.5e-6            # look up a row in a band index
+OUTPUT_ROW_COST = 3.5e-6       # write one result row with csv.writer
+DISTINCT_COST = 0.3e-6         # SELECT DISTINCT of the join attribute
+SQL_FILTER_COST = 0.5e-6       # evaluate an IN (...) predicate inside SQLite
+BLOOM_COST = 2.0e-6            # test a row against the Bloom filter
+SORT_COST = 0.05e-6            # SQLite external sort, per row and per log2(rows)
+MERGE_COST = 0.2e-6            # advance the sort-merge window
+VECTOR_COST = 1.0e-6           # build and probe the NumPy columns
+SEEK_COST = 3.0e-6             # one index range seek inside SQLite
+SQL_OUTPUT_COST = 2.5e-6       # write one result row fetched in batches
+SPILL_COST = 3.0e-6            # write a row to a spill file and read it back
+# Bytes per row of the NumPy key, date, composite and order columns
+COLUMN_BYTES = 40
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# Row count and distinct join keys recorded by ANALYZE in sqlite_stat1, or None when not available
+def read_stat1(cursor, table_name, join_attribute):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'")
+    if cursor.fetchone() is None:
+        return None, None
+    row_count = None
+    distinct_keys = None
+    cursor.execute("SELECT idx, stat FROM sqlite_stat1 WHERE tbl = ?", (table_name,))
+    for index_name, stat in cursor.fetchall():
+        numbers = [int(value) for value in stat.split() if value.isdigit()]
+        if not numbers:
+            continue
+        row_count = numbers[0]
+        if index_name is None or len(numbers) < 2:
+            continue
+        # The second number is the average number of rows per distinct value of the first index column
+        cursor.execute(f"PRAGMA index_info({index_name})")
+        index_columns = [row[2] for row in sorted(cursor.fetchall())]
+        if index_columns and index_columns[0] == join_attribute:
+            distinct_keys = max(1, round(numbers[0] / numbers[1]))
+    return row_count, distinct_keys
+
+# Sample (day ordinal, row) entries by looking up rowids drawn from the random generator rng
+def sample_table(cursor, table_name, timestamp_column, sample_size, rng):
+    cursor.execute(f"SELECT MAX(rowid) FROM {table_name}")
+    max_rowid = cursor.fetchone()[0] or 0
+    rowids = rng.sample(range(1, max_rowid + 1), min(sample_size, max_rowid))
+    sample = []
+    for start in range(0, len(rowids), SAMPLE_CHUNK_SIZE):
+        chunk = rowids[start:start + SAMPLE_CHUNK_SIZE]
+        where = f"rowid IN ({','.join(['?'] * len(chunk))})"
+        cursor.execute(decoded_select(cursor, table_name, timestamp_column, where), chunk)
+        sample.extend((row[0], row[1:]) for row in cursor.fetchall())
+    return sample
+
+# Guaranteed-error estimator of the number of distinct values from a sample:
+# values seen once are scaled up by sqrt(rows / sample size), the others are counted as they are
+def estimate_distinct(key_counts, sample_size, row_count):
+    if sample_size == 0:
+        return 0
+    singletons = sum(1 for count in key_counts.values() if count == 1)
+    scale = math.sqrt(row_count / sample_size)
+    return min(row_count, round(scale * singletons + (len(key_counts) - singletons)))
+
+# Gather the statistics of one table: exact row count, distinct keys, sampled keys, dates and row size
+def table_statistics(cursor, table_name, join_index, join_attribute, timestamp_column, sample_size, rng):
+    row_count, distinct_keys = read_stat1(cursor, table_name, join_attribute)
+    source = 'sqlite_stat1' if distinct_keys is not None else 'sample'
+    if row_count is None:
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+        row_count = cursor.fetchone()[0]
+    sample = sample_table(cursor, table_name, timestamp_column, sample_size, rng)
+    key_counts = Counter(row[join_index] for _, row in sample)
+    if distinct_keys is None:
+        distinct_keys = estimate_distinct(key_counts, len(sample), row_count)
+    row_bytes = len(pickle.dumps(sample)) / len(sample) if sample else 0.0
+    return {
+        'table_name': table_name,
+        'rows': row_count,
+        'distinct_keys': distinct_keys,
+        'distinct_source': source,
+        'key_counts': key_counts,
+        'sample_size': len(sample),
+        'dates': sorted(ordinal for ordinal, _ in sample),
+        'row_bytes': row_bytes,
+        'band_indexed': has_index(cursor, table_name, [join_attribute, timestamp_column]),
+    }
+
+# Probability that a random pair of rows has equal keys; the two samples are independent,
+# so the sum of the products of sampled key frequencies is unbiased
+def key_match_probability(stats_1, stats_2):
+    if not stats_1['sample_size'] or not stats_2['sample_size']:
+        return 0.0
+    return sum(count * stats_2['key_counts'][key] for key, count in stats_1['key_counts'].items()) / (stats_1['sample_size'] * stats_2['sample_size'])
+
+# Probability that a random pair of rows falls within the date band, assuming dates independent of keys
+def band_probability(dates_1, dates_2, max_days_diff):
+    if not dates_1 or not dates_2:
+        return 0.0
+    pairs = sum(bisect.bisect_right(dates_2, ordinal + max_days_diff) - bisect.bisect_left(dates_2, ordinal - max_days_diff) for ordinal in dates_1)
+    return pairs / (len(dates_1) * len(dates_2))
+
+# Fraction of the rows of one table whose key appears in the other, from the samples
+def key_containment(stats, other_stats):
+    if not stats['sample_size']:
+        return 0.0
+    return sum(count for key, count in stats['key_counts'].items() if key in other_stats['key_counts']) / stats['sample_size']
+
+# Cost of sorting a table by (join attribute, date) inside SQLite; free when an index provides the order
+def sort_cost(stats):
+    if stats['band_indexed'] or stats['rows'] < 2:
+        return 0.0
+    return stats['rows'] * math.log2(stats['rows']) * SORT_COST
+
+# Estimate (seconds, bytes) of every strategy and direction.
+# Each plan is (strategy, invert_join, build description, seconds, bytes).
+def candidate_plans(stats_1, stats_2, output_rows, memory_budget_bytes, false_positive_rate):
+    n1, n2 = stats_1['rows'], stats_2['rows']
+    w1, w2 = stats_1['row_bytes'], stats_2['row_bytes']
+    name_1, name_2 = stats_1['table_name'], stats_2['table_name']
+    output_cost = output_rows * OUTPUT_ROW_COST
+    plans = []
+
+    # Single pass hash join: index the build table, stream the probe table
+    for invert_join, (build_rows, build_bytes, probe_rows, build_name) in ((False, (n1, w1, n2, name_1)), (True, (n2, w2, n1, name_2))):
+        seconds = (build_rows + probe_rows) * SCAN_ROW_COST + build_rows * INDEX_INSERT_COST + probe_rows * PROBE_COST + output_cost
+        plans.append(('single_pass_hash_join', invert_join, f"build {build_name}", seconds, build_rows * build_bytes))
+
+    # Pipelined hash join: both tables are indexed and probed
+    seconds = (n1 + n2) * (SCAN_ROW_COST + INDEX_INSERT_COST + PROBE_COST) + output_cost
+    plans.append(('pipelined_hash_join', False, "index both", seconds, n1 * w1 + n2 * w2))
+
+    # Semi-join and Bloom join: the probed table is reduced to the rows whose key the driving table has
+    for invert_join, (driving, probed) in ((False, (stats_2, stats_1)), (True, (stats_1, stats_2))):
+        containment = key_containment(probed, driving)
+        drive_cost = driving['rows'] * (DISTINCT_COST + SCAN_ROW_COST + PROBE_COST) + output_cost
+        reduced_rows = probed['rows'] * containment
+        seconds = drive_cost + probed['rows'] * SQL_FILTER_COST + reduced_rows * (SCAN_ROW_COST + INDEX_INSERT_COST)
+        plans.append(('semi_join', invert_join, f"reduce {probed['table_name']}", seconds, reduced_rows * probed['row_bytes']))
+        passed_rows = probed['rows'] * (containment + (1 - containment) * false_positive_rate)
+        seconds = drive_cost + probed['rows'] * (SCAN_ROW_COST + BLOOM_COST) + passed_rows * INDEX_INSERT_COST
+        plans.append(('bloom_join', invert_join, f"filter {probed['table_name']}", seconds, passed_rows * probed['row_bytes']))
+
+    # Sort-merge join: only one key's worth of right rows is held at a time
+    seconds = sort_cost(stats_1) + sort_cost(stats_2) + (n1 + n2) * (SCAN_ROW_COST + MERGE_COST) + output_cost
+    plans.append(('sort_merge_join', False, "merge", seconds, n2 / max(1, stats_2['distinct_keys']) * w2))
+
+    # Columnar join: both tables are loaded as rows plus NumPy columns
+    seconds = (n1 + n2) * (SCAN_ROW_COST + VECTOR_COST) + output_cost
+    plans.append(('columnar_join', False, "load both", seconds, n1 * w1 + n2 * w2 + (n1 + n2) * COLUMN_BYTES))
+
+    # SQL pushdown: one index range seek per outer row; only considered when the inner table has the index
+    for invert_join, (outer, inner) in ((False, (stats_1, stats_2)), (True, (stats_2, stats_1))):
+        if inner['band_indexed']:
+            seconds = outer['rows'] * SEEK_COST + output_rows * SQL_OUTPUT_COST
+            plans.append(('sql_pushdown_join', invert_join, f"seek {inner['table_name']}", seconds, 0.0))
+
+    # Hybrid grace hash join: the build rows that do not fit in the budget are spilled with their probe rows
+    if memory_budget_bytes is not None:
+        for invert_join, (build_rows, build_bytes, probe_rows, build_name) in ((False, (n1, w1, n2, name_1)), (True, (n2, w2, n1, name_2))):
+            spilled_fraction = max(0.0, 1 - memory_budget_bytes / (build_rows * build_bytes)) if build_rows * build_bytes else 0.0
+            seconds = ((build_rows + probe_rows) * SCAN_ROW_COST + build_rows * INDEX_INSERT_COST + probe_rows * PROBE_COST
+                       + (build_rows + probe_rows) * spilled_fraction * SPILL_COST + output_cost)
+            plans.append(('grace_hash_join', invert_join, f"build {build_name}", seconds, min(build_rows * build_bytes, memory_budget_bytes)))
+
+    return plans
+
+# Run a strategy with its defaults and return the number of rows it produced
+def run_plan(strategy, db1_path, db2_path, invert_join, max_days_diff, memory_budget_mb, sink='csv'):
+    if strategy == 'single_pass_hash_join':
+        return single_pass_hash_join(db1_path, db2_path, invert_join, max_days_diff, sink=sink)
+    if strategy == 'pipelined_hash_join':
+        return pipelined_hash_join(db1_path, db2_path, invert_join, max_days_diff, sink=sink)
+    if strategy == 'semi_join':
+        return semi_join(db1_path, db2_path, invert_join, max_days_diff, sink=sink)
+    if strategy == 'bloom_join':
+        return bloom_join(db1_path, db2_path, invert_join, max_days_diff, DEFAULT_FALSE_POSITIVE_RATE, False, sink=sink)
+    if strategy == 'sort_merge_join':
+        return sort_merge_join(db1_path, db2_path, invert_join, max_days_diff, sink=sink)
+    if strategy == 'columnar_join':
+        return columnar_join(db1_path, db2_path, invert_join, max_days_diff, DEFAULT_PROBE_BATCH_SIZE, sink=sink)
+    if strategy == 'sql_pushdown_join':
+        return sql_pushdown_join(db1_path, db2_path, invert_join, max_days_diff, False, sink=sink)
+    if strategy == 'grace_hash_join':
+        return grace_hash_join(db1_path, db2_path, invert_join, max_days_diff, memory_budget_mb, sink=sink)
+    raise ValueError(f"Unknown strategy {strategy}.")
+
+def cost_based_join(db1_path, db2_path, max_days_diff, memory_budget_mb, sample_size, analyze, sink='csv', random_seed=DEFAULT_RANDOM_SEED):
+    log_file = "results.log"
+    setup_logging(log_file)
+    logging.info("Cost-based join")
+
+    # Measure the start time for the statistics phase
+    statistics_start_time = time.time()
+    stats = []
+    rng = random.Random(random_seed)
+    for db_path in (db1_path, db2_path):
+        conn = connect_for_reading(db_path)
+        cursor = conn.cursor()
+        if analyze:
+            cursor.execute("ANALYZE")
+            conn.commit()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+        table_name = cursor.fetchone()[0]
+        if table_name.lower() == 'projects':
+            timestamp_column = 'StartDate'
+        elif table_name.lower() == 'employees':
+            timestamp_column = 'HireDate'
+        else:
+            raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+        # Department is the second column in both tables
+        stats.append(table_statistics(cursor, table_name, 1, 'Department', timestamp_column, sample_size, rng))
+        conn.close()
+    stats_1, stats_2 = stats
+
+    for table_stats in stats:
+        dates = table_stats['dates']
+        logging.info(f"Statistics of {table_stats['table_name']}: {table_stats['rows']} rows, "
+                     f"{table_stats['distinct_keys']} distinct keys ({table_stats['distinct_source']}), "
+                     f"{table_stats['row_bytes']:.1f} bytes per row, {table_stats['sample_size']} rows sampled (seed {random_seed}), "
+                     f"sampled dates {dates[0] if dates else '-'}..{dates[-1] if dates else '-'}, "
+                     f"(Department, date) index: {'yes' if table_stats['band_indexed'] else 'no'}")
+
+    key_probability = key_match_probability(stats_1, stats_2)
+    band_fraction = band_probability(stats_1['dates'], stats_2['dates'], max_days_diff)
+    output_rows = stats_1['rows'] * stats_2['rows'] * key_probability * band_fraction
+    logging.info(f"Key containment: {key_containment(stats_1, stats_2):.4f} of {stats_1['table_name']}, "
+                 f"{key_containment(stats_2, stats_1):.4f} of {stats_2['table_name']}")
+    logging.info(f"Key match probability {key_probability:.6f}, band probability {band_fraction:.6f}, estimated output {output_rows:.0f} rows")
+
+    memory_budget_bytes = memory_budget_mb * 1024 * 1024 if memory_budget_mb is not None else None
+    plans = sorted(candidate_plans(stats_1, stats_2, output_rows, memory_budget_bytes, DEFAULT_FALSE_POSITIVE_RATE), key=lambda plan: plan[3])
+    for strategy, invert_join, description, seconds, size in plans:
+        logging.info(f"Plan {strategy} (invert_join={invert_join}, {description}): estimated {seconds:.4f} seconds, {size / (1024*1024):.4f} MB")
+
+    # Pick the cheapest plan that fits in the memory budget
+    feasible = [plan for plan in plans if memory_budget_bytes is None or plan[4] <= memory_budget_bytes]
+    strategy, invert_join, description, estimated_seconds, estimated_bytes = feasible[0] if feasible else plans[0]
+    statistics_time = time.time() - statistics_start_time
+    logging.info(f"Statistics phase completed in {statistics_time:.4f} seconds")
+    logging.info(f"Chosen plan: {strategy} (invert_join={invert_join}, {description})")
+    logging.info('-'*50)
+
+    # Run the chosen plan and compare the estimates with what it actually did
+    peak_rss_before = peak_rss()
+    run_start_time = time.time()
+    rows_written = run_plan(strategy, db1_path, db2_path, invert_join, max_days_diff, memory_budget_mb, sink)
+    run_time = time.time() - run_start_time
+    peak_rss_growth = (peak_rss() - peak_rss_before) / (1024*1024)
+
+    logging.info(f"Cost-based join: {strategy} (invert_join={invert_join}, {description})")
+    logging.info(f"Output rows: estimated {output_rows:.0f}, actual {rows_written}")
+    logging.info(f"Execution time: estimated {estimated_seconds:.4f} seconds, actual {run_time:.4f} seconds")
+    logging.info(f"Memory: estimated {estimated_bytes / (1024*1024):.4f} MB, peak RSS growth {peak_rss_growth:.4f} MB")
+    logging.info(f"Total execution time: {statistics_time + run_time:.4f} seconds")
+    logging.info('-'*50)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Choose and run the cheapest join strategy from table statistics.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--memory_budget_mb', type=float, default=None, help='Only choose plans estimated to fit in this many MB. Default=no limit')
+    parser.add_argument('--sample_size', type=int, default=DEFAULT_SAMPLE_SIZE, help='Number of rows sampled per table.')
+    parser.add_argument('--analyze', action='store_true', help='Run ANALYZE on both databases first so row and key counts come from sqlite_stat1.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    parser.add_argument('--random_seed', type=int, default=DEFAULT_RANDOM_SEED, help='The seed of the row sampler. Default=42')
+    args = parser.parse_args()
+
+    cost_based_join(args.db1, args.db2, args.max_days_diff, args.memory_budget_mb, args.sample_size, args.analyze, args.sink, args.random_seed)
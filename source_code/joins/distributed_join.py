@@ -0,0 +1,235 @@
+import logging
+import argparse
+import sys
+import pickle
+from multiprocessing import Pipe, Process
+
+from band_index import build_band_index, insert_into_band_index, probe_band_index
+from table_scan import connect_for_reading, scan_decoded
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
+
+# Number of rows carried by a single message on the wire
+DEFAULT_BATCH_SIZE = 1000
+STRATEGIES = ['single_pass', 'pipelined', 'semi_join']
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# One end of a link between two nodes; messages are pickled and the bytes sent are counted per phase
+class Channel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.stats = dict()
+
+    def send(self, phase, message):
+        data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        self.connection.send_bytes(data)
+        if phase not in self.stats:
+            self.stats[phase] = [0, 0]
+        self.stats[phase][0] += 1
+        self.stats[phase][1] += len(data)
+
+    def recv(self):
+        return pickle.loads(self.connection.recv_bytes())
+
+# Ship the (ordinal, row) entries of a scan over a channel in batches, followed by an end marker
+def send_entries(channel, phase, entries, batch_size):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            channel.send(phase, ('batch', batch))
+            batch = []
+    if batch:
+        channel.send(phase, ('batch', batch))
+    channel.send(phase, ('end',))
+
+# Receive batches from a channel until the end marker
+def receive_entries(channel):
+    while True:
+        message = channel.recv()
+        if message[0] == 'end':
+            return
+        yield from message[1]
+
+# Main loop of a data node process: it owns one database file and answers requests
+def data_node(db_path, main_connection, peer_connection):
+    main = Channel(main_connection)
+    peer = Channel(peer_connection)
+    conn = connect_for_reading(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name = cursor.fetchone()[0]
+    main.send('control', ('hello', table_name))
+
+    while True:
+        request = main.recv()
+        operation = request[0]
+        if operation == 'scan':
+            # Ship the whole table to the main node
+            _, phase, timestamp_column, batch_size = request
+            send_entries(main, phase, scan_decoded(cursor, table_name, timestamp_column), batch_size)
+        elif operation == 'semi_join_reduce':
+            # Probed node: receive the join keys from the peer and ship back only the matching rows
+            _, join_attribute, timestamp_column, batch_size = request
+            join_values = peer.recv()[1]
+            where = f"{join_attribute} IN ({','.join(['?'] * len(join_values))})"
+            send_entries(peer, 'reduction: reduced rows', scan_decoded(cursor, table_name, timestamp_column, where, join_values), batch_size)
+        elif operation == 'semi_join_drive':
+            # Driving node: ship the join keys, join the reduced rows locally and ship the result to the main node
+            _, join_attribute, join_index, probed_join_index, timestamp_column, max_days_diff, batch_size = request
+            cursor.execute(f"SELECT DISTINCT {join_attribute} FROM {table_name}")
+            join_values = [row[0] for row in cursor.fetchall()]
+            peer.send('reduction: join keys', ('keys', join_values))
+            probed_index = build_band_index(receive_entries(peer), probed_join_index)
+            batch = []
+            for ordinal, row in scan_decoded(cursor, table_name, timestamp_column):
+                for record in probe_band_index(probed_index, row[join_index], ordinal, max_days_diff):
+                    batch.append(row + record)
+                    if len(batch) >= batch_size:
+                        main.send('result shipping', ('batch', batch))
+                        batch = []
+            if batch:
+                main.send('result shipping', ('batch', batch))
+            main.send('result shipping', ('end',))
+        elif operation == 'stop':
+            stats = dict()
+            for channel in (main, peer):
+                for phase, (messages, size) in channel.stats.items():
+                    if phase not in stats:
+                        stats[phase] = [0, 0]
+                    stats[phase][0] += messages
+                    stats[phase][1] += size
+            main.send('control', ('stats', stats))
+            break
+
+    conn.close()
+
+# Start the two data nodes, each in its own process and linked to the other by a pipe
+def start_cluster(db1_path, db2_path):
+    peer_1, peer_2 = Pipe()
+    channels = []
+    processes = []
+    for db_path, peer in ((db1_path, peer_1), (db2_path, peer_2)):
+        main_end, node_end = Pipe()
+        process = Process(target=data_node, args=(db_path, node_end, peer))
+        process.start()
+        channels.append(Channel(main_end))
+        processes.append(process)
+    table_names = [channel.recv()[1] for channel in channels]
+    return channels, processes, table_names
+
+# Stop the data nodes and collect the per-phase transfer counters from every node
+def stop_cluster(channels, processes):
+    stats = dict()
+    for channel in channels:
+        channel.send('control', ('stop',))
+        node_stats = channel.recv()[1]
+        for phase, (messages, size) in list(node_stats.items()) + list(channel.stats.items()):
+            if phase not in stats:
+                stats[phase] = [0, 0]
+            stats[phase][0] += messages
+            stats[phase][1] += size
+        channel.stats = dict()
+    for process in processes:
+        process.join()
+    return stats
+
+# Determine the join attribute, the band column and the output columns of two tables
+def join_layout(table_name_1, table_name_2):
+    if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
+        return 1, 1, 'StartDate', 'HireDate', ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
+    elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
+        return 1, 1, 'HireDate', 'StartDate', ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
+    raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+
+def distributed_join(db1_path, db2_path, invert_join, max_days_diff, strategy, batch_size, sink='csv'):
+    log_file = "results.log"
+    setup_logging(log_file)
+    direction = "Large join Small" if invert_join else "Small join Large"
+    suffix = "large_join_small" if invert_join else "small_join_large"
+
+    for name in (STRATEGIES if strategy == 'all' else [strategy]):
+        result_type = f"Distributed {name.replace('_', ' ')} ({direction})"
+        logging.info(result_type)
+        # The semi-join drives from the other side, like semi_join.py
+        if (name == 'semi_join') != bool(invert_join):
+            first_db_path, second_db_path = db2_path, db1_path
+        else:
+            first_db_path, second_db_path = db1_path, db2_path
+        channels, processes, (table_name_1, table_name_2) = start_cluster(first_db_path, second_db_path)
+        join_index_table_1, join_index_table_2, timestamp_column_table_1, timestamp_column_table_2, columns = join_layout(table_name_1, table_name_2)
+        node_1, node_2 = channels
+
+        metrics = JoinMetrics(result_type)
+        metrics.start_phase('join')
+        with open_sink(sink, f"distributed_{name}_{suffix}.csv", columns) as writer:
+            if name == 'single_pass':
+                # Ship the build table to the main node, then stream the probe table through it
+                node_1.send('control', ('scan', f'build: {table_name_1} rows', timestamp_column_table_1, batch_size))
+                hash_table = build_band_index(receive_entries(node_1), join_index_table_1)
+                node_2.send('control', ('scan', f'probe: {table_name_2} rows', timestamp_column_table_2, batch_size))
+                for ordinal, row in receive_entries(node_2):
+                    for record in probe_band_index(hash_table, row[join_index_table_2], ordinal, max_days_diff):
+                        writer.writerow(record + row)
+                        metrics.add_rows()
+            elif name == 'pipelined':
+                # Both nodes stream at once; batches are consumed alternately and joined symmetrically
+                node_1.send('control', ('scan', f'stream: {table_name_1} rows', timestamp_column_table_1, batch_size))
+                node_2.send('control', ('scan', f'stream: {table_name_2} rows', timestamp_column_table_2, batch_size))
+                hash_tables = [dict(), dict()]
+                join_indexes = [join_index_table_1, join_index_table_2]
+                active = [True, True]
+                while active[0] or active[1]:
+                    for side, channel in enumerate(channels):
+                        if not active[side]:
+                            continue
+                        message = channel.recv()
+                        if message[0] == 'end':
+                            active[side] = False
+                            continue
+                        for ordinal, row in message[1]:
+                            key = row[join_indexes[side]]
+                            insert_into_band_index(hash_tables[side], key, ordinal, row)
+                            for record in probe_band_index(hash_tables[1 - side], key, ordinal, max_days_diff):
+                                writer.writerow(row + record if side == 0 else record + row)
+                                metrics.add_rows()
+            else:
+                # The probed node reduces its table with the driving node's keys; the driving node joins and ships the result
+                node_2.send('control', ('semi_join_reduce', 'Department', timestamp_column_table_2, batch_size))
+                node_1.send('control', ('semi_join_drive', 'Department', join_index_table_1, join_index_table_2,
+                                        timestamp_column_table_1, max_days_diff, batch_size))
+                for result in receive_entries(node_1):
+                    writer.writerow(result)
+                    metrics.add_rows()
+
+        metrics.end_phase('join')
+        stats = stop_cluster(channels, processes)
+        stats.pop('control', None)
+
+        for phase, (messages, size) in stats.items():
+            logging.info(f"Phase '{phase}': {messages} messages, {size} bytes")
+        transfer_messages = sum(messages for phase, (messages, _) in stats.items() if phase != 'result shipping')
+        transfer_bytes = sum(size for phase, (_, size) in stats.items() if phase != 'result shipping')
+        logging.info(f"Total transferred (excluding result shipping): {transfer_messages} messages, {transfer_bytes / (1024*1024):.4f} MB")
+        metrics.count('messages', transfer_messages)
+        metrics.finish(max_days_diff=max_days_diff, strategy=name, batch_size=batch_size,
+                       transfer={phase: {'messages': messages, 'bytes': size} for phase, (messages, size) in stats.items()})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform joins over a simulated cluster with one process per database node.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--strategy', type=str, default='all', choices=STRATEGIES + ['all'], help='Join strategy to run over the cluster. Default=all')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE, help='Number of rows per message.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    args = parser.parse_args()
+
+    distributed_join(args.db1, args.db2, args.invert_join, args.max_days_diff, args.strategy, args.batch_size, args.sink)
@@ -0,0 +1,255 @@
+import os
+import logging
+import argparse
+import sys
+import math
+import pickle
+import tempfile
+
+from band_index import build_band_index, probe_band_index
+from table_scan import connect_for_reading, scan_decoded
+from spill import PartitionFile, read_partition
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
+
+# Partitions are sized with some headroom so a partition does not overflow the budget
+PARTITION_FUDGE_FACTOR = 1.2
+# Maximum number of times a skewed partition is re-partitioned
+MAX_RECURSION_DEPTH = 3
+# Number of rows used to estimate the average row size
+SAMPLE_SIZE = 1000
+# Number of resident-partition probe rows joined per batch
+PROBE_BATCH_SIZE = 1024
+# Smallest number of rows buffered per spill file before a write
+MIN_SPILL_BATCH_SIZE = 16
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# Estimate the row count and average serialized row size of a table from a sample of rows
+def estimate_table_size(cursor, table_name, timestamp_column):
+    cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+    row_count = cursor.fetchone()[0]
+    sample = []
+    for entry in scan_decoded(cursor, table_name, timestamp_column):
+        sample.append(entry)
+        if len(sample) >= SAMPLE_SIZE:
+            break
+    if not sample:
+        return row_count, 0
+    average_row_bytes = len(pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL)) / len(sample)
+    return row_count, average_row_bytes
+
+# Number of partitions needed so that each one fits in the memory budget
+def partition_count(estimated_bytes, memory_budget_bytes):
+    return max(1, math.ceil(estimated_bytes * PARTITION_FUDGE_FACTOR / memory_budget_bytes))
+
+# Partition number of a join key; the depth salts the hash for recursive re-partitioning
+def partition_of(key, depth, num_partitions):
+    return hash((depth, key)) % num_partitions
+
+# Create a new spill file with a unique name inside the spill directory
+def new_partition_file(spill_directory, prefix, state):
+    state['spill_files'] += 1
+    return PartitionFile(os.path.join(spill_directory, f"{prefix}_{state['spill_files']}"), state['spill_batch_size'])
+
+# Probe a band index with (day ordinal, row) entries and write the matches
+def probe_and_write(hash_table, probe_entries, join_index, max_days_diff, writer, state):
+    metrics = state['metrics']
+    probes = 0
+    bisect_steps = 0
+    for probe_timestamp, row in probe_entries:
+        key = row[join_index]
+        probes += 1
+        if key in hash_table:
+            bisect_steps += 2 * len(hash_table[key][0]).bit_length()
+            for record in probe_band_index(hash_table, key, probe_timestamp, max_days_diff):
+                writer.writerow(record + row)
+                metrics.add_rows()
+    metrics.count('probes', probes)
+    metrics.count('estimated_bisect_steps', bisect_steps)
+
+# Join one spilled partition pair, re-partitioning it first if it exceeds the budget
+def join_partition(build_path, probe_path, build_bytes, depth, join_index_build, join_index_probe,
+                   max_days_diff, memory_budget_bytes, spill_directory, writer, state):
+    if build_bytes > memory_budget_bytes and depth < MAX_RECURSION_DEPTH:
+        num_partitions = partition_count(build_bytes, memory_budget_bytes)
+        build_files = [new_partition_file(spill_directory, 'build', state) for _ in range(num_partitions)]
+        keys = set()
+        for ordinal, row in read_partition(build_path):
+            key = row[join_index_build]
+            keys.add(key)
+            build_files[partition_of(key, depth, num_partitions)].append((ordinal, row))
+        for partition_file in build_files:
+            partition_file.close()
+
+        # A single hot key cannot be split any further
+        if len(keys) > 1:
+            state['repartitions'] += 1
+            logging.info(f"Re-partitioning a {build_bytes / (1024*1024):.4f} MB partition into {num_partitions} partitions at depth {depth}")
+            probe_files = [new_partition_file(spill_directory, 'probe', state) for _ in range(num_partitions)]
+            for ordinal, row in read_partition(probe_path):
+                probe_files[partition_of(row[join_index_probe], depth, num_partitions)].append((ordinal, row))
+            for partition_file in probe_files:
+                partition_file.close()
+            os.remove(build_path)
+            if os.path.exists(probe_path):
+                os.remove(probe_path)
+
+            for build_file, probe_file in zip(build_files, probe_files):
+                if build_file.count == 0 or probe_file.count == 0:
+                    continue
+                join_partition(build_file.path, probe_file.path, build_file.bytes_written, depth + 1, join_index_build,
+                               join_index_probe, max_days_diff, memory_budget_bytes, spill_directory, writer, state)
+            return
+
+        for partition_file in build_files:
+            if os.path.exists(partition_file.path):
+                os.remove(partition_file.path)
+        logging.info(f"Partition with a single key exceeds the memory budget ({build_bytes / (1024*1024):.4f} MB), joining it in memory")
+
+    hash_table = build_band_index(read_partition(build_path), join_index_build)
+    state['max_partition_bytes'] = max(state['max_partition_bytes'], build_bytes)
+    probe_and_write(hash_table, read_partition(probe_path), join_index_probe, max_days_diff, writer, state)
+
+def grace_hash_join(db1_path, db2_path, invert_join, max_days_diff, memory_budget_mb, sink='csv'):
+    if invert_join:
+        hash_db_path = db2_path
+        probe_db_path = db1_path
+        csv_file = "grace_hash_join_large_join_small.csv"
+        result_type = "Hybrid grace hash join (Large join Small)"
+    else:
+        hash_db_path = db1_path
+        probe_db_path = db2_path
+        csv_file = "grace_hash_join_small_join_large.csv"
+        result_type = "Hybrid grace hash join (Small join Large)"
+
+    log_file = "results.log"
+    setup_logging(log_file)
+    logging.info(result_type)
+
+    conn1 = connect_for_reading(hash_db_path)
+    conn2 = connect_for_reading(probe_db_path)
+    cursor1 = conn1.cursor()
+    cursor2 = conn2.cursor()
+
+    # Fetch the table names
+    cursor1.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_1 = cursor1.fetchone()[0]
+    cursor2.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_2 = cursor2.fetchone()[0]
+
+    # Determine the join attribute and its index in each table
+    if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
+        join_index_table_1 = 1  # Department is the second column in Projects table
+        join_index_table_2 = 1  # Department is the second column in Employees table
+        timestamp_column_table_1 = 'StartDate'
+        timestamp_column_table_2 = 'HireDate'
+        columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
+    elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
+        join_index_table_1 = 1  # Department is the second column in Employees table
+        join_index_table_2 = 1  # Department is the second column in Projects table
+        timestamp_column_table_1 = 'HireDate'
+        timestamp_column_table_2 = 'StartDate'
+        columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
+    else:
+        raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+
+    memory_budget_bytes = int(memory_budget_mb * 1024 * 1024)
+    build_row_count, average_row_bytes = estimate_table_size(cursor1, table_name_1, timestamp_column_table_1)
+    estimated_build_bytes = int(build_row_count * average_row_bytes)
+    num_partitions = partition_count(estimated_build_bytes, memory_budget_bytes)
+    # The write buffers of all spill files together stay within the memory budget
+    spill_batch_size = max(MIN_SPILL_BATCH_SIZE, int(memory_budget_bytes / (num_partitions * max(average_row_bytes, 1))))
+    logging.info(f"Estimated build side size: {estimated_build_bytes / (1024*1024):.4f} MB, memory budget: {memory_budget_mb:.4f} MB, partitions: {num_partitions}")
+
+    metrics = JoinMetrics(result_type)
+    state = {'metrics': metrics, 'repartitions': 0, 'max_partition_bytes': 0, 'spill_files': 0,
+             'spill_batch_size': spill_batch_size}
+
+    with tempfile.TemporaryDirectory(prefix='grace_hash_join_') as spill_directory:
+        metrics.start_phase('build')
+
+        # Partition the build side; partition 0 stays resident (hybrid hash join)
+        logging.info("Partitioning build side on the main node...")
+        resident_entries = []
+        build_files = [None] + [new_partition_file(spill_directory, 'build', state) for _ in range(1, num_partitions)]
+        for ordinal, row in scan_decoded(cursor1, table_name_1, timestamp_column_table_1):
+            partition = partition_of(row[join_index_table_1], 0, num_partitions)
+            if partition == 0:
+                resident_entries.append((ordinal, row))
+            else:
+                build_files[partition].append((ordinal, row))
+        for partition_file in build_files[1:]:
+            partition_file.close()
+        hash_table = build_band_index(resident_entries, join_index_table_1)
+        resident_bytes = len(pickle.dumps(hash_table))
+        state['max_partition_bytes'] = resident_bytes
+        del resident_entries
+
+        build_time = metrics.end_phase('build')
+        spilled_build_bytes = sum(partition_file.bytes_written for partition_file in build_files[1:])
+        logging.info(f"Build phase completed in {build_time:.4f} seconds")
+        logging.info(f"Resident partition memory: {resident_bytes / (1024*1024):.4f} MB, spilled build bytes: {spilled_build_bytes}")
+
+        metrics.start_phase('probe')
+
+        logging.info(f"Performing probe phase with {table_name_2} table...")
+        with open_sink(sink, csv_file, columns) as writer:
+
+            # Probe the resident partition right away and spill the rest of the probe side
+            probe_files = [None] + [new_partition_file(spill_directory, 'probe', state) for _ in range(1, num_partitions)]
+            resident_probe_entries = []
+            for ordinal, row in scan_decoded(cursor2, table_name_2, timestamp_column_table_2):
+                partition = partition_of(row[join_index_table_2], 0, num_partitions)
+                if partition == 0:
+                    resident_probe_entries.append((ordinal, row))
+                    if len(resident_probe_entries) >= PROBE_BATCH_SIZE:
+                        probe_and_write(hash_table, resident_probe_entries, join_index_table_2, max_days_diff, writer, state)
+                        resident_probe_entries = []
+                else:
+                    probe_files[partition].append((ordinal, row))
+            probe_and_write(hash_table, resident_probe_entries, join_index_table_2, max_days_diff, writer, state)
+            for partition_file in probe_files[1:]:
+                partition_file.close()
+            del hash_table
+
+            # Join the spilled partition pairs one at a time
+            for build_file, probe_file in zip(build_files[1:], probe_files[1:]):
+                if build_file.count == 0 or probe_file.count == 0:
+                    continue
+                join_partition(build_file.path, probe_file.path, build_file.bytes_written, 1, join_index_table_1,
+                               join_index_table_2, max_days_diff, memory_budget_bytes, spill_directory, writer, state)
+
+        probe_time = metrics.end_phase('probe')
+        spilled_probe_bytes = sum(partition_file.bytes_written for partition_file in probe_files[1:])
+        logging.info(f"Probe phase completed in {probe_time:.4f} seconds")
+        logging.info(f"Spilled probe bytes: {spilled_probe_bytes}, re-partitioned partitions: {state['repartitions']}")
+
+    logging.info(f"Largest resident partition memory: {state['max_partition_bytes'] / (1024*1024):.4f} MB")
+    metrics.count('spill files', state['spill_files'])
+    metrics.count('repartitions', state['repartitions'])
+    metrics.finish(max_days_diff=max_days_diff, memory_budget_mb=memory_budget_mb,
+                   spilled_bytes={'build': spilled_build_bytes, 'probe': spilled_probe_bytes})
+
+    # Close the connections
+    conn1.close()
+    conn2.close()
+
+    return metrics.rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform a Hybrid Grace Hash Join between two SQLite databases under a memory budget.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--memory_budget_mb', type=float, default=0.25, help='Memory budget in MB for the resident build-side partition.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    args = parser.parse_args()
+
+    grace_hash_join(args.db1, args.db2, args.invert_join, args.max_days_diff, args.memory_budget_mb, args.sink)
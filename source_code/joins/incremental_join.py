@@ -0,0 +1,235 @@
+import os
+import logging
+import argparse
+import sys
+import pickle
+import hashlib
+
+from band_index import build_band_index, merge_band_index, probe_band_index
+from table_scan import connect_for_reading, scan_decoded
+from sinks import open_sink, sink_path, output_size, SINKS
+from instrumentation import JoinMetrics
+from index_cache import database_signature
+
+# File the join state is kept in between runs
+DEFAULT_STATE_FILE = "incremental_join_state.pkl"
+# Layout version of the state file; a state of another version is rebuilt from scratch
+STATE_VERSION = 3
+# Row hashes are summed modulo this, so a fingerprint does not depend on the row order
+FINGERPRINT_MODULUS = 1 << 128
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# Largest rowid of a table (0 when empty)
+def high_water_mark(cursor, table_name):
+    cursor.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table_name}")
+    return cursor.fetchone()[0]
+
+# Fingerprint of the rows with low < rowid <= high: their count and the sum of a 128-bit hash of every
+# row with its rowid. Any update, delete or insert in the range changes it. The sum does not depend on
+# the order, so the fingerprint of a table's prefix is extended with that of the rows appended after it
+# (see extend_fingerprint) instead of being computed again.
+def rows_fingerprint(cursor, table_name, low, high):
+    cursor.execute(f"SELECT rowid, * FROM {table_name} WHERE rowid > ? AND rowid <= ?", (low, high))
+    count = 0
+    checksum = 0
+    for row in cursor:
+        count += 1
+        checksum += int.from_bytes(hashlib.blake2b(repr(row).encode(), digest_size=16).digest(), 'little')
+    return count, checksum % FINGERPRINT_MODULUS
+
+def extend_fingerprint(fingerprint, delta):
+    return fingerprint[0] + delta[0], (fingerprint[1] + delta[1]) % FINGERPRINT_MODULUS
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'rb') as file:
+        return pickle.load(file)
+
+# Write the state to a temporary file and rename it, so an interrupted run keeps the previous state.
+# Only the state file is replaced atomically: the new rows are appended to the output before it is
+# saved, so the state records the output's size (see output_size in sinks.py, e.g. the CSV file's
+# byte size) and a run whose output has another size (e.g. one interrupted between the two) starts
+# from scratch instead of appending again.
+def save_state(state, state_file):
+    temporary_file = state_file + '.tmp'
+    with open(temporary_file, 'wb') as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_file, state_file)
+
+# Return why a stored state cannot be extended with the new rows, or None if it can. The rows below
+# the high-water mark of a table are only hashed again when its database file changed since the last run.
+def stale_reason(state, parameters, db_paths, cursors, table_names, sink, output_file):
+    if state is None:
+        return "no stored state"
+    if state['version'] != STATE_VERSION:
+        return f"state version {state['version']} instead of {STATE_VERSION}"
+    if state['parameters'] != parameters:
+        return "the state was built with other parameters"
+    output_path = sink_path(sink, output_file)
+    if output_path is not None:
+        if not os.path.exists(output_path):
+            return f"{output_path} is missing"
+        if output_size(sink, output_file) != state['output_size']:
+            return f"{output_path} changed since the state was saved"
+    for db_path, cursor, table_name, mark, fingerprint, signature in zip(db_paths, cursors, table_names, state['high_water_marks'],
+                                                                         state['fingerprints'], state['signatures']):
+        if database_signature(db_path, 'mtime') == signature:
+            continue
+        if rows_fingerprint(cursor, table_name, 0, mark) != fingerprint:
+            return f"{table_name} changed below rowid {mark}"
+    return None
+
+# Band join maintained incrementally under appends. The band indexes of both tables and a rowid
+# high-water mark per table are persisted; each run joins only the rows appended since the last one,
+# as ΔR⋈S ∪ R⋈ΔS ∪ ΔR⋈ΔS, and appends the matches to the existing result. Updates and deletes
+# below the high-water mark are not maintained: the fingerprint of the rows below the mark detects
+# them, at the cost of hashing those rows again whenever the database file changed, and the join is
+# then recomputed from scratch.
+def incremental_join(db1_path, db2_path, max_days_diff, state_file=DEFAULT_STATE_FILE, sink='csv', reset=False):
+    csv_file = "incremental_join.csv"
+    result_type = "Incremental join"
+
+    log_file = "results.log"
+    setup_logging(log_file)
+    logging.info(result_type)
+
+    conn1 = connect_for_reading(db1_path)
+    conn2 = connect_for_reading(db2_path)
+    cursor1 = conn1.cursor()
+    cursor2 = conn2.cursor()
+
+    # Fetch the table names
+    cursor1.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_1 = cursor1.fetchone()[0]
+    cursor2.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_2 = cursor2.fetchone()[0]
+
+    # Determine the join attribute and its index in each table
+    if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
+        join_index_table_1 = 1  # Department is the second column in Projects table
+        join_index_table_2 = 1  # Department is the second column in Employees table
+        timestamp_column_table_1 = 'StartDate'
+        timestamp_column_table_2 = 'HireDate'
+        columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
+    elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
+        join_index_table_1 = 1  # Department is the second column in Employees table
+        join_index_table_2 = 1  # Department is the second column in Projects table
+        timestamp_column_table_1 = 'HireDate'
+        timestamp_column_table_2 = 'StartDate'
+        columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
+    else:
+        raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+
+    db_paths = [db1_path, db2_path]
+    cursors = [cursor1, cursor2]
+    table_names = [table_name_1, table_name_2]
+    parameters = {'db1': os.path.abspath(db1_path), 'db2': os.path.abspath(db2_path), 'max_days_diff': max_days_diff,
+                  'sink': sink, 'output': os.path.abspath(csv_file)}
+
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('load state')
+
+    # The signatures are taken before anything is read, so that a change made during this run is checked by the next one
+    signatures = [database_signature(db_path, 'mtime') for db_path in db_paths]
+    state = None if reset else load_state(state_file)
+    reason = "reset requested" if reset else stale_reason(state, parameters, db_paths, cursors, table_names, sink, csv_file)
+    if reason is not None:
+        logging.info(f"Computing the join from scratch: {reason}")
+        state = {'version': STATE_VERSION, 'parameters': parameters, 'high_water_marks': [0, 0],
+                 'fingerprints': [(0, 0), (0, 0)], 'signatures': [None, None], 'indexes': [dict(), dict()], 'rows': 0,
+                 'output_size': None}
+    index_1, index_2 = state['indexes']
+
+    load_time = metrics.end_phase('load state')
+    logging.info(f"State loaded in {load_time:.4f} seconds")
+
+    metrics.start_phase('delta scan')
+
+    # Only the rows between the stored and the current high-water mark are read
+    old_marks = state['high_water_marks']
+    new_marks = [high_water_mark(cursor, table_name) for cursor, table_name in zip(cursors, table_names)]
+    delta_1 = list(scan_decoded(cursor1, table_name_1, timestamp_column_table_1, "rowid > ? AND rowid <= ?", (old_marks[0], new_marks[0])))
+    delta_2 = list(scan_decoded(cursor2, table_name_2, timestamp_column_table_2, "rowid > ? AND rowid <= ?", (old_marks[1], new_marks[1])))
+    logging.info(f"New rows: {len(delta_1)} in {table_name_1} (rowid {old_marks[0]} -> {new_marks[0]}), "
+                 f"{len(delta_2)} in {table_name_2} (rowid {old_marks[1]} -> {new_marks[1]})")
+
+    scan_time = metrics.end_phase('delta scan')
+    logging.info(f"Delta scan completed in {scan_time:.4f} seconds")
+
+    metrics.start_phase('delta join')
+
+    delta_index_1 = build_band_index(delta_1, join_index_table_1)
+    matches = {'delta R join S': 0, 'R join delta S': 0, 'delta R join delta S': 0}
+    with open_sink(sink, csv_file, columns, append=reason is None) as writer:
+        # ΔR⋈S: new rows of the first table against the stored rows of the second
+        for ordinal, row in delta_1:
+            for record in probe_band_index(index_2, row[join_index_table_1], ordinal, max_days_diff):
+                writer.writerow(row + record)
+                matches['delta R join S'] += 1
+                metrics.add_rows()
+        # R⋈ΔS and ΔR⋈ΔS: new rows of the second table against the stored and the new rows of the first
+        for ordinal, row in delta_2:
+            key = row[join_index_table_2]
+            for record in probe_band_index(index_1, key, ordinal, max_days_diff):
+                writer.writerow(record + row)
+                matches['R join delta S'] += 1
+                metrics.add_rows()
+            for record in probe_band_index(delta_index_1, key, ordinal, max_days_diff):
+                writer.writerow(record + row)
+                matches['delta R join delta S'] += 1
+                metrics.add_rows()
+
+    join_time = metrics.end_phase('delta join')
+    logging.info(f"Delta join completed in {join_time:.4f} seconds")
+    for term, count in matches.items():
+        logging.info(f"{term}: {count} rows")
+
+    metrics.start_phase('save state')
+
+    # Fold the new rows into the stored indexes and move the high-water marks
+    merge_band_index(index_1, delta_index_1)
+    merge_band_index(index_2, build_band_index(delta_2, join_index_table_2))
+    state['high_water_marks'] = new_marks
+    state['fingerprints'] = [extend_fingerprint(fingerprint, rows_fingerprint(cursor, table_name, old_mark, new_mark))
+                             for fingerprint, cursor, table_name, old_mark, new_mark
+                             in zip(state['fingerprints'], cursors, table_names, old_marks, new_marks)]
+    state['signatures'] = signatures
+    state['rows'] += metrics.rows
+    state['output_size'] = output_size(sink, csv_file)
+    save_state(state, state_file)
+
+    save_time = metrics.end_phase('save state')
+    logging.info(f"State saved to {state_file} ({os.path.getsize(state_file) / (1024*1024):.4f} MB) in {save_time:.4f} seconds")
+    logging.info(f"Result now holds {state['rows']} rows")
+
+    metrics.count('new rows', len(delta_1) + len(delta_2))
+    metrics.count('probes', len(delta_1) + 2 * len(delta_2))
+    for term, count in matches.items():
+        metrics.count(term, count)
+    metrics.finish(max_days_diff=max_days_diff, recomputed=reason is not None, high_water_marks=new_marks,
+                   total_rows=state['rows'], state_bytes=os.path.getsize(state_file))
+
+    # Close the connections
+    conn1.close()
+    conn2.close()
+
+    return metrics.rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain a band join between two SQLite databases incrementally as rows are appended.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--state_file', type=str, default=DEFAULT_STATE_FILE, help='File the join state is kept in between runs.')
+    parser.add_argument('--reset', action='store_true', help='Discard the stored state and recompute the join from scratch.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    args = parser.parse_args()
+
+    incremental_join(args.db1, args.db2, args.max_days_diff, args.state_file, args.sink, args.reset)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from collections.abc import Mapping
+
+import numpy as np
+
+from band_index import build_band_index
+from table_scan import scan_decoded
+
+# Bumped whenever the on-disk layout changes, which invalidates all entries
+CACHE_FORMAT_VERSION = 1
+# Default cap on the total size of the cache directory
+DEFAULT_CACHE_MB = 512
+# Files are hashed in blocks of this size when validating by content
+HASH_BLOCK_BYTES = 1 << 20
+# How an entry is checked against its database: file size and mtime, or a hash of the file content.
+# PRAGMA data_version only changes within the lifetime of one connection, so it cannot tell
+# whether the file changed between two runs.
+VALIDATION_MODES = ['mtime', 'hash']
+
+# Signature of the database file an entry was built from
+def database_signature(db_path, validation):
+    paths = [db_path] + [db_path + suffix for suffix in ('-wal',) if os.path.exists(db_path + suffix)]
+    if validation == 'hash':
+        digest = hashlib.blake2b(digest_size=16)
+        for path in paths:
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(HASH_BLOCK_BYTES), b''):
+                    digest.update(block)
+        return {'hash': digest.hexdigest()}
+    return {'files': [[os.path.getsize(path), os.stat(path).st_mtime_ns] for path in paths]}
+
+# Directory of the entry for one table, join column and date column of a database
+def entry_directory(cache_directory, db_path, table_name, join_index, timestamp_column):
+    name = f"{os.path.abspath(db_path)}|{table_name}|{join_index}|{timestamp_column}|{CACHE_FORMAT_VERSION}"
+    return os.path.join(cache_directory, f"{table_name}_{hashlib.blake2b(name.encode(), digest_size=8).hexdigest()}")
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+# Signature recorded in an entry's meta file, or None when there is no complete entry
+def read_signature(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as file:
+            return json.load(file)['signature']
+    except (OSError, ValueError):
+        return None
+
+# Band index stored as a key directory (sorted keys and bucket offsets) plus contiguous arrays of day
+# ordinals and payload columns sorted by (key, ordinal), all memory-mapped. A bucket is turned into
+# the (ordinals, rows) lists of an in-memory band index the first time its key is looked up, so opening
+# the index costs only the key directory and the pages of untouched buckets are never read.
+class MappedBandIndex(Mapping):
+    def __init__(self, path):
+        self.keys = np.load(os.path.join(path, 'keys.npy')).tolist()
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.ordinals = np.load(os.path.join(path, 'ordinals.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'meta.json')) as file:
+            num_columns = json.load(file)['columns']
+        self.columns = [np.load(os.path.join(path, f'column_{column}.npy'), mmap_mode='r') for column in range(num_columns)]
+        self.buckets = dict()
+
+    def __getitem__(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            position = self.positions[key]
+            low, high = int(self.offsets[position]), int(self.offsets[position + 1])
+            rows = list(zip(*[column[low:high].tolist() for column in self.columns]))
+            bucket = (self.ordinals[low:high].tolist(), rows)
+            self.buckets[key] = bucket
+        return bucket
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+# Write a band index as a cache entry. The entry is written to a temporary directory and renamed,
+# so other processes only ever see complete entries; when several processes write the same entry at
+# once, the first rename wins and the others keep it. Returns False if a column cannot be stored
+# as a plain array (e.g. it holds NULLs or mixed types).
+def write_entry(path, band_index, signature):
+    keys = sorted(band_index)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    ordinals = []
+    rows = []
+    for position, key in enumerate(keys):
+        bucket_ordinals, bucket_rows = band_index[key]
+        ordinals.extend(bucket_ordinals)
+        rows.extend(bucket_rows)
+        offsets[position + 1] = len(ordinals)
+    arrays = {'keys': np.array(keys), 'offsets': offsets, 'ordinals': np.array(ordinals, dtype=np.int32)}
+    for column, values in enumerate(zip(*rows)):
+        arrays[f'column_{column}'] = np.array(values)
+    if any(array.dtype == object for array in arrays.values()):
+        return False
+
+    temporary_path = f"{path}.tmp{os.getpid()}"
+    stale_path = f"{path}.stale{os.getpid()}"
+    try:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        os.makedirs(temporary_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(temporary_path, f"{name}.npy"), array)
+        with open(os.path.join(temporary_path, 'meta.json'), 'w') as file:
+            json.dump({'signature': signature, 'columns': len(arrays) - 3, 'rows': len(rows), 'created': time.time()}, file)
+        if read_signature(path) == signature:
+            # Another process installed the same entry while this one was building it
+            return True
+        # A stale entry is moved aside first; if another process already moved it, there is nothing to do
+        try:
+            os.replace(path, stale_path)
+        except OSError:
+            pass
+        try:
+            os.replace(temporary_path, path)
+        except OSError:
+            # Another process installed its entry in between; it is complete, so it is kept and ours dropped
+            if not os.path.exists(os.path.join(path, 'meta.json')):
+                raise
+            logging.info(f"Index cache entry {path} was written concurrently by another process")
+    finally:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        shutil.rmtree(stale_path, ignore_errors=True)
+    return True
+
+# Remove least recently used entries until the cache fits in max_bytes; the entry in use is kept
+def evict(cache_directory, max_bytes, keep):
+    entries = []
+    for name in os.listdir(cache_directory):
+        # Temporary and moved-aside directories of writers in flight are theirs to remove
+        if '.tmp' in name or '.stale' in name:
+            continue
+        path = os.path.join(cache_directory, name)
+        meta_file = os.path.join(path, 'meta.json')
+        try:
+            if os.path.isdir(path) and os.path.exists(meta_file):
+                entries.append((os.stat(meta_file).st_mtime, path, directory_bytes(path)))
+        except OSError:
+            # Removed or replaced by another process while listing
+            continue
+    total = sum(size for _, _, size in entries)
+    for _, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path != keep:
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logging.info(f"Evicted index cache entry {path} ({size / (1024*1024):.4f} MB)")
+
+# Return the band index of a table, from the cache when a valid entry exists, otherwise built from a
+# scan and written to the cache. Returns the index and whether it came from the cache.
+def cached_band_index(cursor, db_path, table_name, join_index, timestamp_column, cache_directory,
+                      max_cache_mb=DEFAULT_CACHE_MB, validation='mtime'):
+    os.makedirs(cache_directory, exist_ok=True)
+    path = entry_directory(cache_directory, db_path, table_name, join_index, timestamp_column)
+    signature = database_signature(db_path, validation)
+    meta_file = os.path.join(path, 'meta.json')
+    cached_signature = read_signature(path)
+    if cached_signature == signature:
+        # The meta file's mtime is the entry's last use, for the LRU eviction
+        os.utime(meta_file)
+        return MappedBandIndex(path), True
+    if cached_signature is not None:
+        logging.info(f"Index cache entry for {table_name} is stale")
+
+    band_index = build_band_index(scan_decoded(cursor, table_name, timestamp_column), join_index)
+    if write_entry(path, band_index, signature):
+        logging.info(f"Wrote index cache entry {path} ({directory_bytes(path) / (1024*1024):.4f} MB)")
+        evict(cache_directory, max_cache_mb * 1024 * 1024, path)
+    else:
+        logging.info(f"{table_name} has columns that cannot be cached as arrays; index not cached")
+    return band_index, False
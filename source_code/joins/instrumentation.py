@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import logging
+import resource
+import tracemalloc
+from collections import Counter
+
+import psutil
+from pympler import asizeof
+
+# Structured records are appended here, one JSON object per line, next to results.log
+METRICS_FILE = "results.jsonl"
+# tracemalloc slows allocation-heavy code down several times and Pympler walks every object,
+# so both only run when JOIN_TRACE_MEMORY=1; peak RSS is always recorded
+TRACE_MEMORY = os.environ.get('JOIN_TRACE_MEMORY') == '1'
+
+# Peak resident set size of this process so far, in bytes (ru_maxrss is in KB on Linux)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# Start a new peak RSS scope, so that a run in a long-lived process is not charged for the peak of an
+# earlier one. Writing 5 to /proc/self/clear_refs (Linux 4.0+) resets the peak to the current RSS.
+# Returns False where this is not possible; peak_rss() is then the peak of the whole process.
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+# Phase timings, counters, time to first row and memory of one join run
+class JoinMetrics:
+    def __init__(self, name, trace_memory=TRACE_MEMORY):
+        self.name = name
+        self.phases = dict()
+        self.phase_starts = dict()
+        self.counters = Counter()
+        self.structures = dict()
+        self.rows = 0
+        self.first_row_ns = None
+        self.process = psutil.Process()
+        self.start_rss = self.process.memory_info().rss
+        # Only trace if nobody else (e.g. an enclosing run) already is
+        self.trace_memory = trace_memory and not tracemalloc.is_tracing()
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start_ns = time.perf_counter_ns()
+
+    def start_phase(self, phase):
+        self.phase_starts[phase] = time.perf_counter_ns()
+
+    # End a phase and return its duration in seconds; a phase run several times accumulates
+    def end_phase(self, phase):
+        elapsed = time.perf_counter_ns() - self.phase_starts.pop(phase)
+        self.phases[phase] = self.phases.get(phase, 0) + elapsed
+        return elapsed / 1e9
+
+    def count(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    # Record result rows; the first call fixes the time to first row. Rows produced elsewhere
+    # (e.g. by a worker process) pass the perf_counter_ns() at which their first row was written.
+    def add_rows(self, amount=1, first_row_ns=None):
+        self.rows += amount
+        if first_row_ns is not None:
+            if amount and (self.first_row_ns is None or first_row_ns < self.first_row_ns):
+                self.first_row_ns = first_row_ns
+        elif self.first_row_ns is None and amount:
+            self.first_row_ns = time.perf_counter_ns()
+
+    # Register a data structure whose deep size is recorded when memory tracing is on. The size is
+    # taken in finish(), after tracing stops, so that walking the structure does not count as peak.
+    def measure(self, name, structure):
+        if self.trace_memory:
+            self.structures[name] = structure
+
+    # Log the summary, append the JSON record and return it
+    def finish(self, **fields):
+        end_ns = time.perf_counter_ns()
+        peak_rss_bytes = peak_rss()
+        traced_peak = None
+        if self.trace_memory:
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        structure_bytes = {name: asizeof.asizeof(structure) for name, structure in self.structures.items()}
+        self.structures = dict()
+        total_ns = sum(self.phases.values()) if self.phases else end_ns - self.start_ns
+        record = {
+            'name': self.name,
+            'timestamp': time.time(),
+            'rows': self.rows,
+            'phases': {phase: elapsed / 1e9 for phase, elapsed in self.phases.items()},
+            'total_seconds': total_ns / 1e9,
+            'time_to_first_row': (self.first_row_ns - self.start_ns) / 1e9 if self.first_row_ns is not None else None,
+            'rows_per_second': self.rows / (total_ns / 1e9) if total_ns else 0.0,
+            'counters': dict(self.counters),
+            'start_rss_bytes': self.start_rss,
+            'peak_rss_bytes': peak_rss_bytes,
+            'traced_peak_bytes': traced_peak,
+            'structure_bytes': structure_bytes,
+        }
+        record.update(fields)
+
+        logging.info(f"Join produced {self.rows} rows")
+        if record['time_to_first_row'] is not None:
+            logging.info(f"Time until the first record was extracted: {record['time_to_first_row']:.4f} seconds")
+        else:
+            logging.info("No records were extracted.")
+        logging.info(f"Throughput: {record['rows_per_second']:.0f} rows/second")
+        if self.counters:
+            logging.info(f"Counters: {', '.join(f'{counter}={value}' for counter, value in self.counters.items())}")
+        logging.info(f"Peak RSS: {record['peak_rss_bytes'] / (1024*1024):.4f} MB "
+                     f"(growth {max(0, record['peak_rss_bytes'] - self.start_rss) / (1024*1024):.4f} MB)")
+        if traced_peak is not None:
+            logging.info(f"Peak traced memory: {traced_peak / (1024*1024):.4f} MB")
+        for name, size in structure_bytes.items():
+            logging.info(f"{name[0].upper()}{name[1:]} memory: {size / (1024*1024):.4f} MB")
+        logging.info(f"Total execution time: {record['total_seconds']:.4f} seconds")
+        logging.info('-'*50)
+
+        with open(METRICS_FILE, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+        return record
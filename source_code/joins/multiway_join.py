@@ -0,0 +1,437 @@
+import os
+import logging
+import argparse
+import sys
+from itertools import combinations
+from operator import itemgetter
+
+from band_index import build_keyed_band_index, insert_into_band_index, probe_band_index
+from table_scan import connect_for_reading, table_columns, date_column_expressions, DEFAULT_BATCH_SIZE
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
+
+PLAN_SHAPES = ['bushy', 'left-deep']
+OPERATORS = ['auto', 'hash', 'pipelined', 'semi']
+# In auto mode a base table on the build side is reduced by a semi-join first when fewer than this
+# fraction of its rows are expected to have a key present on the other side
+SEMI_JOIN_CONTAINMENT = 0.5
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# Parse a 'Table.Column=Table.Column' predicate into two (table, column) pairs
+def parse_predicate(value):
+    sides = value.split('=')
+    if len(sides) != 2 or any(side.count('.') != 1 for side in sides):
+        raise argparse.ArgumentTypeError(f"Expected 'Table.Column=Table.Column', got {value!r}.")
+    return tuple(tuple(part.strip() for part in side.split('.')) for side in sides)
+
+# Resolve a 'path' or 'path:table' specification to (db path, table name); a bare path
+# names the first table of the database, as in the two-table joins
+def resolve_table(specification):
+    db_path, table_name = specification, None
+    if not os.path.exists(specification) and ':' in specification:
+        db_path, table_name = specification.rsplit(':', 1)
+    if table_name is None:
+        conn = connect_for_reading(db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        table_name = cursor.fetchone()[0]
+        conn.close()
+    return db_path, table_name
+
+# Gather the schema and statistics of a table: its columns from PRAGMA table_info, the row count,
+# the distinct values of its key columns and the date span in days of its band columns
+def table_statistics(db_path, table_name, key_columns, band_columns):
+    conn = connect_for_reading(db_path)
+    cursor = conn.cursor()
+    columns = table_columns(cursor, table_name)
+    types = dict(columns)
+    for name in list(key_columns) + list(band_columns):
+        if name not in types:
+            raise ValueError(f"Column {name} not found in table {table_name}.")
+    aggregates = ["COUNT(*)"] + [f"COUNT(DISTINCT {name})" for name in key_columns]
+    for name in band_columns:
+        ordinal_expression, _ = date_column_expressions(name, types[name])
+        aggregates.append(f"MAX({ordinal_expression}) - MIN({ordinal_expression}) + 1")
+    cursor.execute(f"SELECT {', '.join(aggregates)} FROM {table_name}")
+    values = cursor.fetchone()
+    conn.close()
+    return {
+        'db_path': db_path,
+        'columns': columns,
+        'rows': values[0],
+        'distinct': dict(zip(key_columns, values[1:1 + len(key_columns)])),
+        'date_span': {name: span or 1 for name, span in zip(band_columns, values[1 + len(key_columns):])},
+    }
+
+# Base of the plan operators. Rows are plain tuples laid out as self.columns: (table, column) pairs,
+# plus (table, column, 'ordinal') for the day ordinal of every band column, which the join
+# operators use and the final projection drops.
+class Operator:
+    estimated_rows = 0
+    actual_rows = 0
+
+    # Yield the rows of the operator, counting them
+    def stream(self):
+        self.actual_rows = 0
+        for row in self.rows():
+            self.actual_rows += 1
+            yield row
+
+    def children(self):
+        return []
+
+    # Scan operators of the subtree by table name
+    def scans(self):
+        found = dict()
+        for child in self.children():
+            found.update(child.scans())
+        return found
+
+# Stream a table in batches from its own connection. A semi-join may restrict the scan to the rows
+# whose reduction column holds one of a set of keys.
+class Scan(Operator):
+    def __init__(self, db_path, table_name, columns, band_columns, estimated_rows):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.estimated_rows = estimated_rows
+        self.select_list = []
+        self.columns = []
+        ordinal_list = []
+        ordinal_columns = []
+        for name, declared_type in columns:
+            if name in band_columns:
+                ordinal_expression, rendered = date_column_expressions(name, declared_type)
+                self.select_list.append(rendered)
+                ordinal_list.append(ordinal_expression)
+                ordinal_columns.append((table_name, name, 'ordinal'))
+            else:
+                self.select_list.append(name)
+            self.columns.append((table_name, name))
+        self.select_list += ordinal_list
+        self.columns += ordinal_columns
+        self.reduction = None
+
+    def rows(self):
+        conn = connect_for_reading(self.db_path)
+        cursor = conn.cursor()
+        query = f"SELECT {', '.join(self.select_list)} FROM {self.table_name}"
+        if self.reduction is not None:
+            # The keys go through a temporary table, so their number is not bound by SQLite's parameter limit
+            column, keys = self.reduction
+            cursor.execute("CREATE TEMP TABLE semi_join_keys (value PRIMARY KEY)")
+            cursor.executemany("INSERT OR IGNORE INTO semi_join_keys VALUES (?)", ((key,) for key in keys))
+            query += f" WHERE {column} IN (SELECT value FROM temp.semi_join_keys)"
+        cursor.execute(query)
+        try:
+            while True:
+                batch = cursor.fetchmany(DEFAULT_BATCH_SIZE)
+                if not batch:
+                    return
+                yield from batch
+        finally:
+            conn.close()
+
+    def scans(self):
+        return {self.table_name: self}
+
+    def describe(self):
+        return f"Scan {self.table_name}"
+
+# Base of the binary joins: equality predicates form the join key and the first band predicate is
+# answered by the band index; any further band predicates are checked on the joined rows
+class Join(Operator):
+    name = 'Join'
+
+    def __init__(self, left, right, keys, bands, max_days_diff, estimated_rows):
+        self.left = left
+        self.right = right
+        self.keys = keys
+        self.bands = bands
+        self.max_days_diff = max_days_diff
+        self.estimated_rows = estimated_rows
+        self.columns = left.columns + right.columns
+        self.left_key = itemgetter(*[left.columns.index(left_column) for left_column, _ in keys])
+        self.right_key = itemgetter(*[right.columns.index(right_column) for _, right_column in keys])
+        if bands:
+            self.left_ordinal = itemgetter(left.columns.index(bands[0][0] + ('ordinal',)))
+            self.right_ordinal = itemgetter(right.columns.index(bands[0][1] + ('ordinal',)))
+            self.window = max_days_diff
+        else:
+            # Without a band predicate every row has ordinal 0, so a probe returns the whole bucket
+            self.left_ordinal = self.right_ordinal = lambda row: 0
+            self.window = 0
+        self.residual = [(self.columns.index(left_column + ('ordinal',)), self.columns.index(right_column + ('ordinal',)))
+                         for left_column, right_column in bands[1:]]
+
+    def matches(self, row):
+        return all(abs(row[left] - row[right]) <= self.max_days_diff for left, right in self.residual)
+
+    def children(self):
+        return [self.left, self.right]
+
+    def describe(self):
+        predicates = [f"{left[0]}.{left[1]} = {right[0]}.{right[1]}" for left, right in self.keys]
+        predicates += [f"|{left[0]}.{left[1]} - {right[0]}.{right[1]}| <= {self.max_days_diff}" for left, right in self.bands]
+        return f"{self.name} on {' AND '.join(predicates)}"
+
+# Build a band index over one input, then stream the other input through it
+class HashJoin(Join):
+    name = 'Hash join'
+
+    def __init__(self, left, right, keys, bands, max_days_diff, estimated_rows, build_left):
+        super().__init__(left, right, keys, bands, max_days_diff, estimated_rows)
+        self.build_left = build_left
+
+    def rows(self):
+        if self.build_left:
+            build, build_key, build_ordinal = self.left, self.left_key, self.left_ordinal
+            probe, probe_key, probe_ordinal = self.right, self.right_key, self.right_ordinal
+        else:
+            build, build_key, build_ordinal = self.right, self.right_key, self.right_ordinal
+            probe, probe_key, probe_ordinal = self.left, self.left_key, self.left_ordinal
+        index = build_keyed_band_index((build_key(row), build_ordinal(row), row) for row in build.stream())
+        for row in probe.stream():
+            for match in probe_band_index(index, probe_key(row), probe_ordinal(row), self.window):
+                joined = match + row if self.build_left else row + match
+                if not self.residual or self.matches(joined):
+                    yield joined
+
+    def describe(self):
+        return f"{super().describe()} [build {'left' if self.build_left else 'right'}]"
+
+# Hash join whose build side is a base table first reduced to the keys of the first join column that
+# occur in the other side's base table; the distinct keys are read with one SELECT DISTINCT
+class SemiJoin(HashJoin):
+    name = 'Semi-join'
+    shipped_keys = 0
+
+    def rows(self):
+        if self.build_left:
+            reduced_column, driving_column = self.keys[0]
+            reduced, driving = self.left, self.right
+        else:
+            driving_column, reduced_column = self.keys[0]
+            driving, reduced = self.left, self.right
+        source = driving.scans()[driving_column[0]]
+        conn = connect_for_reading(source.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT DISTINCT {driving_column[1]} FROM {driving_column[0]}")
+        keys = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        self.shipped_keys = len(keys)
+        reduced.reduction = (reduced_column[1], keys)
+        yield from super().rows()
+
+# Symmetric hash join: rows are read alternately from both inputs, inserted into their own band
+# index and probed against the other's, so output starts before either input is exhausted
+class PipelinedJoin(Join):
+    name = 'Pipelined join'
+
+    def rows(self):
+        inputs = [self.left.stream(), self.right.stream()]
+        accessors = [(self.left_key, self.left_ordinal), (self.right_key, self.right_ordinal)]
+        indexes = [dict(), dict()]
+        active = [True, True]
+        while active[0] or active[1]:
+            for side in (0, 1):
+                if not active[side]:
+                    continue
+                row = next(inputs[side], None)
+                if row is None:
+                    active[side] = False
+                    continue
+                key_of, ordinal_of = accessors[side]
+                key, ordinal = key_of(row), ordinal_of(row)
+                insert_into_band_index(indexes[side], key, ordinal, row)
+                for match in probe_band_index(indexes[1 - side], key, ordinal, self.window):
+                    joined = row + match if side == 0 else match + row
+                    if not self.residual or self.matches(joined):
+                        yield joined
+
+# Predicates between two sets of tables, oriented left to right
+def connecting(predicates, left_tables, right_tables):
+    oriented = []
+    for first, second in predicates:
+        if first[0] in left_tables and second[0] in right_tables:
+            oriented.append((first, second))
+        elif second[0] in left_tables and first[0] in right_tables:
+            oriented.append((second, first))
+    return oriented
+
+# Distinct values of a base table column within a plan: never more than the plan's rows
+def distinct_values(plan, column, statistics):
+    return max(1, min(statistics[column[0]]['distinct'][column[1]], plan['rows']))
+
+# Estimated fraction of the row pairs of two plans that satisfy the predicates between them: each
+# equality keeps 1/max(distinct values), each band the share of a date span covered by the window
+def selectivity(left_plan, right_plan, keys, bands, statistics, max_days_diff):
+    fraction = 1.0
+    for left_column, right_column in keys:
+        fraction /= max(distinct_values(left_plan, left_column, statistics), distinct_values(right_plan, right_column, statistics))
+    for left_column, right_column in bands:
+        span = max(statistics[left_column[0]]['date_span'][left_column[1]], statistics[right_column[0]]['date_span'][right_column[1]])
+        fraction *= min(1.0, (2 * max_days_diff + 1) / span)
+    return fraction
+
+# Rows of a base table column's table whose value occurs in another base table's column: the rows a
+# semi-join reduction would keep. The other database is attached, so the count runs inside SQLite.
+def semi_join_rows(statistics, column, other_column):
+    conn = connect_for_reading(statistics[column[0]]['db_path'])
+    cursor = conn.cursor()
+    cursor.execute("ATTACH DATABASE ? AS other", (statistics[other_column[0]]['db_path'],))
+    cursor.execute(f"SELECT COUNT(*) FROM main.{column[0]} WHERE {column[1]} IN (SELECT {other_column[1]} FROM other.{other_column[0]})")
+    rows = cursor.fetchone()[0]
+    conn.close()
+    return rows
+
+# Choose the join order by dynamic programming over connected sets of tables, minimizing the sum of
+# the estimated intermediate result sizes. Left-deep plans add one base table per join; bushy plans
+# may also join two intermediate results. Cross products are never considered.
+def plan_joins(table_names, statistics, equalities, bands, max_days_diff, plan_shape):
+    best = dict()
+    for table_name in table_names:
+        best[frozenset([table_name])] = {'tables': frozenset([table_name]), 'table': table_name,
+                                         'rows': statistics[table_name]['rows'], 'cost': 0}
+    for size in range(2, len(table_names) + 1):
+        for subset in combinations(table_names, size):
+            subset = frozenset(subset)
+            for left_size in range(1, size):
+                for left_tables in combinations([name for name in table_names if name in subset], left_size):
+                    left_tables = frozenset(left_tables)
+                    right_tables = subset - left_tables
+                    if plan_shape == 'left-deep' and len(right_tables) != 1:
+                        continue
+                    if left_tables not in best or right_tables not in best:
+                        continue
+                    keys = connecting(equalities, left_tables, right_tables)
+                    if not keys:
+                        continue
+                    join_bands = connecting(bands, left_tables, right_tables)
+                    left_plan, right_plan = best[left_tables], best[right_tables]
+                    rows = left_plan['rows'] * right_plan['rows'] * selectivity(left_plan, right_plan, keys, join_bands, statistics, max_days_diff)
+                    cost = left_plan['cost'] + right_plan['cost'] + rows
+                    if subset not in best or cost < best[subset]['cost']:
+                        best[subset] = {'tables': subset, 'left': left_plan, 'right': right_plan,
+                                        'keys': keys, 'bands': join_bands, 'rows': rows, 'cost': cost}
+    plan = best.get(frozenset(table_names))
+    if plan is None:
+        raise ValueError("The join predicates do not connect all tables; cross products are not supported.")
+    return plan
+
+# Turn a plan into operators. Hash joins build on the input with fewer estimated rows; operator
+# 'auto' picks a semi-join when that input is a base table whose rows mostly have keys missing from
+# the other side's base table.
+def build_operator(plan, statistics, band_columns, max_days_diff, operator):
+    if 'table' in plan:
+        table_name = plan['table']
+        return Scan(statistics[table_name]['db_path'], table_name, statistics[table_name]['columns'],
+                    band_columns[table_name], plan['rows'])
+    left = build_operator(plan['left'], statistics, band_columns, max_days_diff, operator)
+    right = build_operator(plan['right'], statistics, band_columns, max_days_diff, operator)
+    arguments = (left, right, plan['keys'], plan['bands'], max_days_diff, plan['rows'])
+    if operator == 'pipelined':
+        return PipelinedJoin(*arguments)
+    build_left = plan['left']['rows'] < plan['right']['rows']
+    build_plan = plan['left'] if build_left else plan['right']
+    if operator in ('auto', 'semi') and 'table' in build_plan:
+        build_column, probe_column = plan['keys'][0] if build_left else plan['keys'][0][::-1]
+        kept_rows = semi_join_rows(statistics, build_column, probe_column)
+        if operator == 'semi' or kept_rows < SEMI_JOIN_CONTAINMENT * build_plan['rows']:
+            (left if build_left else right).estimated_rows = kept_rows
+            return SemiJoin(*arguments, build_left)
+    return HashJoin(*arguments, build_left)
+
+# Log an operator tree, one operator per line, with estimated and (once run) actual rows
+def log_plan(operator, executed, depth=0):
+    actual = f", actual {operator.actual_rows}" if executed else ''
+    logging.info(f"{'  ' * depth}{operator.describe()} (estimated {operator.estimated_rows:.0f} rows{actual})")
+    for child in operator.children():
+        log_plan(child, executed, depth + 1)
+
+def all_operators(operator):
+    operators = [operator]
+    for child in operator.children():
+        operators.extend(all_operators(child))
+    return operators
+
+def multiway_join(tables, equalities, bands, max_days_diff, plan_shape='bushy', operator='auto', sink='csv'):
+    csv_file = "multiway_join.csv"
+    log_file = "results.log"
+    setup_logging(log_file)
+
+    locations = [resolve_table(specification) for specification in tables]
+    table_names = [table_name for _, table_name in locations]
+    if len(set(table_names)) != len(table_names):
+        raise ValueError("Every table may appear only once in a multi-way join.")
+    for predicate in list(equalities) + list(bands):
+        for table_name, _ in predicate:
+            if table_name not in table_names:
+                raise ValueError(f"Predicate refers to table {table_name}, which is not joined.")
+    result_type = f"Multi-way join ({', '.join(table_names)})"
+    logging.info(result_type)
+
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('plan')
+
+    # Gather the statistics of the columns the predicates use, then choose the join order
+    key_columns = {table_name: [] for table_name in table_names}
+    band_columns = {table_name: [] for table_name in table_names}
+    for predicate in equalities:
+        for table_name, column in predicate:
+            if column not in key_columns[table_name]:
+                key_columns[table_name].append(column)
+    for predicate in bands:
+        for table_name, column in predicate:
+            if column not in band_columns[table_name]:
+                band_columns[table_name].append(column)
+    statistics = {table_name: table_statistics(db_path, table_name, key_columns[table_name], band_columns[table_name])
+                  for db_path, table_name in locations}
+    plan = plan_joins(table_names, statistics, equalities, bands, max_days_diff, plan_shape)
+    root = build_operator(plan, statistics, band_columns, max_days_diff, operator)
+
+    plan_time = metrics.end_phase('plan')
+    logging.info(f"Planned a {plan_shape} join of {len(table_names)} tables in {plan_time:.4f} seconds:")
+    log_plan(root, executed=False)
+
+    metrics.start_phase('execute')
+
+    # Rows stream from the root of the operator tree to the sink; the day ordinal columns are dropped
+    visible = [position for position, column in enumerate(root.columns) if len(column) == 2]
+    columns = [root.columns[position][1] for position in visible]
+    project = itemgetter(*visible)
+    with open_sink(sink, csv_file, columns) as writer:
+        for row in root.stream():
+            writer.writerow(project(row))
+            metrics.add_rows()
+
+    execute_time = metrics.end_phase('execute')
+    logging.info(f"Execution completed in {execute_time:.4f} seconds:")
+    log_plan(root, executed=True)
+
+    operators = all_operators(root)
+    for join in operators:
+        if isinstance(join, SemiJoin):
+            metrics.count('semi-join keys', join.shipped_keys)
+    metrics.finish(max_days_diff=max_days_diff, plan_shape=plan_shape, operator=operator,
+                   operators=[{'operator': op.describe(), 'estimated_rows': op.estimated_rows, 'actual_rows': op.actual_rows} for op in operators])
+
+    return metrics.rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform a multi-way band join between tables of SQLite databases.")
+    parser.add_argument('--tables', type=str, nargs='+', default=['./databases/database1.db', './databases/database2.db'], help="Tables to join as 'path' (the database's first table) or 'path:table'.")
+    parser.add_argument('--join', type=parse_predicate, nargs='+', default=[parse_predicate('Projects.Department=Employees.Department')], help="Equality predicates as 'Table.Column=Table.Column'. Default=Projects.Department=Employees.Department")
+    parser.add_argument('--band', type=parse_predicate, nargs='*', default=[parse_predicate('Projects.StartDate=Employees.HireDate')], help="Date columns that must lie within max_days_diff of each other, as 'Table.Column=Table.Column'. Default=Projects.StartDate=Employees.HireDate")
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--plan_shape', type=str, default='bushy', choices=PLAN_SHAPES, help='Shape of the join trees the planner considers. Default=bushy')
+    parser.add_argument('--operator', type=str, default='auto', choices=OPERATORS, help='Join operator of every join, or auto to pick hash or semi-join per join. Default=auto')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    args = parser.parse_args()
+
+    multiway_join(args.tables, args.join, args.band, args.max_days_diff, args.plan_shape, args.operator, args.sink)
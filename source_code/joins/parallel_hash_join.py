@@ -0,0 +1,240 @@
+import time
+import os
+import logging
+import argparse
+import sys
+import tempfile
+from multiprocessing import Pool
+
+from band_index import build_band_index, probe_band_index
+from table_scan import connect_for_reading, scan_decoded
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics, peak_rss
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# Row count per join key of a table
+def key_counts(cursor, table_name, join_attribute):
+    cursor.execute(f"SELECT {join_attribute}, COUNT(*) FROM {table_name} GROUP BY {join_attribute}")
+    return dict(cursor.fetchall())
+
+# Return the keys holding at least fraction of the rows, with their row counts
+def heavy_keys_from_counts(key_counts, fraction):
+    threshold = fraction * sum(key_counts.values())
+    return {key: count for key, count in key_counts.items() if count >= threshold}
+
+# Choose, for each heavy key, the side whose rows are split across all partitions: the side with more
+# rows for that key. The other side's rows for the key are broadcast to every partition.
+def split_sides(heavy_keys, build_counts, probe_counts):
+    return {key: 'build' if build_counts[key] > probe_counts[key] else 'probe'
+            for key in heavy_keys if key in build_counts and key in probe_counts}
+
+# Assign join keys to partitions, heaviest first onto the least loaded partition.
+# Every partition starts with its share of the heavy keys, which are spread over all partitions.
+def assign_partitions(build_counts, probe_counts, num_partitions, heavy_splits=None):
+    heavy_splits = heavy_splits or dict()
+    partitions = [[] for _ in range(num_partitions)]
+    base_load = 0
+    for key, split_side in heavy_splits.items():
+        split_count, broadcast_count = (build_counts[key], probe_counts[key]) if split_side == 'build' else (probe_counts[key], build_counts[key])
+        base_load += split_count / num_partitions + broadcast_count
+    loads = [base_load] * num_partitions
+    # Keys missing from either side produce no output and are skipped entirely
+    keys = [key for key in build_counts if key in probe_counts and key not in heavy_splits]
+    keys.sort(key=lambda key: build_counts[key] + probe_counts[key], reverse=True)
+    for key in keys:
+        target = loads.index(min(loads))
+        partitions[target].append(key)
+        loads[target] += build_counts[key] + probe_counts[key]
+    if heavy_splits:
+        # The rowid split of the heavy keys needs every partition, even those without keys of their own
+        return list(zip(partitions, loads))
+    return [(keys, load) for keys, load in zip(partitions, loads) if keys]
+
+# Load a partition's own keys into a temporary table of the connection, so that their number is not
+# bound by SQLite's parameter limit
+def load_partition_keys(cursor, keys):
+    cursor.execute("CREATE TEMP TABLE partition_keys (value PRIMARY KEY)")
+    cursor.executemany("INSERT OR IGNORE INTO partition_keys VALUES (?)", ((key,) for key in keys))
+
+# WHERE clause and parameters selecting one side's rows of a partition: its own keys (loaded with
+# load_partition_keys), plus for each heavy key either its share of the rows (rowid modulo the
+# partition count) or all of them
+def partition_predicate(join_attribute, keys, heavy_splits, side, number, num_partitions):
+    clauses = []
+    parameters = []
+    if keys:
+        clauses.append(f"{join_attribute} IN (SELECT value FROM temp.partition_keys)")
+    for key, split_side in heavy_splits.items():
+        if split_side == side:
+            clauses.append(f"({join_attribute} = ? AND rowid % ? = ?)")
+            parameters.extend([key, num_partitions, number])
+        else:
+            clauses.append(f"{join_attribute} = ?")
+            parameters.append(key)
+    return ' OR '.join(clauses), parameters
+
+# Build/probe one partition straight from the SQLite files and write its rows to a part sink
+def join_partition(hash_db_path, probe_db_path, table_name_1, table_name_2, join_attribute,
+                   join_index_table_1, join_index_table_2, timestamp_column_table_1, timestamp_column_table_2,
+                   keys, heavy_splits, number, num_partitions, max_days_diff, sink, part_file, columns):
+    start_time = time.perf_counter()
+    conn1 = connect_for_reading(hash_db_path)
+    conn2 = connect_for_reading(probe_db_path)
+    cursor1 = conn1.cursor()
+    cursor2 = conn2.cursor()
+
+    # Partition predicates evaluated inside SQLite
+    load_partition_keys(cursor1, keys)
+    load_partition_keys(cursor2, keys)
+    build_where, build_parameters = partition_predicate(join_attribute, keys, heavy_splits, 'build', number, num_partitions)
+    probe_where, probe_parameters = partition_predicate(join_attribute, keys, heavy_splits, 'probe', number, num_partitions)
+    hash_table = build_band_index(scan_decoded(cursor1, table_name_1, timestamp_column_table_1, build_where, build_parameters), join_index_table_1)
+
+    rows_written = 0
+    probes = 0
+    # perf_counter_ns() is a system-wide monotonic clock, so the main process can compare it
+    first_record_time = None
+    writer = open_sink(sink, part_file, columns)
+    for probe_timestamp, row in scan_decoded(cursor2, table_name_2, timestamp_column_table_2, probe_where, probe_parameters):
+        probes += 1
+        for record in probe_band_index(hash_table, row[join_index_table_2], probe_timestamp, max_days_diff):
+            writer.writerow(record + row)
+            rows_written += 1
+            if first_record_time is None:
+                first_record_time = time.perf_counter_ns()
+    part_summary = writer.close()
+
+    conn1.close()
+    conn2.close()
+    return part_summary, rows_written, first_record_time, probes, peak_rss(), time.perf_counter() - start_time
+
+def parallel_hash_join(db1_path, db2_path, invert_join, max_days_diff, workers, sink='csv', heavy_hitter_fraction=None):
+    if invert_join:
+        hash_db_path = db2_path
+        probe_db_path = db1_path
+        csv_file = "parallel_hash_join_large_join_small.csv"
+        result_type = "Parallel hash join (Large join Small)"
+    else:
+        hash_db_path = db1_path
+        probe_db_path = db2_path
+        csv_file = "parallel_hash_join_small_join_large.csv"
+        result_type = "Parallel hash join (Small join Large)"
+
+    log_file = "results.log"
+    setup_logging(log_file)
+    logging.info(result_type)
+
+    conn1 = connect_for_reading(hash_db_path)
+    conn2 = connect_for_reading(probe_db_path)
+    cursor1 = conn1.cursor()
+    cursor2 = conn2.cursor()
+
+    # Fetch the table names
+    cursor1.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_1 = cursor1.fetchone()[0]
+    cursor2.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_2 = cursor2.fetchone()[0]
+
+    # Determine the join attribute and its index in each table
+    if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
+        join_attribute = 'Department'
+        join_index_table_1 = 1  # Department is the second column in Projects table
+        join_index_table_2 = 1  # Department is the second column in Employees table
+        timestamp_column_table_1 = 'StartDate'
+        timestamp_column_table_2 = 'HireDate'
+        columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
+    elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
+        join_attribute = 'Department'
+        join_index_table_1 = 1  # Department is the second column in Employees table
+        join_index_table_2 = 1  # Department is the second column in Projects table
+        timestamp_column_table_1 = 'HireDate'
+        timestamp_column_table_2 = 'StartDate'
+        columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
+    else:
+        raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('partition')
+
+    # Partition the join keys on the main node; workers receive keys, not rows
+    build_counts = key_counts(cursor1, table_name_1, join_attribute)
+    probe_counts = key_counts(cursor2, table_name_2, join_attribute)
+    # A key holding more than a partition's fair share of the probe rows cannot be balanced by assigning
+    # whole keys; such keys are taken from the exact probe counts above and split by rowid
+    heavy_splits = dict()
+    if workers > 1:
+        if heavy_hitter_fraction is None:
+            heavy_hitter_fraction = 1 / (2 * workers)
+        if heavy_hitter_fraction > 0:
+            heavy_keys = heavy_keys_from_counts(probe_counts, heavy_hitter_fraction)
+            heavy_splits = split_sides(heavy_keys, build_counts, probe_counts)
+            total_probe_rows = sum(probe_counts.values())
+            for key, split_side in heavy_splits.items():
+                logging.info(f"Heavy key {key}: {heavy_keys[key] / total_probe_rows:.2%} of the probe rows "
+                             f"({build_counts[key]} build, {probe_counts[key]} probe rows), {split_side} side split")
+    conn1.close()
+    conn2.close()
+    partitions = assign_partitions(build_counts, probe_counts, workers, heavy_splits)
+    partition_time = metrics.end_phase('partition')
+    logging.info(f"Partitioned {len(build_counts)} build keys into {len(partitions)} partitions "
+                 f"({len(heavy_splits)} heavy keys split) in {partition_time:.4f} seconds")
+    for number, (keys, load) in enumerate(partitions):
+        logging.info(f"Partition {number}: {len(keys)} keys, {load:.0f} rows")
+    loads = [load for _, load in partitions]
+    load_imbalance = max(loads) / (sum(loads) / len(loads)) if sum(loads) else 1.0
+    logging.info(f"Partition load imbalance (max/mean): {load_imbalance:.4f}")
+
+    # Build and probe every partition on the worker pool
+    logging.info(f"Performing build and probe phases on {workers} workers...")
+    with tempfile.TemporaryDirectory(prefix='parallel_hash_join_') as part_directory:
+        tasks = [(hash_db_path, probe_db_path, table_name_1, table_name_2, join_attribute,
+                  join_index_table_1, join_index_table_2, timestamp_column_table_1, timestamp_column_table_2,
+                  keys, heavy_splits, number, len(partitions), max_days_diff, sink,
+                  os.path.join(part_directory, f"part_{number}.csv"), columns)
+                 for number, (keys, _) in enumerate(partitions)]
+        metrics.start_phase('join')
+        with Pool(processes=workers) as pool:
+            outputs = pool.starmap(join_partition, tasks)
+        join_time = metrics.end_phase('join')
+        logging.info(f"Build and probe phases completed in {join_time:.4f} seconds")
+
+        # Merge the part outputs into a single result
+        metrics.start_phase('merge')
+        with open_sink(sink, csv_file, columns) as writer:
+            for part_summary, part_rows, part_first_record_time, part_probes, _, _ in outputs:
+                writer.merge(part_summary)
+                metrics.add_rows(part_rows, part_first_record_time)
+                metrics.count('probes', part_probes)
+        merge_time = metrics.end_phase('merge')
+        logging.info(f"Merge phase completed in {merge_time:.4f} seconds")
+
+    # Worker memory is not visible to this process, so each worker reports its own peak
+    worker_peak_rss = [output[4] for output in outputs]
+    logging.info(f"Largest worker peak RSS: {max(worker_peak_rss, default=0) / (1024*1024):.4f} MB")
+    # The slowest partition bounds the join phase; compare it with the average partition
+    worker_seconds = [output[5] for output in outputs]
+    straggler_ratio = max(worker_seconds) / (sum(worker_seconds) / len(worker_seconds)) if outputs else 1.0
+    logging.info(f"Partition times: slowest {max(worker_seconds, default=0):.4f} seconds, straggler ratio (max/mean) {straggler_ratio:.4f}")
+    metrics.finish(max_days_diff=max_days_diff, workers=workers, worker_peak_rss_bytes=worker_peak_rss,
+                   heavy_keys=sorted(heavy_splits), load_imbalance=load_imbalance, straggler_ratio=straggler_ratio)
+
+    return metrics.rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform a partitioned parallel Hash Join between two SQLite databases.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes. Default=number of CPU cores')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    parser.add_argument('--heavy_hitter_fraction', type=float, default=None, help='Probe-side share of the rows above which a key is split across all workers; 0 disables. Default=1/(2 x workers)')
+    args = parser.parse_args()
+
+    parallel_hash_join(args.db1, args.db2, args.invert_join, args.max_days_diff, args.workers, args.sink, args.heavy_hitter_fraction)
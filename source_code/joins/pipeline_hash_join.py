@@ -1,12 +1,16 @@
-import sqlite3
-import time
 import os
 import logging
 import argparse
-import csv
 import sys
-from datetime import datetime
-import pickle
+import time
+import asyncio
+import threading
+from itertools import islice
+
+from band_index import insert_into_band_index, probe_band_index
+from table_scan import connect_for_reading, scan_batches, DEFAULT_BATCH_SIZE
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
 
 # Setup logging to a file
 def setup_logging(log_file):
@@ -19,7 +23,73 @@ def fetch_all_rows(cursor, table_name):
     cursor.execute(f"SELECT * FROM {table_name}")
     return cursor.fetchall()
 
-def pipelined_hash_join(db1_path, db2_path, invert_join, max_days_diff):
+# Parse an 'N:M' interleave ratio: N rows of the first table for every M rows of the second
+def parse_interleave_ratio(value):
+    ratio_1, ratio_2 = (int(part) for part in value.split(':'))
+    if ratio_1 < 1 or ratio_2 < 1:
+        raise argparse.ArgumentTypeError("Interleave ratio parts must be positive integers.")
+    return ratio_1, ratio_2
+
+# Queue capacity of each source in the asyncio mode, in batches
+DEFAULT_QUEUE_BATCHES = 4
+
+# Yield (day ordinal, row) pairs from scan batches, sleeping delay seconds before every batch to
+# simulate a remote source
+def delayed_scan(batches, delay):
+    for batch in batches:
+        if delay:
+            time.sleep(delay)
+        for row in batch:
+            yield row[0], row[1:]
+
+# Reader thread of the asyncio mode: scans a table on its own connection and puts its batches on a
+# bounded asyncio queue, blocking while the queue is full. The scan ends with None, or with the
+# exception that stopped it. stats collects the rows read and the time spent blocked.
+def read_source(loop, queue, db_path, table_name, timestamp_column, batch_size, delay, stats):
+    try:
+        conn = connect_for_reading(db_path)
+        try:
+            for batch in scan_batches(conn.cursor(), table_name, timestamp_column, batch_size=batch_size):
+                if delay:
+                    time.sleep(delay)
+                blocked_since = time.perf_counter()
+                asyncio.run_coroutine_threadsafe(queue.put(batch), loop).result()
+                stats['blocked_seconds'] += time.perf_counter() - blocked_since
+                stats['rows'] += len(batch)
+        finally:
+            conn.close()
+        end = None
+    except Exception as error:
+        end = error
+    asyncio.run_coroutine_threadsafe(queue.put(end), loop).result()
+
+# Start one reader thread per source and hand every batch to join_batch(source number, batch) as soon
+# as it arrives, from whichever source has one ready. Returns the seconds spent waiting for data.
+async def consume_sources(sources, queue_batches, join_batch):
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(maxsize=queue_batches) for _ in sources]
+    for queue, source in zip(queues, sources):
+        # Daemon threads, so a reader blocked on a full queue cannot keep a failed join alive
+        threading.Thread(target=read_source, args=(loop, queue) + source, daemon=True).start()
+    gets = {asyncio.ensure_future(queue.get()): number for number, queue in enumerate(queues)}
+    idle_seconds = 0.0
+    while gets:
+        waiting_since = time.perf_counter()
+        done, _ = await asyncio.wait(gets, return_when=asyncio.FIRST_COMPLETED)
+        idle_seconds += time.perf_counter() - waiting_since
+        for get in sorted(done, key=gets.get):
+            number = gets.pop(get)
+            batch = get.result()
+            if isinstance(batch, Exception):
+                raise batch
+            if batch is None:
+                continue
+            join_batch(number, batch)
+            gets[asyncio.ensure_future(queues[number].get())] = number
+    return idle_seconds
+
+def pipelined_hash_join(db1_path, db2_path, invert_join, max_days_diff, batch_size=DEFAULT_BATCH_SIZE, interleave_ratio=(1, 1), sink='csv',
+                        asynchronous=False, source_delays=(0.0, 0.0), queue_batches=DEFAULT_QUEUE_BATCHES):
     if invert_join:
         hash_db_path = db2_path
         probe_db_path = db1_path
@@ -35,8 +105,8 @@ def pipelined_hash_join(db1_path, db2_path, invert_join, max_days_diff):
     setup_logging(log_file)
     logging.info(result_type)
 
-    conn1 = sqlite3.connect(hash_db_path)
-    conn2 = sqlite3.connect(probe_db_path)
+    conn1 = connect_for_reading(hash_db_path)
+    conn2 = connect_for_reading(probe_db_path)
     cursor1 = conn1.cursor()
     cursor2 = conn2.cursor()
 
@@ -50,124 +120,136 @@ def pipelined_hash_join(db1_path, db2_path, invert_join, max_days_diff):
     if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
         join_index_table_1 = 1  # Department is the second column in Projects table
         join_index_table_2 = 1  # Department is the second column in Employees table
-        timestamp_index_table_1 = 2  # HireDate is the fourth column in Projects table
-        timestamp_index_table_2 = 3  # StartDate is the third column in Employees table
+        timestamp_column_table_1 = 'StartDate'
+        timestamp_column_table_2 = 'HireDate'
         columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
     elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
         join_index_table_1 = 1  # Department is the second column in Employees table
         join_index_table_2 = 1  # Department is the second column in Projects table
-        timestamp_index_table_1 = 3  # StartDate is the third column in Employees table
-        timestamp_index_table_2 = 2  # HireDate is the fourth column in Projects table
+        timestamp_column_table_1 = 'HireDate'
+        timestamp_column_table_2 = 'StartDate'
         columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
     else:
         raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
 
-    # Measure the start time for the build phase
-    build_start_time = time.time()
+    metrics = JoinMetrics(result_type)
 
-    # Initialize hash tables
+    # Initialize hash tables (band indexes kept sorted by timestamp per key)
     hash_table1 = {}
     hash_table2 = {}
 
-    # Set to keep track of written pairs to avoid duplicates
-    written_pairs = set()
-
-    # Measure the start time for the probe phase
-    probe_start_time = time.time()
+    # Each row is inserted into its own hash table before probing the other one,
+    # so every matching pair is produced exactly once: by whichever row arrives last
+    metrics.start_phase('probe')
 
     # Perform the probe phase
     logging.info(f"Performing probe phase with {table_name_1} and {table_name_2} tables...")
-    results = []
-    first_record_time_logged = False
-    first_record_time = 0.0
-    cursor1.execute(f"SELECT * FROM {table_name_1}")
-    cursor2.execute(f"SELECT * FROM {table_name_2}")
-    with open(csv_file, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(columns)
-        
-        while True:
-            row1 = cursor1.fetchone()
-            if row1:
-                key = row1[join_index_table_1]
-                if key in hash_table2:
-                    timestamp_1 = datetime.strptime(row1[timestamp_index_table_1], '%Y-%m-%d')
-                    for record in hash_table2[key]:
-                        # Check the timestamp difference
-                        #timestamp_1 = datetime.strptime(row1[timestamp_index_table_1], '%Y-%m-%d')
-                        timestamp_2 = datetime.strptime(record[timestamp_index_table_2], '%Y-%m-%d')
-                        if abs((timestamp_1 - timestamp_2).days) <= max_days_diff:
-                            result = row1 + record
-                            if (row1, record) not in written_pairs:
-                                results.append(result)
-                                writer.writerow(result)
-                                written_pairs.add((row1, record))
-                            if not first_record_time_logged:
-                                first_record_time = time.time()
-                                first_record_time_logged = True
-                if key not in hash_table1:
-                    hash_table1[key] = []
-                hash_table1[key].append(row1)
-            
-            row2 = cursor2.fetchone()
-            if row2:
-                key = row2[join_index_table_2]
-                if key in hash_table1:
-                    timestamp_2 = datetime.strptime(row2[timestamp_index_table_2], '%Y-%m-%d')
-                    for record in hash_table1[key]:
-                        # Check the timestamp difference
-                        timestamp_1 = datetime.strptime(record[timestamp_index_table_1], '%Y-%m-%d')
-                        #timestamp_2 = datetime.strptime(row2[timestamp_index_table_2], '%Y-%m-%d')
-                        if abs((timestamp_1 - timestamp_2).days) <= max_days_diff:
-                            result = record + row2
-                            if (record, row2) not in written_pairs:
-                                results.append(result)
-                                writer.writerow(result)
-                                written_pairs.add((record, row2))
-                            if not first_record_time_logged:
-                                first_record_time = time.time()
-                                first_record_time_logged = True
-                if key not in hash_table2:
-                    hash_table2[key] = []
-                hash_table2[key].append(row2)
-            
-            if row1 is None and row2 is None:
-                break
-
-    # Measure the end time for the probe phase
-    probe_end_time = time.time()
-    probe_time = probe_end_time - probe_start_time
+    probes = 0
+    bisect_steps = 0
+    delay_1, delay_2 = source_delays
+    stats = [{'rows': 0, 'blocked_seconds': 0.0}, {'rows': 0, 'blocked_seconds': 0.0}]
+    idle_seconds = None
+    with open_sink(sink, csv_file, columns) as writer:
+        if asynchronous:
+            # Each table is read by its own thread into a bounded queue, and rows are joined in whatever
+            # order the sources deliver them; a full queue stops its reader until the join catches up
+            logging.info(f"Reading the sources asynchronously with {delay_1 * 1000:.1f}/{delay_2 * 1000:.1f} ms per batch")
+            sides = [(join_index_table_1, hash_table1, hash_table2), (join_index_table_2, hash_table2, hash_table1)]
+
+            def join_batch(number, batch):
+                join_index, own_table, other_table = sides[number]
+                batch_bisect_steps = 0
+                for raw_row in batch:
+                    timestamp, row = raw_row[0], raw_row[1:]
+                    key = row[join_index]
+                    insert_into_band_index(own_table, key, timestamp, row)
+                    if key in other_table:
+                        # Only the records inside the timestamp window are visited
+                        batch_bisect_steps += 2 * len(other_table[key][0]).bit_length()
+                        for record in probe_band_index(other_table, key, timestamp, max_days_diff):
+                            # The first table's columns always come first
+                            writer.writerow(row + record if number == 0 else record + row)
+                            metrics.add_rows()
+                metrics.count('probes', len(batch))
+                metrics.count('estimated_bisect_steps', batch_bisect_steps)
+
+            sources = [(hash_db_path, table_name_1, timestamp_column_table_1, batch_size, delay_1, stats[0]),
+                       (probe_db_path, table_name_2, timestamp_column_table_2, batch_size, delay_2, stats[1])]
+            idle_seconds = asyncio.run(consume_sources(sources, queue_batches, join_batch))
+        else:
+            # Both tables are streamed in batches of batch_size rows
+            scan1 = delayed_scan(scan_batches(cursor1, table_name_1, timestamp_column_table_1, batch_size=batch_size), delay_1)
+            scan2 = delayed_scan(scan_batches(cursor2, table_name_2, timestamp_column_table_2, batch_size=batch_size), delay_2)
+            ratio_1, ratio_2 = interleave_ratio
+
+            exhausted1 = False
+            exhausted2 = False
+            while not (exhausted1 and exhausted2):
+                # Take up to ratio_1 rows from the first table
+                taken = 0
+                for timestamp_1, row1 in islice(scan1, ratio_1):
+                    taken += 1
+                    key = row1[join_index_table_1]
+                    insert_into_band_index(hash_table1, key, timestamp_1, row1)
+                    probes += 1
+                    if key in hash_table2:
+                        # Only the records inside the timestamp window are visited
+                        bisect_steps += 2 * len(hash_table2[key][0]).bit_length()
+                        for record in probe_band_index(hash_table2, key, timestamp_1, max_days_diff):
+                            writer.writerow(row1 + record)
+                            metrics.add_rows()
+                exhausted1 = taken < ratio_1
+
+                # Then up to ratio_2 rows from the second table
+                taken = 0
+                for timestamp_2, row2 in islice(scan2, ratio_2):
+                    taken += 1
+                    key = row2[join_index_table_2]
+                    insert_into_band_index(hash_table2, key, timestamp_2, row2)
+                    probes += 1
+                    if key in hash_table1:
+                        # Only the records inside the timestamp window are visited
+                        bisect_steps += 2 * len(hash_table1[key][0]).bit_length()
+                        for record in probe_band_index(hash_table1, key, timestamp_2, max_days_diff):
+                            writer.writerow(record + row2)
+                            metrics.add_rows()
+                exhausted2 = taken < ratio_2
+
+    probe_time = metrics.end_phase('probe')
     logging.info(f"Probe phase completed in {probe_time:.4f} seconds")
 
-    # Calculate the total execution time
-    total_execution_time = probe_time
-
-    hash_table_memory_1 = sys.getsizeof(pickle.dumps(hash_table1)) / ((1024)*(1024))  # Convert to MB
-    hash_table_memory_2 = sys.getsizeof(pickle.dumps(hash_table2)) / ((1024)*(1024))  # Convert to MB
-
-    logging.info(f"Join produced {len(results)} rows")
-    # Calculate the time until the first record was written
-    if first_record_time_logged:
-        time_until_first_record = first_record_time - build_start_time
-        logging.info(f"Time until the first record was extracted: {time_until_first_record:.4f} seconds")
-    else:
-        logging.info("No records were extracted.")
-    logging.info(f"Hash table 1 memory: {hash_table_memory_1:.4f} MB")
-    logging.info(f"Hash table 2 memory: {hash_table_memory_2:.4f} MB")
-    logging.info(f"Total hash table memory: {(hash_table_memory_1+hash_table_memory_2):.4f} MB")
-    logging.info(f"Total execution time: {total_execution_time:.4f} seconds")
-    logging.info('-'*50)
+    metrics.count('probes', probes)
+    metrics.count('estimated_bisect_steps', bisect_steps)
+    metrics.measure('hash table 1', hash_table1)
+    metrics.measure('hash table 2', hash_table2)
+    if asynchronous:
+        for table_name, source_stats in zip((table_name_1, table_name_2), stats):
+            logging.info(f"{table_name} reader: {source_stats['rows']} rows, blocked on a full queue for {source_stats['blocked_seconds']:.4f} seconds")
+        logging.info(f"Join waited {idle_seconds:.4f} seconds for source data")
+    metrics.finish(max_days_diff=max_days_diff, batch_size=batch_size, interleave_ratio=list(interleave_ratio), asynchronous=asynchronous,
+                   source_delay_ms=[delay * 1000 for delay in source_delays], queue_batches=queue_batches,
+                   reader_blocked_seconds=[source_stats['blocked_seconds'] for source_stats in stats] if asynchronous else None,
+                   idle_seconds=idle_seconds)
 
     # Close the connections
     conn1.close()
     conn2.close()
 
+    return metrics.rows
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Perform a Pipelined Hash Join between two SQLite databases.")
     parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
     parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
     parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
     parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE, help='Number of rows fetched from SQLite per call.')
+    parser.add_argument('--interleave_ratio', type=parse_interleave_ratio, default=(1, 1), help="Rows read from the first table for every rows read from the second, as 'N:M'. Default=1:1")
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    parser.add_argument('--asyncio', action='store_true', help='Read each table in its own thread into a bounded queue and join rows from whichever table has them ready, instead of alternating.')
+    parser.add_argument('--source_delay_ms', type=float, nargs=2, default=[0.0, 0.0], help='Artificial delay before every batch of the first and second table, simulating remote sources. Default=0 0')
+    parser.add_argument('--queue_batches', type=int, default=DEFAULT_QUEUE_BATCHES, help='Capacity of each source queue in the asyncio mode, in batches.')
     args = parser.parse_args()
 
-    pipelined_hash_join(args.db1, args.db2, args.invert_join, args.max_days_diff)
+    pipelined_hash_join(args.db1, args.db2, args.invert_join, args.max_days_diff, args.batch_size, args.interleave_ratio, args.sink,
+                        args.asyncio, tuple(delay / 1000 for delay in args.source_delay_ms), args.queue_batches)
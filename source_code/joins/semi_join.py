@@ -1,13 +1,14 @@
-import sqlite3
-import time
 import os
 import logging
 import argparse
-import csv
 import sys
-from datetime import datetime
 import pickle
 
+from band_index import build_band_index, probe_band_index
+from table_scan import connect_for_reading, scan_decoded
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
+
 # Setup logging to a file
 def setup_logging(log_file):
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
@@ -19,7 +20,7 @@ def fetch_all_rows(cursor, table_name):
     cursor.execute(f"SELECT * FROM {table_name}")
     return cursor.fetchall()
 
-def semi_join(db1_path, db2_path, invert_join, max_days_diff):
+def semi_join(db1_path, db2_path, invert_join, max_days_diff, sink='csv'):
     if invert_join:
         driving_db_path = db1_path
         probed_db_path = db2_path
@@ -35,8 +36,8 @@ def semi_join(db1_path, db2_path, invert_join, max_days_diff):
     setup_logging(log_file)
     logging.info(result_type)
 
-    conn1 = sqlite3.connect(driving_db_path)
-    conn2 = sqlite3.connect(probed_db_path)
+    conn1 = connect_for_reading(driving_db_path)
+    conn2 = connect_for_reading(probed_db_path)
     cursor1 = conn1.cursor()
     cursor2 = conn2.cursor()
 
@@ -51,99 +52,89 @@ def semi_join(db1_path, db2_path, invert_join, max_days_diff):
         join_attribute = 'Department'
         driving_join_index = 1  # Department is the second column in Employees table
         probed_join_index = 1  # Department is the second column in Projects table
-        driving_timestamp_index = 3  # HireDate is the fourth column in Employees table
-        probed_timestamp_index = 2  # StartDate is the third column in Projects table
+        driving_timestamp_column = 'HireDate'
+        probed_timestamp_column = 'StartDate'
         columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
     elif driving_table_name.lower() == 'projects' and probed_table_name.lower() == 'employees':
         join_attribute = 'Department'
         driving_join_index = 1  # Department is the second column in Projects table
         probed_join_index = 1  # Department is the second column in Employees table
-        driving_timestamp_index = 2  # StartDate is the third column in Projects table
-        probed_timestamp_index = 3  # HireDate is the fourth column in Employees table
+        driving_timestamp_column = 'StartDate'
+        probed_timestamp_column = 'HireDate'
         columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
     else:
         raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
 
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('reduction')
+
     # Fetch distinct join attribute values from the driving table
     cursor1.execute(f"SELECT DISTINCT {join_attribute} FROM {driving_table_name}")
     join_values = [row[0] for row in cursor1.fetchall()]
 
     # Fetch rows from the probed table that match the join attribute values
     placeholder = ','.join(['?'] * len(join_values))
-    query = f"SELECT * FROM {probed_table_name} WHERE {join_attribute} IN ({placeholder})"
-    cursor2.execute(query, join_values)
-    probed_rows = cursor2.fetchall()
+    where = f"{join_attribute} IN ({placeholder})"
+    probed_rows = list(scan_decoded(cursor2, probed_table_name, probed_timestamp_column, where, join_values))
 
-    # Measure the start time for the join phase
-    join_start_time = time.time()
+    reduction_time = metrics.end_phase('reduction')
+    logging.info(f"Reduction phase completed in {reduction_time:.4f} seconds")
 
-    # Perform the semi-join
-    logging.info(f"Performing semi-join between {driving_table_name} and {probed_table_name} tables...")
-    results = []
-    first_record_time_logged = False
-    first_record_time = 0.0
-    cursor1.execute(f"SELECT * FROM {driving_table_name}")
-    with open(csv_file, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(columns)
-        for row1 in cursor1.fetchall():
-            #driving_timestamp = datetime.strptime(row1[driving_timestamp_index], '%Y-%m-%d')
-            for row2 in probed_rows:
-                #probed_timestamp = datetime.strptime(row2[probed_timestamp_index], '%Y-%m-%d')
-                if row1[driving_join_index] == row2[probed_join_index]:
-                    # Check the timestamp difference
-                    driving_timestamp = datetime.strptime(row1[driving_timestamp_index], '%Y-%m-%d')
-                    probed_timestamp = datetime.strptime(row2[probed_timestamp_index], '%Y-%m-%d')
-                    if abs((probed_timestamp - driving_timestamp).days) <= max_days_diff:
-                        result = row1 + row2
-                        results.append(result)
-                        writer.writerow(result)
-                        if not first_record_time_logged:
-                            first_record_time = time.time()
-                            first_record_time_logged = True
-
-    # Measure the end time for the join phase
-    join_end_time = time.time()
-    join_time = join_end_time - join_start_time
-    logging.info(f"Join phase completed in {join_time:.4f} seconds")
+    # Measure how much the reduction phase shrank the probed table
+    cursor2.execute(f"SELECT COUNT(*) FROM {probed_table_name}")
+    probed_table_count = cursor2.fetchone()[0]
+    reduction_ratio = len(probed_rows) / probed_table_count if probed_table_count else 0.0
+    logging.info(f"Reduction phase kept {len(probed_rows)} of {probed_table_count} {probed_table_name} rows (ratio {reduction_ratio:.4f})")
 
-    # Calculate the total execution time
-    total_execution_time = join_time
-    logging.info(f"Total execution time: {total_execution_time:.4f} seconds")
+    # Bytes shipped in each direction of the reduction phase
+    join_values_bytes = len(pickle.dumps(join_values))
+    probed_rows_bytes = len(pickle.dumps(probed_rows))
+    logging.info(f"Bytes shipped {driving_table_name} -> {probed_table_name} (join values): {join_values_bytes}")
+    logging.info(f"Bytes shipped {probed_table_name} -> {driving_table_name} (reduced rows): {probed_rows_bytes}")
 
-    # Calculate the time until the first record was written
-    if first_record_time_logged:
-        time_until_first_record = first_record_time - join_start_time
-        logging.info(f"Time until the first record was written to the CSV: {time_until_first_record:.4f} seconds")
-    else:
-        logging.info("No records were written to the CSV.")
+    metrics.start_phase('join')
 
-    join_values_memory = sys.getsizeof(pickle.dumps(join_values)) / ((1024)*(1024))  # Convert to MB
-    probed_rows_memory = sys.getsizeof(pickle.dumps(probed_rows)) / ((1024)*(1024))  # Convert to MB
+    # Build a band index over the reduced probed rows
+    probed_index = build_band_index(probed_rows, probed_join_index)
 
-    logging.info(f"Join produced {len(results)} rows")
-    # Calculate the time until the first record was written
-    if first_record_time_logged:
-        time_until_first_record = first_record_time - join_start_time
-        logging.info(f"Time until the first record was extracted: {time_until_first_record:.4f} seconds")
-    else:
-        logging.info("No records were extracted.")
-    logging.info(f"Join values memory: {join_values_memory:.4f} MB")
-    logging.info(f"Probed rows memory: {probed_rows_memory:.4f} MB")
-    logging.info(f"Total memory required: {join_values_memory+probed_rows_memory:.4f} MB")
-    logging.info(f"Total execution time: {total_execution_time:.4f} seconds")
-    logging.info('-'*50)
+    # Perform the semi-join
+    logging.info(f"Performing semi-join between {driving_table_name} and {probed_table_name} tables...")
+    probes = 0
+    bisect_steps = 0
+    with open_sink(sink, csv_file, columns) as writer:
+        # Stream the driving table through the index of the reduced probed rows
+        for driving_timestamp, row1 in scan_decoded(cursor1, driving_table_name, driving_timestamp_column):
+            key = row1[driving_join_index]
+            probes += 1
+            if key in probed_index:
+                bisect_steps += 2 * len(probed_index[key][0]).bit_length()
+                for row2 in probe_band_index(probed_index, key, driving_timestamp, max_days_diff):
+                    writer.writerow(row1 + row2)
+                    metrics.add_rows()
+
+    join_time = metrics.end_phase('join')
+    logging.info(f"Join phase completed in {join_time:.4f} seconds")
+
+    metrics.count('probes', probes)
+    metrics.count('estimated_bisect_steps', bisect_steps)
+    metrics.count('reduced rows', len(probed_rows))
+    metrics.measure('join values', join_values)
+    metrics.measure('probed index', probed_index)
+    metrics.finish(max_days_diff=max_days_diff, bytes_shipped={'join values': join_values_bytes, 'reduced rows': probed_rows_bytes})
 
     # Close the connections
     conn1.close()
     conn2.close()
 
+    return metrics.rows
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Perform a Semi-Join between two SQLite databases.")
     parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
     parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
     parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
     parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
     args = parser.parse_args()
 
-    semi_join(args.db1, args.db2, args.invert_join, args.max_days_diff)
+    semi_join(args.db1, args.db2, args.invert_join, args.max_days_diff, args.sink)
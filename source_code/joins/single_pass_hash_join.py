@@ -1,15 +1,13 @@
-import sqlite3
-import time
 import os
 import logging
 import argparse
-import csv
 import sys
-from datetime import datetime
-import pickle
 
-import sys
-from collections.abc import Mapping, Container
+from band_index import build_band_index, build_compact_band_index, probe_band_index
+from table_scan import connect_for_reading, decoded_columns, scan_batches, scan_decoded, scan_join_columns, fetch_rows
+from sinks import open_sink, SINKS
+from index_cache import cached_band_index, DEFAULT_CACHE_MB, VALIDATION_MODES
+from instrumentation import JoinMetrics
 
 # Setup logging to a file
 def setup_logging(log_file):
@@ -23,7 +21,8 @@ def fetch_all_rows(cursor, table_name):
     return cursor.fetchall()
 
 
-def single_pass_hash_join(db1_path, db2_path, invert_join, max_days_diff):
+def single_pass_hash_join(db1_path, db2_path, invert_join, max_days_diff, sink='csv', index_cache_directory=None,
+                          max_cache_mb=DEFAULT_CACHE_MB, cache_validation='mtime', late_materialization=False):
     if invert_join:
         hash_db_path = db2_path
         probe_db_path = db1_path
@@ -39,8 +38,8 @@ def single_pass_hash_join(db1_path, db2_path, invert_join, max_days_diff):
     setup_logging(log_file)
     logging.info(result_type)
 
-    conn1 = sqlite3.connect(hash_db_path)
-    conn2 = sqlite3.connect(probe_db_path)
+    conn1 = connect_for_reading(hash_db_path)
+    conn2 = connect_for_reading(probe_db_path)
     cursor1 = conn1.cursor()
     cursor2 = conn2.cursor()
 
@@ -51,100 +50,111 @@ def single_pass_hash_join(db1_path, db2_path, invert_join, max_days_diff):
     table_name_2 = cursor2.fetchone()[0]
 
     # Determine the join attribute and its index in each table
+    join_attribute = 'Department'
     if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
         join_index_table_1 = 1  # Department is the second column in Employees table
         join_index_table_2 = 1  # Department is the second column in Projects table
-        timestamp_index_table_1 = 2  # HireDate is the fourth column in Employees table
-        timestamp_index_table_2 = 3  # StartDate is the third column in Projects table
+        timestamp_column_table_1 = 'StartDate'
+        timestamp_column_table_2 = 'HireDate'
         columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
     elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
         join_index_table_1 = 1  # Department is the second column in Projects table
         join_index_table_2 = 1  # Department is the second column in Employees table
-        timestamp_index_table_1 = 3  # StartDate is the third column in Projects table
-        timestamp_index_table_2 = 2  # HireDate is the fourth column in Employees table
+        timestamp_column_table_1 = 'HireDate'
+        timestamp_column_table_2 = 'StartDate'
         columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
     else:
         raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
 
-    # Fetch and calculate size for both tables
-    table_1_rows = fetch_all_rows(cursor1, table_name_1)
-    
-    # Measure the start time for the build phase
-    build_start_time = time.time()
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('build')
 
     # Build the hash table on the main node
     logging.info("Building hash table on the main node...")
-    hash_table = dict()
-    for row in table_1_rows:
-        key = row[join_index_table_1]
-        if key not in hash_table:
-            hash_table[key] = []
-        hash_table[key].append(row)
-
-    # Measure the end time for the build phase
-    build_end_time = time.time()
-    build_time = build_end_time - build_start_time
+    # Each bucket is kept sorted by timestamp so the probe can range-scan the date band
+    # The build table is streamed from SQLite in batches straight into the index
+    cache_hit = None
+    if late_materialization:
+        # Only the join key, date and rowid are read; buckets hold arrays of date ordinals and rowids
+        hash_table = build_compact_band_index(scan_join_columns(cursor1, table_name_1, join_attribute, timestamp_column_table_1))
+        _, _, build_select_list = decoded_columns(cursor1, table_name_1, timestamp_column_table_1)
+    elif index_cache_directory:
+        # A cached index is memory-mapped instead of rebuilt; its buckets are decoded on first use
+        hash_table, cache_hit = cached_band_index(cursor1, hash_db_path, table_name_1, join_index_table_1, timestamp_column_table_1,
+                                                  index_cache_directory, max_cache_mb, cache_validation)
+        logging.info(f"Build index {'loaded from' if cache_hit else 'written to'} the cache in {index_cache_directory}")
+    else:
+        hash_table = build_band_index(scan_decoded(cursor1, table_name_1, timestamp_column_table_1), join_index_table_1)
+
+    build_time = metrics.end_phase('build')
     logging.info(f"Build phase completed in {build_time:.4f} seconds")
 
-    # Measure the start time for the probe phase
-    probe_start_time = time.time()
+    metrics.start_phase('probe')
 
     # Perform the probe phase
     logging.info(f"Performing probe phase with {table_name_2} table...")
-    results = []
-    first_record_time_logged = False
-    first_record_time = 0.0
-    cursor2.execute(f"SELECT * FROM {table_name_2}")
-    with open(csv_file, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(columns)
-        for row in cursor2.fetchall():
-            key = row[join_index_table_2]
-            if key in hash_table:
-                probe_timestamp = datetime.strptime(row[timestamp_index_table_2], '%Y-%m-%d')     
-                for record in hash_table[key]:
-                    # Check the timestamp difference
-                    hash_timestamp = datetime.strptime(record[timestamp_index_table_1], '%Y-%m-%d')
-                    #probe_timestamp = datetime.strptime(row[timestamp_index_table_2], '%Y-%m-%d')
-                    if abs((probe_timestamp - hash_timestamp).days) <= max_days_diff:
-                        result = record + row
-                        results.append(result)
-                        writer.writerow(result)
-                        if not first_record_time_logged:
-                            first_record_time = time.time()
-                            first_record_time_logged = True
-
-    # Measure the end time for the probe phase
-    probe_end_time = time.time()
-    probe_time = probe_end_time - probe_start_time
+    probes = 0
+    bisect_steps = 0
+    fetched_rows = 0
+    with open_sink(sink, csv_file, columns) as writer:
+        if late_materialization:
+            # The matches of a probe batch are collected first, then their build rows are fetched by rowid at once
+            for batch in scan_batches(cursor2, table_name_2, timestamp_column_table_2):
+                matches = []
+                for probe_row in batch:
+                    probe_timestamp, row = probe_row[0], probe_row[1:]
+                    key = row[join_index_table_2]
+                    probes += 1
+                    if key in hash_table:
+                        bisect_steps += 2 * len(hash_table[key][0]).bit_length()
+                        for rowid in probe_band_index(hash_table, key, probe_timestamp, max_days_diff):
+                            matches.append((rowid, row))
+                if not matches:
+                    continue
+                records = fetch_rows(cursor1, table_name_1, build_select_list, list({rowid for rowid, _ in matches}))
+                fetched_rows += len(records)
+                for rowid, row in matches:
+                    writer.writerow(records[rowid] + row)
+                    metrics.add_rows()
+        else:
+            for probe_timestamp, row in scan_decoded(cursor2, table_name_2, timestamp_column_table_2):
+                key = row[join_index_table_2]
+                probes += 1
+                if key in hash_table:
+                    # Only the records inside the timestamp window are visited; each bound is a binary search
+                    bisect_steps += 2 * len(hash_table[key][0]).bit_length()
+                    for record in probe_band_index(hash_table, key, probe_timestamp, max_days_diff):
+                        writer.writerow(record + row)
+                        metrics.add_rows()
+
+    probe_time = metrics.end_phase('probe')
     logging.info(f"Probe phase completed in {probe_time:.4f} seconds")
 
-    # Calculate the total execution time
-    total_execution_time = build_time + probe_time
-
-    hash_table_memory = sys.getsizeof(pickle.dumps(hash_table)) / ((1024)*(1024))  # Convert to MB
-
-    logging.info(f"Join produced {len(results)} rows")
-    # Calculate the time until the first record was written
-    if first_record_time_logged:
-        time_until_first_record = first_record_time - build_start_time
-        logging.info(f"Time until the first record was extracted: {time_until_first_record:.4f} seconds")
-    else:
-        logging.info("No records were extracted.")
-    logging.info(f"Hash table memory: {hash_table_memory:.4f} MB")
-    logging.info(f"Total execution time: {total_execution_time:.4f} seconds")
-    logging.info('-'*50)
+    metrics.count('probes', probes)
+    metrics.count('estimated_bisect_steps', bisect_steps)
+    if late_materialization:
+        metrics.count('fetched rows', fetched_rows)
+    metrics.measure('hash table', hash_table)
+    metrics.finish(max_days_diff=max_days_diff, index_cache_hit=cache_hit, late_materialization=late_materialization)
 
     # Close the connections
     conn1.close()
     conn2.close()
 
+    return metrics.rows
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Perform a Single Pass Hash Join between two SQLite databases.")
     parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
     parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
     parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
     parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    parser.add_argument('--index_cache_dir', type=str, default=None, help='Directory of the persistent build index cache. Default=no cache')
+    parser.add_argument('--index_cache_mb', type=float, default=DEFAULT_CACHE_MB, help='Size cap of the index cache directory in MB; least recently used entries are evicted.')
+    parser.add_argument('--cache_validation', type=str, default='mtime', choices=VALIDATION_MODES, help='Check cached indexes against the database file size and mtime, or a hash of its content.')
+    parser.add_argument('--late_materialization', action='store_true', help='Build the hash table from the join key, date and rowid only, and fetch the build rows once they match.')
     args = parser.parse_args()
 
-    single_pass_hash_join(args.db1, args.db2, args.invert_join, args.max_days_diff)
+    single_pass_hash_join(args.db1, args.db2, args.invert_join, args.max_days_diff, args.sink, args.index_cache_dir,
+                          args.index_cache_mb, args.cache_validation, args.late_materialization)
@@ -0,0 +1,303 @@
+import os
+import csv
+import json
+import shutil
+import sqlite3
+import hashlib
+
+import numpy as np
+
+# Result rows are buffered and handed to the storage in batches of this many
+BATCH_ROWS = 8192
+# Write buffer of the CSV file
+CSV_BUFFER_BYTES = 1 << 20
+# Row hashes are summed modulo this, so the digest does not depend on the row order
+DIGEST_MODULUS = 1 << 128
+
+# Base class of the result sinks: buffers rows and writes them in batches. A sink is opened on the
+# CSV file name of a join; sinks that store something else derive their path from it. With append
+# set, an existing output is extended instead of replaced; rows counts the rows of this session only.
+class ResultSink:
+    name = None
+    suffix = None
+
+    def __init__(self, output_file, columns, batch_rows=BATCH_ROWS, append=False):
+        self.path = self.output_path(output_file)
+        self.columns = list(columns)
+        self.batch_rows = batch_rows
+        self.append = append and self.path is not None and os.path.exists(self.path)
+        self.buffer = []
+        self.rows = 0
+
+    @classmethod
+    def output_path(cls, output_file):
+        return os.path.splitext(output_file)[0] + cls.suffix if cls.suffix else None
+
+    # Size of an existing output, read without scanning it (e.g. a file size), so that a caller can tell
+    # whether the output changed since it last wrote to it; None if it stores nothing or cannot be read
+    @classmethod
+    def stored_size(cls, path):
+        return None
+
+    def writerow(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_rows:
+            self.flush()
+
+    def writerows(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.write_batch(self.buffer)
+            self.rows += len(self.buffer)
+            self.buffer = []
+
+    def write_batch(self, rows):
+        raise NotImplementedError
+
+    # Append the output of another sink of the same kind (e.g. the part written by a worker process)
+    def merge(self, summary):
+        raise NotImplementedError
+
+    # Picklable description of the output, returned by close()
+    def summary(self):
+        return {'sink': self.name, 'path': self.path, 'rows': self.rows}
+
+    def close(self):
+        self.flush()
+        return self.summary()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# CSV file with a header row, written with writerows
+class CSVSink(ResultSink):
+    name = 'csv'
+    suffix = '.csv'
+
+    def __init__(self, output_file, columns, batch_rows=BATCH_ROWS, append=False):
+        super().__init__(output_file, columns, batch_rows, append)
+        self.file = open(self.path, 'a' if self.append else 'w', newline='', buffering=CSV_BUFFER_BYTES)
+        self.writer = csv.writer(self.file)
+        if not self.append:
+            self.writer.writerow(self.columns)
+
+    @classmethod
+    def stored_size(cls, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    def write_batch(self, rows):
+        self.writer.writerows(rows)
+
+    def merge(self, summary):
+        self.flush()
+        with open(summary['path'], 'r', newline='') as part:
+            part.readline()  # Header
+            shutil.copyfileobj(part, self.file)
+        self.rows += summary['rows']
+
+    def close(self):
+        summary = super().close()
+        self.file.close()
+        return summary
+
+# Directory of .npy chunks, one file per column and batch, described by columns.json
+class NpySink(ResultSink):
+    name = 'npy'
+    suffix = '_npy'
+
+    def __init__(self, output_file, columns, batch_rows=BATCH_ROWS * 8, append=False):
+        super().__init__(output_file, columns, batch_rows, append)
+        self.chunks = 0
+        self.previous_rows = 0
+        if self.append:
+            with open(os.path.join(self.path, 'columns.json')) as file:
+                manifest = json.load(file)
+            self.chunks = manifest['chunks']
+            self.previous_rows = manifest['rows']
+        else:
+            if os.path.exists(self.path):
+                shutil.rmtree(self.path)
+            os.makedirs(self.path)
+
+    @classmethod
+    def stored_size(cls, path):
+        try:
+            with open(os.path.join(path, 'columns.json')) as file:
+                manifest = json.load(file)
+            return manifest['rows'], manifest['chunks']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def chunk_file(self, chunk, column):
+        return os.path.join(self.path, f"chunk_{chunk:06d}_{column}.npy")
+
+    def write_batch(self, rows):
+        for column, values in enumerate(zip(*rows)):
+            np.save(self.chunk_file(self.chunks, column), np.array(values))
+        self.chunks += 1
+
+    def merge(self, summary):
+        self.flush()
+        for chunk in range(summary['chunks']):
+            for column in range(len(self.columns)):
+                # The part may be on another file system (e.g. a temporary directory), where a rename fails
+                shutil.move(os.path.join(summary['path'], f"chunk_{chunk:06d}_{column}.npy"), self.chunk_file(self.chunks, column))
+            self.chunks += 1
+        self.rows += summary['rows']
+
+    def summary(self):
+        summary = super().summary()
+        summary['chunks'] = self.chunks
+        return summary
+
+    def close(self):
+        summary = super().close()
+        with open(os.path.join(self.path, 'columns.json'), 'w') as file:
+            json.dump({'columns': self.columns, 'chunks': self.chunks, 'rows': self.previous_rows + self.rows}, file)
+        return summary
+
+# Table "result" in a SQLite database, bulk-loaded in one transaction
+class SQLiteSink(ResultSink):
+    name = 'sqlite'
+    suffix = '.db'
+
+    def __init__(self, output_file, columns, batch_rows=BATCH_ROWS, append=False):
+        super().__init__(output_file, columns, batch_rows, append)
+        if os.path.exists(self.path) and not self.append:
+            os.remove(self.path)
+        self.conn = sqlite3.connect(self.path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        # Both tables have a Department column; later duplicates get a suffix
+        names = []
+        for column in self.columns:
+            name = column
+            while name in names:
+                name = f"{name}_{len(names)}"
+            names.append(name)
+        quoted_names = ', '.join('"' + name + '"' for name in names)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS result ({quoted_names})")
+        self.insert = f"INSERT INTO result VALUES ({', '.join(['?'] * len(names))})"
+        self.conn.execute("BEGIN")
+
+    # Rows are only ever appended, so the largest rowid is the row count, read from the end of the B-tree
+    @classmethod
+    def stored_size(cls, path):
+        try:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                return conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM result").fetchone()[0]
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+
+    def write_batch(self, rows):
+        self.conn.executemany(self.insert, rows)
+
+    def merge(self, summary):
+        self.flush()
+        # ATTACH is not allowed inside a transaction
+        self.conn.execute("COMMIT")
+        self.conn.execute("ATTACH DATABASE ? AS part", (summary['path'],))
+        self.conn.execute("INSERT INTO result SELECT * FROM part.result")
+        self.conn.execute("DETACH DATABASE part")
+        self.conn.execute("BEGIN")
+        self.rows += summary['rows']
+
+    def close(self):
+        summary = super().close()
+        self.conn.execute("COMMIT")
+        self.conn.close()
+        return summary
+
+# Counts the rows and stores nothing, to time the join alone
+class NullSink(ResultSink):
+    name = 'null'
+
+    def writerow(self, row):
+        self.rows += 1
+
+    def writerows(self, rows):
+        for _ in rows:
+            self.rows += 1
+
+    def merge(self, summary):
+        self.rows += summary['rows']
+
+# Order-independent digest of the result: the sum of a 128-bit hash of every row. Values are
+# hashed as text in the order of the sorted column names, so both join directions, and rows
+# read back from a CSV file, give the same digest. Written to <output>.digest.json.
+class DigestSink(ResultSink):
+    name = 'digest'
+    suffix = '.digest.json'
+
+    def __init__(self, output_file, columns, batch_rows=BATCH_ROWS, append=False):
+        super().__init__(output_file, columns, batch_rows, append)
+        self.order = sorted(range(len(self.columns)), key=lambda column: self.columns[column])
+        self.digest = 0
+        self.previous_rows = 0
+        if self.append:
+            with open(self.path) as file:
+                previous = json.load(file)
+            self.digest = int(previous['digest'], 16)
+            self.previous_rows = previous['rows']
+
+    @classmethod
+    def stored_size(cls, path):
+        try:
+            with open(path) as file:
+                previous = json.load(file)
+            return previous['rows'], previous['digest']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def write_batch(self, rows):
+        order = self.order
+        digest = self.digest
+        for row in rows:
+            encoded = '\x1f'.join([str(row[column]) for column in order]).encode()
+            digest += int.from_bytes(hashlib.blake2b(encoded, digest_size=16).digest(), 'little')
+        self.digest = digest % DIGEST_MODULUS
+
+    def merge(self, summary):
+        self.flush()
+        self.digest = (self.digest + int(summary['digest'], 16)) % DIGEST_MODULUS
+        self.rows += summary['rows']
+
+    def summary(self):
+        summary = super().summary()
+        summary['digest'] = f"{self.digest:032x}"
+        return summary
+
+    def close(self):
+        summary = super().close()
+        with open(self.path, 'w') as file:
+            json.dump({'columns': sorted(self.columns), 'rows': self.previous_rows + self.rows, 'digest': summary['digest']}, file)
+        return summary
+
+SINKS = {sink.name: sink for sink in (CSVSink, NpySink, SQLiteSink, NullSink, DigestSink)}
+
+# Open the sink of the given kind for the output of a join
+def open_sink(kind, output_file, columns, append=False):
+    return SINKS[kind](output_file, columns, append=append)
+
+# Path of the file or directory a sink of the given kind writes for the output of a join (None for null)
+def sink_path(kind, output_file):
+    return SINKS[kind].output_path(output_file)
+
+# Size of the existing output of a join, read without scanning it (None for null, or if it cannot be read)
+def output_size(kind, output_file):
+    sink = SINKS[kind]
+    path = sink.output_path(output_file)
+    return sink.stored_size(path) if path is not None else None
@@ -0,0 +1,138 @@
+import logging
+import argparse
+import sys
+from collections import deque
+
+from table_scan import connect_for_reading, scan_decoded, has_index
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# Scan a table sorted by (join attribute, timestamp); SQLite walks a matching index when there
+# is one and otherwise runs its own external merge sort, spilling to temporary files if needed
+def sorted_scan(cursor, table_name, join_attribute, timestamp_column):
+    if has_index(cursor, table_name, [join_attribute, timestamp_column]):
+        logging.info(f"Sorting {table_name} through the ({join_attribute}, {timestamp_column}) index")
+    else:
+        logging.info(f"No ({join_attribute}, {timestamp_column}) index on {table_name}, SQLite sorts externally")
+    return scan_decoded(cursor, table_name, timestamp_column, order_by=f"{join_attribute}, {timestamp_column}")
+
+def sort_merge_join(db1_path, db2_path, invert_join, max_days_diff, sink='csv'):
+    if invert_join:
+        left_db_path = db2_path
+        right_db_path = db1_path
+        csv_file = "sort_merge_join_large_join_small.csv"
+        result_type = "Sort-merge band join (Large join Small)"
+    else:
+        left_db_path = db1_path
+        right_db_path = db2_path
+        csv_file = "sort_merge_join_small_join_large.csv"
+        result_type = "Sort-merge band join (Small join Large)"
+
+    log_file = "results.log"
+    setup_logging(log_file)
+    logging.info(result_type)
+
+    conn1 = connect_for_reading(left_db_path)
+    conn2 = connect_for_reading(right_db_path)
+    cursor1 = conn1.cursor()
+    cursor2 = conn2.cursor()
+
+    # Fetch the table names
+    cursor1.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_1 = cursor1.fetchone()[0]
+    cursor2.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_2 = cursor2.fetchone()[0]
+
+    # Determine the join attribute and its index in each table
+    if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
+        join_attribute = 'Department'
+        join_index_table_1 = 1  # Department is the second column in Projects table
+        join_index_table_2 = 1  # Department is the second column in Employees table
+        timestamp_column_table_1 = 'StartDate'
+        timestamp_column_table_2 = 'HireDate'
+        columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
+    elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
+        join_attribute = 'Department'
+        join_index_table_1 = 1  # Department is the second column in Employees table
+        join_index_table_2 = 1  # Department is the second column in Projects table
+        timestamp_column_table_1 = 'HireDate'
+        timestamp_column_table_2 = 'StartDate'
+        columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
+    else:
+        raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('sort')
+    left = sorted_scan(cursor1, table_name_1, join_attribute, timestamp_column_table_1)
+    right = sorted_scan(cursor2, table_name_2, join_attribute, timestamp_column_table_2)
+    right_entry = next(right, None)
+    left_entry = next(left, None)
+    sort_time = metrics.end_phase('sort')
+    logging.info(f"Sort phase completed in {sort_time:.4f} seconds")
+
+    metrics.start_phase('merge')
+
+    logging.info(f"Performing merge phase with {table_name_1} and {table_name_2} tables...")
+    max_window_size = 0
+    comparisons = 0
+    # Right rows of the current key whose timestamp may still match upcoming left rows
+    window = deque()
+    with open_sink(sink, csv_file, columns) as writer:
+        while left_entry is not None:
+            left_timestamp, left_row = left_entry
+            key = left_row[join_index_table_1]
+
+            # Left rows arrive in (key, timestamp) order, so rows that fell out of the band never return
+            while window and (window[0][1][join_index_table_2] != key or window[0][0] < left_timestamp - max_days_diff):
+                window.popleft()
+                comparisons += 1
+
+            # Pull right rows up to the top of the band of the current left row
+            while right_entry is not None:
+                right_timestamp, right_row = right_entry
+                right_key = right_row[join_index_table_2]
+                comparisons += 1
+                if right_key > key or (right_key == key and right_timestamp > left_timestamp + max_days_diff):
+                    break
+                if right_key == key and right_timestamp >= left_timestamp - max_days_diff:
+                    window.append(right_entry)
+                right_entry = next(right, None)
+            max_window_size = max(max_window_size, len(window))
+
+            for _, right_row in window:
+                writer.writerow(left_row + right_row)
+            if window:
+                metrics.add_rows(len(window))
+
+            left_entry = next(left, None)
+
+    merge_time = metrics.end_phase('merge')
+    logging.info(f"Merge phase completed in {merge_time:.4f} seconds")
+
+    logging.info(f"Largest merge window: {max_window_size} rows")
+    metrics.count('comparisons', comparisons)
+    metrics.finish(max_days_diff=max_days_diff, max_window_size=max_window_size)
+
+    # Close the connections
+    conn1.close()
+    conn2.close()
+
+    return metrics.rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform a Sort-Merge Band Join between two SQLite databases.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    args = parser.parse_args()
+
+    sort_merge_join(args.db1, args.db2, args.invert_join, args.max_days_diff, args.sink)
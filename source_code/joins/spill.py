@@ -0,0 +1,46 @@
+import os
+import pickle
+
+# Append-only spill file holding (day ordinal, row) entries, written in pickled batches
+class PartitionFile:
+    def __init__(self, path, batch_size=1024):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        self.count = 0
+        self.bytes_written = 0
+
+    def append(self, entry):
+        self.buffer.append(entry)
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        # The file is only held open while a batch is written, so many partitions can coexist
+        data = pickle.dumps(self.buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.path, 'ab') as file:
+            file.write(data)
+        self.bytes_written += len(data)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+
+# Stream the entries of a spill file back, batch by batch
+def read_partition(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                batch = pickle.load(file)
+            except EOFError:
+                return
+            yield from batch
@@ -0,0 +1,132 @@
+import logging
+import argparse
+import sys
+
+from table_scan import connect_for_reading, decoded_columns, table_columns, has_index, JULIAN_DAY_ORDINAL_OFFSET
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
+
+# Schema name of the attached second database
+ATTACHED_SCHEMA = 'probe'
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# Create a covering (join attribute, timestamp, remaining columns) index unless a
+# (join attribute, timestamp) index already exists. Returns True if an index was created.
+def ensure_band_index(cursor, schema, table_name, join_attribute, timestamp_column):
+    if has_index(cursor, table_name, [join_attribute, timestamp_column], schema):
+        return False
+    remaining = [name for name, _ in table_columns(cursor, table_name, schema) if name not in (join_attribute, timestamp_column)]
+    index_columns = ', '.join([join_attribute, timestamp_column] + remaining)
+    cursor.execute(f"CREATE INDEX {schema}.idx_{table_name}_{join_attribute}_{timestamp_column} ON {table_name} ({index_columns})")
+    return True
+
+# Lower and upper bound of the inner timestamp column for an outer day ordinal, in the inner column's
+# own representation so the BETWEEN can be answered by the inner index
+def band_bounds(outer_ordinal, inner_type, max_days_diff):
+    if inner_type == 'INTEGER':
+        return f"{outer_ordinal} - {max_days_diff}", f"{outer_ordinal} + {max_days_diff}"
+    return (f"date({outer_ordinal} + {JULIAN_DAY_ORDINAL_OFFSET - max_days_diff})",
+            f"date({outer_ordinal} + {JULIAN_DAY_ORDINAL_OFFSET + max_days_diff})")
+
+def sql_pushdown_join(db1_path, db2_path, invert_join, max_days_diff, create_indexes, sink='csv'):
+    if invert_join:
+        main_db_path = db2_path
+        attached_db_path = db1_path
+        csv_file = "sql_pushdown_join_large_join_small.csv"
+        result_type = "SQL pushdown join (Large join Small)"
+    else:
+        main_db_path = db1_path
+        attached_db_path = db2_path
+        csv_file = "sql_pushdown_join_small_join_large.csv"
+        result_type = "SQL pushdown join (Small join Large)"
+
+    log_file = "results.log"
+    setup_logging(log_file)
+    logging.info(result_type)
+
+    conn = connect_for_reading(main_db_path)
+    cursor = conn.cursor()
+    cursor.execute(f"ATTACH DATABASE ? AS {ATTACHED_SCHEMA}", (attached_db_path,))
+
+    # Fetch the table names
+    cursor.execute("SELECT name FROM main.sqlite_master WHERE type='table'")
+    table_name_1 = cursor.fetchone()[0]
+    cursor.execute(f"SELECT name FROM {ATTACHED_SCHEMA}.sqlite_master WHERE type='table'")
+    table_name_2 = cursor.fetchone()[0]
+
+    # Determine the join attribute and the timestamp column of each table
+    if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
+        join_attribute = 'Department'
+        timestamp_column_table_1 = 'StartDate'
+        timestamp_column_table_2 = 'HireDate'
+        columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
+    elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
+        join_attribute = 'Department'
+        timestamp_column_table_1 = 'HireDate'
+        timestamp_column_table_2 = 'StartDate'
+        columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
+    else:
+        raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('index')
+    if create_indexes:
+        for schema, table_name, timestamp_column in (('main', table_name_1, timestamp_column_table_1),
+                                                     (ATTACHED_SCHEMA, table_name_2, timestamp_column_table_2)):
+            if ensure_band_index(cursor, schema, table_name, join_attribute, timestamp_column):
+                logging.info(f"Created covering index on {table_name} ({join_attribute}, {timestamp_column})")
+        conn.commit()
+    index_time = metrics.end_phase('index')
+    logging.info(f"Index phase completed in {index_time:.4f} seconds")
+
+    # Build the band join as a single statement
+    ordinal_1, _, select_list_1 = decoded_columns(cursor, table_name_1, timestamp_column_table_1, 't1')
+    _, type_2, select_list_2 = decoded_columns(cursor, table_name_2, timestamp_column_table_2, 't2', ATTACHED_SCHEMA)
+    low, high = band_bounds(ordinal_1, type_2, max_days_diff)
+    query = (f"SELECT {', '.join(select_list_1 + select_list_2)} "
+             f"FROM main.{table_name_1} AS t1 JOIN {ATTACHED_SCHEMA}.{table_name_2} AS t2 "
+             f"ON t2.{join_attribute} = t1.{join_attribute} AND t2.{timestamp_column_table_2} BETWEEN {low} AND {high}")
+    cursor.execute(f"EXPLAIN QUERY PLAN {query}")
+    for plan_row in cursor.fetchall():
+        logging.info(f"Query plan: {plan_row[-1]}")
+
+    metrics.start_phase('query')
+
+    logging.info(f"Performing band join of {table_name_1} and {table_name_2} inside SQLite...")
+    cursor.execute(query)
+    with open_sink(sink, csv_file, columns) as writer:
+        # Stream the cursor straight to the output in batches
+        while True:
+            batch = cursor.fetchmany(1000)
+            if not batch:
+                break
+            writer.writerows(batch)
+            metrics.add_rows(len(batch))
+
+    query_time = metrics.end_phase('query')
+    logging.info(f"Query phase completed in {query_time:.4f} seconds")
+
+    metrics.finish(max_days_diff=max_days_diff, create_indexes=create_indexes)
+
+    # Close the connection
+    conn.close()
+
+    return metrics.rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform the band join inside SQLite by attaching the second database.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--no_create_indexes', action='store_true', help='Do not create missing (join attribute, timestamp) indexes.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    args = parser.parse_args()
+
+    sql_pushdown_join(args.db1, args.db2, args.invert_join, args.max_days_diff, not args.no_create_indexes, args.sink)
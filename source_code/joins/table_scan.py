@@ -0,0 +1,111 @@
+import sqlite3
+
+# Offset between SQLite's julianday() and Python's date.toordinal()
+JULIAN_DAY_ORDINAL_OFFSET = 1721424.5
+# Number of rows fetched from SQLite per call; the first fetch is small to keep time-to-first-row low
+DEFAULT_BATCH_SIZE = 1000
+FIRST_BATCH_SIZE = 16
+# Rowids per IN list when fetching rows (SQLite before 3.32 allows at most 999 parameters)
+FETCH_CHUNK_SIZE = 900
+# Read connection tuning: memory-map up to 256 MB of the file and keep a 64 MB page cache
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KB = 64 * 1024
+
+# Open a connection tuned for scanning
+def connect_for_reading(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    return conn
+
+# Return the (name, declared type) pairs of a table's columns
+def table_columns(cursor, table_name, schema='main'):
+    cursor.execute(f"PRAGMA {schema}.table_info({table_name})")
+    return [(row[1], row[2].upper()) for row in cursor.fetchall()]
+
+# Return True if the table has an index whose leading columns are exactly the given ones
+def has_index(cursor, table_name, columns, schema='main'):
+    cursor.execute(f"PRAGMA {schema}.index_list({table_name})")
+    for index_name in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"PRAGMA {schema}.index_info({index_name})")
+        index_columns = [row[2] for row in sorted(cursor.fetchall())]
+        if index_columns[:len(columns)] == list(columns):
+            return True
+    return False
+
+# Return the day-ordinal expression of a date column and its select expression rendered as 'YYYY-MM-DD'
+def date_column_expressions(name, declared_type, prefix=''):
+    if declared_type == 'INTEGER':
+        # Dates stored as day ordinals
+        return f"{prefix}{name}", f"date({prefix}{name} + {JULIAN_DAY_ORDINAL_OFFSET}) AS {name}"
+    # Dates stored as ISO-8601 text
+    return f"CAST(julianday({prefix}{name}) - {JULIAN_DAY_ORDINAL_OFFSET} AS INTEGER)", f"{prefix}{name}"
+
+# Return the day-ordinal expression of timestamp_column, its declared type, and the table's
+# select list with dates always rendered as 'YYYY-MM-DD'. Column references are prefixed with alias.
+# The conversion runs inside SQLite, so no datetime objects are created in Python.
+def decoded_columns(cursor, table_name, timestamp_column, alias='', schema='main'):
+    prefix = f"{alias}." if alias else ''
+    select_list = []
+    ordinal_expression = None
+    timestamp_type = None
+    for name, declared_type in table_columns(cursor, table_name, schema):
+        if name == timestamp_column:
+            ordinal_expression, rendered = date_column_expressions(name, declared_type, prefix)
+            timestamp_type = declared_type
+            select_list.append(rendered)
+        else:
+            select_list.append(f"{prefix}{name}")
+    if ordinal_expression is None:
+        raise ValueError(f"Column {timestamp_column} not found in table {table_name}.")
+    return ordinal_expression, timestamp_type, select_list
+
+# Build a SELECT whose first column is the day ordinal of timestamp_column,
+# followed by the table's columns with dates always rendered as 'YYYY-MM-DD'
+def decoded_select(cursor, table_name, timestamp_column, where='', order_by=''):
+    ordinal_expression, _, select_list = decoded_columns(cursor, table_name, timestamp_column)
+    query = f"SELECT {ordinal_expression}, {', '.join(select_list)} FROM {table_name}"
+    if where:
+        query += f" WHERE {where}"
+    if order_by:
+        query += f" ORDER BY {order_by}"
+    return query
+
+# Scan a table yielding lists of up to batch_size raw rows, each starting with the day ordinal.
+# Batches double in size from FIRST_BATCH_SIZE up to batch_size.
+def scan_batches(cursor, table_name, timestamp_column, where='', parameters=(), batch_size=DEFAULT_BATCH_SIZE, order_by=''):
+    cursor.execute(decoded_select(cursor, table_name, timestamp_column, where, order_by), parameters)
+    size = min(FIRST_BATCH_SIZE, batch_size)
+    while True:
+        batch = cursor.fetchmany(size)
+        if not batch:
+            return
+        yield batch
+        size = min(size * 2, batch_size)
+
+# Scan a table yielding (day ordinal, row) pairs, fetched from SQLite in batches
+def scan_decoded(cursor, table_name, timestamp_column, where='', parameters=(), batch_size=DEFAULT_BATCH_SIZE, order_by=''):
+    for batch in scan_batches(cursor, table_name, timestamp_column, where, parameters, batch_size, order_by):
+        for row in batch:
+            yield row[0], row[1:]
+
+# Scan only the join key, the day ordinal and the rowid of a table, yielding (join key, day ordinal, rowid)
+# triples. The other columns are never read into Python; see fetch_rows.
+def scan_join_columns(cursor, table_name, join_attribute, timestamp_column, batch_size=DEFAULT_BATCH_SIZE):
+    ordinal_expression, _, _ = decoded_columns(cursor, table_name, timestamp_column)
+    cursor.execute(f"SELECT {join_attribute}, {ordinal_expression}, rowid FROM {table_name}")
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield from batch
+
+# Fetch the rows with the given rowids, selecting select_list (see decoded_columns); returns rowid -> row
+def fetch_rows(cursor, table_name, select_list, rowids):
+    rows = dict()
+    for start in range(0, len(rowids), FETCH_CHUNK_SIZE):
+        chunk = rowids[start:start + FETCH_CHUNK_SIZE]
+        cursor.execute(f"SELECT rowid, {', '.join(select_list)} FROM {table_name} WHERE rowid IN ({','.join(['?'] * len(chunk))})", chunk)
+        for row in cursor.fetchall():
+            rows[row[0]] = row[1:]
+    return rows
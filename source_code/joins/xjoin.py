@@ -0,0 +1,200 @@
+import os
+import logging
+import argparse
+import sys
+import pickle
+import tempfile
+
+from band_index import build_keyed_band_index, insert_into_band_index, probe_band_index
+from table_scan import connect_for_reading, scan_decoded
+from spill import PartitionFile, read_partition
+from sinks import open_sink, SINKS
+from instrumentation import JoinMetrics
+
+# Departure timestamp of tuples that never left memory
+NEVER_FLUSHED = float('inf')
+
+# Setup logging to a file
+def setup_logging(log_file):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler(log_file ,mode='a'),
+        logging.StreamHandler(sys.stdout)
+    ])
+
+# A pair was already emitted by the in-memory phase if the earlier tuple was
+# still resident when the later tuple arrived. A flush happens after the tuple
+# that triggered it has probed, so departing at that arrival still counts as resident.
+def emitted_in_memory(arrival_1, departure_1, arrival_2, departure_2):
+    if arrival_1 < arrival_2:
+        return arrival_2 <= departure_1
+    return arrival_1 <= departure_2
+
+# Load every tuple of a partition (disk and memory) as (key, ordinal, (row, arrival, departure)) entries
+def partition_entries(partition_file, memory_partition, join_index):
+    for ordinal, row, arrival, departure in read_partition(partition_file.path):
+        yield row[join_index], ordinal, (row, arrival, departure)
+    for key, (ordinals, items) in memory_partition.items():
+        for ordinal, (row, arrival) in zip(ordinals, items):
+            yield key, ordinal, (row, arrival, NEVER_FLUSHED)
+
+def xjoin(db1_path, db2_path, invert_join, max_days_diff, memory_threshold_mb, num_partitions, sink='csv'):
+    if invert_join:
+        hash_db_path = db2_path
+        probe_db_path = db1_path
+        csv_file = "xjoin_large_join_small.csv"
+        result_type = "XJoin (Large join Small)"
+    else:
+        hash_db_path = db1_path
+        probe_db_path = db2_path
+        csv_file = "xjoin_small_join_large.csv"
+        result_type = "XJoin (Small join Large)"
+
+    log_file = "results.log"
+    setup_logging(log_file)
+    logging.info(result_type)
+
+    conn1 = connect_for_reading(hash_db_path)
+    conn2 = connect_for_reading(probe_db_path)
+    cursor1 = conn1.cursor()
+    cursor2 = conn2.cursor()
+
+    # Fetch the table names
+    cursor1.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_1 = cursor1.fetchone()[0]
+    cursor2.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    table_name_2 = cursor2.fetchone()[0]
+
+    # Determine the join attribute and its index in each table
+    if table_name_1.lower() == 'projects' and table_name_2.lower() == 'employees':
+        join_index_table_1 = 1  # Department is the second column in Projects table
+        join_index_table_2 = 1  # Department is the second column in Employees table
+        timestamp_column_table_1 = 'StartDate'
+        timestamp_column_table_2 = 'HireDate'
+        columns = ['ProjectID', 'Department', 'StartDate', 'Funding', 'EmployeeID', 'Department', 'Name', 'HireDate']
+    elif table_name_1.lower() == 'employees' and table_name_2.lower() == 'projects':
+        join_index_table_1 = 1  # Department is the second column in Employees table
+        join_index_table_2 = 1  # Department is the second column in Projects table
+        timestamp_column_table_1 = 'HireDate'
+        timestamp_column_table_2 = 'StartDate'
+        columns = ['EmployeeID', 'Department', 'Name', 'HireDate', 'ProjectID', 'Department', 'StartDate', 'Funding']
+    else:
+        raise ValueError("Unexpected table names. Expected 'Employees' and 'Projects'.")
+
+    memory_threshold_bytes = int(memory_threshold_mb * 1024 * 1024)
+    join_indexes = [join_index_table_1, join_index_table_2]
+
+    # Per side: one in-memory band index per partition, its spill file and its resident tuple count
+    memory_partitions = [[dict() for _ in range(num_partitions)] for _ in range(2)]
+    resident_counts = [[0] * num_partitions for _ in range(2)]
+    # Approximate bytes per resident tuple, estimated from the first tuple of each side
+    entry_bytes = [None, None]
+    resident_bytes = 0
+    flushes = 0
+    flushed_bytes = 0
+
+    metrics = JoinMetrics(result_type)
+    metrics.start_phase('in-memory')
+
+    logging.info(f"Performing probe phase with {table_name_1} and {table_name_2} tables...")
+    cleanup_rows = 0
+    probes = 0
+    arrival = 0
+    scans = [scan_decoded(cursor1, table_name_1, timestamp_column_table_1),
+             scan_decoded(cursor2, table_name_2, timestamp_column_table_2)]
+    with tempfile.TemporaryDirectory(prefix='xjoin_') as spill_directory, open_sink(sink, csv_file, columns) as writer:
+        spill_files = [[PartitionFile(os.path.join(spill_directory, f"side{side}_{partition}")) for partition in range(num_partitions)] for side in range(2)]
+
+        # Stage 1: symmetric hash join over the in-memory partitions
+        exhausted = [False, False]
+        while not (exhausted[0] and exhausted[1]):
+            for side in (0, 1):
+                if exhausted[side]:
+                    continue
+                fetched = next(scans[side], None)
+                if fetched is None:
+                    exhausted[side] = True
+                    continue
+                arrival += 1
+                ordinal, row = fetched
+                key = row[join_indexes[side]]
+                partition = hash(key) % num_partitions
+
+                other_partition = memory_partitions[1 - side][partition]
+                probes += 1
+                if key in other_partition:
+                    for record, _ in probe_band_index(other_partition, key, ordinal, max_days_diff):
+                        writer.writerow(row + record if side == 0 else record + row)
+                        metrics.add_rows()
+
+                insert_into_band_index(memory_partitions[side][partition], key, ordinal, (row, arrival))
+                resident_counts[side][partition] += 1
+                if entry_bytes[side] is None:
+                    entry_bytes[side] = len(pickle.dumps((ordinal, row, arrival, arrival)))
+                resident_bytes += entry_bytes[side]
+
+                # Flush the largest resident partition to disk when over the memory threshold
+                if resident_bytes > memory_threshold_bytes:
+                    flush_side, flush_partition = max(((s, p) for s in (0, 1) for p in range(num_partitions)),
+                                                      key=lambda sp: resident_counts[sp[0]][sp[1]] * (entry_bytes[sp[0]] or 0))
+                    departure = arrival
+                    spill_file = spill_files[flush_side][flush_partition]
+                    before = spill_file.bytes_written
+                    for ordinals, items in memory_partitions[flush_side][flush_partition].values():
+                        for flushed_ordinal, (flushed_row, flushed_arrival) in zip(ordinals, items):
+                            spill_file.append((flushed_ordinal, flushed_row, flushed_arrival, departure))
+                    spill_file.flush()
+                    flushed_bytes += spill_file.bytes_written - before
+                    resident_bytes -= resident_counts[flush_side][flush_partition] * entry_bytes[flush_side]
+                    resident_counts[flush_side][flush_partition] = 0
+                    memory_partitions[flush_side][flush_partition] = dict()
+                    flushes += 1
+
+        memory_phase_time = metrics.end_phase('in-memory')
+        logging.info(f"In-memory phase completed in {memory_phase_time:.4f} seconds with {flushes} partition flushes ({flushed_bytes} bytes)")
+
+        # Cleanup stage: join partitions that were flushed, skipping pairs already emitted in memory
+        metrics.start_phase('cleanup')
+        for partition in range(num_partitions):
+            if spill_files[0][partition].count == 0 and spill_files[1][partition].count == 0:
+                continue
+            partition_index = build_keyed_band_index(partition_entries(spill_files[0][partition], memory_partitions[0][partition], join_index_table_1))
+            memory_partitions[0][partition] = None
+            for key, ordinal, (row2, arrival_2, departure_2) in partition_entries(spill_files[1][partition], memory_partitions[1][partition], join_index_table_2):
+                probes += 1
+                if key not in partition_index:
+                    continue
+                for row1, arrival_1, departure_1 in probe_band_index(partition_index, key, ordinal, max_days_diff):
+                    if emitted_in_memory(arrival_1, departure_1, arrival_2, departure_2):
+                        continue
+                    writer.writerow(row1 + row2)
+                    metrics.add_rows()
+                    cleanup_rows += 1
+            memory_partitions[1][partition] = None
+        cleanup_time = metrics.end_phase('cleanup')
+        logging.info(f"Cleanup phase completed in {cleanup_time:.4f} seconds, producing {cleanup_rows} missed rows")
+
+    logging.info(f"Memory threshold: {memory_threshold_mb:.4f} MB")
+    metrics.count('probes', probes)
+    metrics.count('cleanup matches', cleanup_rows)
+    metrics.count('flushes', flushes)
+    metrics.finish(max_days_diff=max_days_diff, memory_threshold_mb=memory_threshold_mb, num_partitions=num_partitions,
+                   flushed_bytes=flushed_bytes)
+
+    # Close the connections
+    conn1.close()
+    conn2.close()
+
+    return metrics.rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Perform a bounded-memory XJoin (pipelined hash join with disk flushing) between two SQLite databases.")
+    parser.add_argument('--db1', type=str, default='./databases/database1.db', help="Path to the first database.")
+    parser.add_argument('--db2', type=str, default='./databases/database2.db', help="Path to the second database.")
+    parser.add_argument('--invert_join', type=bool, default=False, help='Instead of db1⨝db2 perform db2⨝db1. Default=False')
+    parser.add_argument('--max_days_diff', type=int, default=10, help='Maximum allowed difference in days between timestamps for the join.')
+    parser.add_argument('--memory_threshold_mb', type=float, default=0.5, help='Resident memory in MB above which the largest partition is flushed to disk.')
+    parser.add_argument('--num_partitions', type=int, default=16, help='Number of hash partitions per input.')
+    parser.add_argument('--sink', type=str, default='csv', choices=list(SINKS), help='Where the result rows go (see sinks.py). Default=csv')
+    args = parser.parse_args()
+
+    xjoin(args.db1, args.db2, args.invert_join, args.max_days_diff, args.memory_threshold_mb, args.num_partitions, args.sink)
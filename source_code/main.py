@@ -1,6 +1,41 @@
-import subprocess
+import os
+import sys
+import gc
 import glob
-import pandas as pd
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+import statistics
+import subprocess
+import tempfile
+import multiprocessing
+from functools import partial
+
+# The joins are imported once and run in this process, instead of one interpreter per variant
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'joins'))
+
+from single_pass_hash_join import single_pass_hash_join
+from pipeline_hash_join import pipelined_hash_join
+from semi_join import semi_join
+from bloom_join import bloom_join, DEFAULT_FALSE_POSITIVE_RATE
+from grace_hash_join import grace_hash_join
+from xjoin import xjoin
+from parallel_hash_join import parallel_hash_join
+from distributed_join import distributed_join, DEFAULT_BATCH_SIZE
+from columnar_join import columnar_join, DEFAULT_PROBE_BATCH_SIZE
+from sort_merge_join import sort_merge_join
+from sql_pushdown_join import sql_pushdown_join
+from cost_based_join import cost_based_join, DEFAULT_SAMPLE_SIZE
+from incremental_join import incremental_join
+from multiway_join import multiway_join, parse_predicate
+from instrumentation import reset_peak_rss, METRICS_FILE
+
+DB1_PATH = './databases/database1.db'
+DB2_PATH = './databases/database2.db'
+MAX_DAYS_DIFF = 10
 
 # Function to execute a script
 def execute_script(script_name, *args):
@@ -11,31 +46,181 @@ def execute_script(script_name, *args):
     else:
         print(f"Executed {script_name} with args {args}")
 
-# Execute create_dbs.py first
-execute_script('databases/create_dbs.py')
+# Every join variant with the defaults of its command line; all write an order-independent digest
+# of their result instead of a CSV file
+def join_variants():
+    variants = []
+    for name, join, arguments in [
+        ('single_pass_hash_join', single_pass_hash_join, ()),
+        ('pipeline_hash_join', pipelined_hash_join, ()),
+        ('semi_join', semi_join, ()),
+        ('bloom_join', bloom_join, (DEFAULT_FALSE_POSITIVE_RATE, False)),
+        ('grace_hash_join', grace_hash_join, (0.25,)),
+        ('xjoin', xjoin, (0.5, 16)),
+        ('parallel_hash_join', parallel_hash_join, (os.cpu_count(),)),
+        ('distributed_join', distributed_join, ('all', DEFAULT_BATCH_SIZE)),
+        ('columnar_join', columnar_join, (DEFAULT_PROBE_BATCH_SIZE,)),
+        ('sort_merge_join', sort_merge_join, ()),
+        ('sql_pushdown_join', sql_pushdown_join, (True,)),
+    ]:
+        variants.append((name, partial(join, DB1_PATH, DB2_PATH, False, MAX_DAYS_DIFF, *arguments, sink='digest')))
+        variants.append((f"{name} --invert_join", partial(join, DB1_PATH, DB2_PATH, True, MAX_DAYS_DIFF, *arguments, sink='digest')))
+    variants.append(('cost_based_join', partial(cost_based_join, DB1_PATH, DB2_PATH, MAX_DAYS_DIFF, None, DEFAULT_SAMPLE_SIZE, False, sink='digest')))
+    variants.append(('incremental_join', partial(incremental_join, DB1_PATH, DB2_PATH, MAX_DAYS_DIFF, sink='digest')))
+    variants.append(('multiway_join', partial(multiway_join, [DB1_PATH, DB2_PATH], [parse_predicate('Projects.Department=Employees.Department')],
+                                              [parse_predicate('Projects.StartDate=Employees.HireDate')], MAX_DAYS_DIFF, sink='digest')))
+    return variants
+
+# Modification times of the digest files, to tell which ones a run wrote
+def digest_files():
+    return {path: os.stat(path).st_mtime_ns for path in glob.glob('*.digest.json')}
+
+# Run one join in a fresh peak RSS scope; with fork it runs in a child process forked from this
+# one, which already has every module imported, so its memory is not shared with the other runs
+def run_variant(join, fork):
+    gc.collect()
+    if not fork:
+        reset_peak_rss()
+        join()
+        return
+    process = multiprocessing.get_context('fork').Process(target=join)
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"exit code {process.exitcode}")
+
+# Run every variant back to back, checking each digest against the first as soon as it is written
+def run_suite(fork, repetitions):
+    reference = None
+    mismatches = []
+    variants = 0
+    suite_start = time.perf_counter()
+    for name, join in join_variants():
+        records = []
+        results = dict()
+        for _ in range(repetitions):
+            before = digest_files()
+            offset = os.path.getsize(METRICS_FILE) if os.path.exists(METRICS_FILE) else 0
+            try:
+                run_variant(join, fork)
+            except Exception as error:
+                print(f"Error executing {name}: {error}")
+                mismatches.append(name)
+                break
+            with open(METRICS_FILE) as file:
+                file.seek(offset)
+                records.extend(json.loads(line) for line in file if line.strip())
+            for path, mtime in digest_files().items():
+                if before.get(path) != mtime:
+                    with open(path) as file:
+                        result = json.load(file)
+                    results[path] = (result['rows'], result['digest'])
+        if not records:
+            continue
+        if reference is None and results:
+            reference = next(iter(results.values()))
+        differing = [path for path, result in results.items() if result != reference]
+        if not results:
+            status = 'no digest written'
+        elif differing:
+            status = f"differs in {', '.join(differing)}"
+        else:
+            status = 'OK'
+        if status != 'OK':
+            mismatches.append(name)
+        median_seconds = statistics.median(record['total_seconds'] for record in records)
+        peak_rss_bytes = max(record['peak_rss_bytes'] for record in records)
+        print(f"{name:<40} {median_seconds:8.4f} s  {peak_rss_bytes / (1024*1024):8.2f} MB  {status}")
+        variants += 1
+    print(f"Ran {variants} variants in {time.perf_counter() - suite_start:.2f} seconds")
+    return variants, reference, mismatches
+
+# Duplicate every tenth row of the table of a database under new rowids, as an append
+def append_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    table_name = conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchone()[0]
+    # The first column is the INTEGER PRIMARY KEY, which assigns the new rowids
+    columns = ', '.join([row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")][1:])
+    appended = conn.execute(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {table_name} WHERE rowid % 10 = 0").rowcount
+    conn.commit()
+    conn.close()
+    return appended
+
+# Move every tenth of the first rows of the table of a database to the Department of its first row,
+# as an in-place update below the incremental join's high-water mark
+def update_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    table_name = conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchone()[0]
+    updated = conn.execute(f"UPDATE {table_name} SET Department = (SELECT Department FROM {table_name} WHERE rowid = 1) "
+                           f"WHERE rowid % 10 = 1 AND rowid <= 5000").rowcount
+    conn.commit()
+    conn.close()
+    return updated
+
+def read_digest(path):
+    with open(path) as file:
+        result = json.load(file)
+    return result['rows'], result['digest']
+
+# Run the incremental join and a full join, in the current directory, and return both results
+def incremental_and_full(db1_path, db2_path, state_file):
+    incremental_join(db1_path, db2_path, MAX_DAYS_DIFF, state_file, sink='digest')
+    single_pass_hash_join(db1_path, db2_path, False, MAX_DAYS_DIFF, sink='digest')
+    return read_digest('incremental_join.digest.json'), read_digest(glob.glob('single_pass_hash_join_*.digest.json')[0])
 
-# Execute the other scripts in the specified order
-execute_script('joins/single_pass_hash_join.py')
-execute_script('joins/single_pass_hash_join.py', '--invert_join=True')
-execute_script('joins/pipeline_hash_join.py')
-execute_script('joins/pipeline_hash_join.py', '--invert_join=True')
-execute_script('joins/semi_join.py')
-execute_script('joins/semi_join.py', '--invert_join=True')
+# Check the incremental join against a full join on copies of the databases: after rows are appended
+# and it is extended by a normal run; after a run that appended its rows but did not save its state, as
+# when it is interrupted between the two; and after rows below its high-water mark are updated in place.
+# Returns the names of the checks that failed.
+def check_incremental():
+    checks = []
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        db1_path = shutil.copy(DB1_PATH, directory)
+        db2_path = shutil.copy(DB2_PATH, directory)
+        os.chdir(directory)
+        try:
+            state_file = 'incremental_join_state.pkl'
+            incremental_join(db1_path, db2_path, MAX_DAYS_DIFF, state_file, sink='digest')
+            shutil.copy(state_file, 'previous_state.pkl')
+            appended = append_rows(db1_path) + append_rows(db2_path)
+            checks.append(('incremental_join after appends', f"{appended} rows appended",
+                           *incremental_and_full(db1_path, db2_path, state_file)))
+            os.replace('previous_state.pkl', state_file)
+            checks.append(('incremental_join after an interrupted run', f"{appended} rows appended",
+                           *incremental_and_full(db1_path, db2_path, state_file)))
+            updated = update_rows(db2_path)
+            checks.append(('incremental_join after in-place updates', f"{updated} rows updated",
+                           *incremental_and_full(db1_path, db2_path, state_file)))
+        finally:
+            os.chdir(working_directory)
+    failed = []
+    for name, change, result, full in checks:
+        status = 'OK' if result == full else f"{result[0]} rows instead of {full[0]}, or another digest"
+        if status != 'OK':
+            failed.append(name)
+        print(f"{name:<48} {change}, {result[0]} rows  {status}")
+    return failed
 
-# Function to read and normalize CSV files
-def read_and_normalize_csv(filepath):
-    df = pd.read_csv(filepath)
-    df = df.reindex(sorted(df.columns), axis=1)  # Sort the columns
-    return df.sort_values(by=df.columns.tolist()).reset_index(drop=True)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create the databases and run every join variant, checking that all produce the same rows.")
+    parser.add_argument('--fork', action='store_true', help='Run each variant in a forked child process, so its peak RSS is not shared with the other runs.')
+    parser.add_argument('--repetitions', type=int, default=1, help='Runs per variant; the median time is reported.')
+    args = parser.parse_args()
 
+    # Execute create_dbs.py first
+    execute_script('databases/create_dbs.py')
 
-# Find all CSV files in the current directory
-csv_files = glob.glob('*.csv')
+    # The joins' own basicConfig calls are no-ops once the root logger has a handler, so every run
+    # logs to the same results.log handler instead of adding one per run; only this summary is printed
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
+        logging.FileHandler('results.log', mode='a')
+    ])
 
-# Read and normalize all CSV files
-dataframes = [read_and_normalize_csv(file) for file in csv_files]
+    variants, reference, mismatches = run_suite(args.fork, args.repetitions)
+    mismatches += check_incremental()
 
-# Check if all dataframes are equal
-assert all(df.equals(dataframes[0]) for df in dataframes), "CSV files contain different data"
+    # Check if all results are equal
+    assert not mismatches, f"Results differ or are missing: {mismatches}"
 
-print("All CSV files contain the same data.")
+    print(f"All {variants} variants produced the same {reference[0]} rows.")